@@ -10,3 +10,6 @@ python manage.py collectstatic --no-input
 
 # Apply database migrations
 python manage.py migrate
+
+# Cache table (no-op unless CACHE_BACKEND is the database cache)
+python manage.py createcachetable
@@ -2,6 +2,8 @@
 ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is the production entry point (see Procfile): the live event stream at
+/api/events/ holds one coroutine per open dashboard, which WSGI cannot do.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
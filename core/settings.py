@@ -6,6 +6,7 @@ Django settings for this project (development copy).
 from pathlib import Path
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "queue_backend.api.middleware.MetricsMiddleware",  # first, so its timing covers the rest
+    "queue_backend.api.middleware.ReplicaPinMiddleware",  # only active with DATABASE_REPLICA_URLS
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  # Added for Render static files
@@ -50,6 +53,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "queue_backend.api.middleware.ProfilingMiddleware",  # staff requests with X-Profile / ?_profile=1
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -60,6 +64,10 @@ CORS_ALLOWED_ORIGINS = [
 # For easier local development you can allow all (not recommended for prod)
 # CORS_ALLOW_ALL_ORIGINS = True
 
+# conditional GETs: let the frontend send If-None-Match and read the ETag
+CORS_ALLOW_HEADERS = (*default_headers, "if-none-match")
+CORS_EXPOSE_HEADERS = ["ETag"]
+
 
 
 
@@ -91,6 +99,38 @@ DATABASES = {
     )
 }
 
+# Read replicas: comma-separated URLs in DATABASE_REPLICA_URLS become aliases
+# replica1, replica2, ... and request reads go to them (queue_backend/api/routers.py).
+# To try it locally with SQLite: `cp db.sqlite3 replica.sqlite3` and run with
+# DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3 (the copy is a frozen "replica").
+REPLICA_DATABASES = []
+for _url in filter(None, (u.strip() for u in os.environ.get("DATABASE_REPLICA_URLS", "").split(","))):
+    _alias = f"replica{len(REPLICA_DATABASES) + 1}"
+    DATABASES[_alias] = {**dj_database_url.parse(_url, conn_max_age=0), "TEST": {"MIRROR": "default"}}
+    REPLICA_DATABASES.append(_alias)
+if REPLICA_DATABASES:
+    DATABASE_ROUTERS = ["queue_backend.api.routers.ReplicaRouter"]
+# seconds a client reads the primary after writing; seconds an unreachable replica is skipped
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 5))
+REPLICA_RETRY_SECONDS = int(os.environ.get("REPLICA_RETRY_SECONDS", 30))
+
+# Cache - shared queue snapshots and their hit/miss counters.
+# Locmem is per process; for several gunicorn workers point CACHE_BACKEND at
+# django.core.cache.backends.db.DatabaseCache (LOCATION = table name, created by
+# `manage.py createcachetable`) or filebased.FileBasedCache (LOCATION = dir).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'queue-manager'),
+    }
+}
+# caches whose invalidations must reach every worker (API keys, the directory)
+# are only turned on when the backend is shared across processes
+CACHE_SHARED = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
 # Default auth user (explicit)
 AUTH_USER_MODEL = 'auth.User'
 
@@ -134,11 +174,65 @@ CORS_ALLOWED_ORIGINS = [
 # DRF basic config (optional; expand later)
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "queue_backend.api.authentication.TokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
 }
 
+# seconds a key -> user lookup stays cached; key lifetime in seconds (0 = keys never expire).
+# Revoking a key only clears the cache it is written to, so with a per-process
+# cache (locmem) other workers would keep accepting it: lookups are not cached there.
+# Opt in by pointing CACHE_BACKEND at a shared backend (see above); every
+# authenticated request then skips its key query (`manage.py bench_token_auth`).
+AUTH_TOKEN_CACHE_SECONDS = int(os.environ.get("AUTH_TOKEN_CACHE_SECONDS", 60)) if CACHE_SHARED else 0
+AUTH_TOKEN_TTL = int(os.environ.get("AUTH_TOKEN_TTL", 0))
+
+# provider/service directory (see queue_backend/api/directory.py): seconds its
+# responses stay in the default cache (0 = no caching), and the max-age sent to
+# browsers and CDNs, which revalidate with the ETag afterwards. A write only
+# drops the cached version in the cache it is written to, so like the key
+# lookups this is off unless the cache is shared between workers.
+DIRECTORY_CACHE_SECONDS = int(os.environ.get("DIRECTORY_CACHE_SECONDS", 300)) if CACHE_SHARED else 0
+DIRECTORY_MAX_AGE = int(os.environ.get("DIRECTORY_MAX_AGE", 60))
+
+# login/register limits (see queue_backend/api/throttles.py): token buckets per
+# client IP and per username in the default cache, as "<attempts>/<s|min|hour|day>";
+# remove a key to disable that bucket. Without a shared cache each worker has its
+# own buckets, so the effective limit is the rate times the number of workers.
+# PASSWORD_HASH_CONCURRENCY caps the password hashes one worker runs at once
+# (0 = no cap); a request waits up to PASSWORD_HASH_WAIT seconds for a slot
+# before getting a 503.
+AUTH_THROTTLE_RATES = {
+    "login-ip": os.environ.get("THROTTLE_LOGIN_IP", "30/min"),
+    "login-username": os.environ.get("THROTTLE_LOGIN_USERNAME", "10/min"),
+    "register-ip": os.environ.get("THROTTLE_REGISTER_IP", "10/min"),
+    "register-username": os.environ.get("THROTTLE_REGISTER_USERNAME", "5/min"),
+}
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get("PASSWORD_HASH_CONCURRENCY", 2))
+PASSWORD_HASH_WAIT = float(os.environ.get("PASSWORD_HASH_WAIT", 0.5))
+
+# default page size for the cursor-paginated token/notification lists
+API_PAGE_SIZE = int(os.environ.get("API_PAGE_SIZE", 50))
+
+# retention windows in days for `manage.py apply_retention` (0 disables a policy)
+RETENTION_POLICIES = {
+    "read_notifications": int(os.environ.get("RETENTION_READ_NOTIFICATIONS_DAYS", 30)),
+    "notifications": int(os.environ.get("RETENTION_NOTIFICATIONS_DAYS", 180)),
+    "auth_tokens": int(os.environ.get("RETENTION_AUTH_TOKENS_DAYS", 90)),
+}
+
+# per-view request metrics served at /api/metrics (see queue_backend/api/metrics.py).
+# Each worker writes its totals to METRICS_DIR every METRICS_FLUSH_INTERVAL
+# seconds; scrapers authenticate as a staff user or with "Bearer <METRICS_TOKEN>".
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_DIR = os.environ.get("METRICS_DIR", "/tmp/queue-manager-metrics")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# on-demand request profiles (see ProfilingMiddleware); the newest PROFILE_KEEP are kept
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "1") == "1"
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 200))
+
 # ------------------- END: overwrite core/settings.py -------------------
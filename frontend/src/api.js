@@ -1,5 +1,10 @@
 // frontend/src/api.js
 const API_BASE = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000/api";
+
+// Last ETag + body per GET path; polls revalidate with If-None-Match and reuse
+// the body on 304 Not Modified.
+const etagCache = new Map();
+
 async function request(path, opts = {}) {
   const headers = new Headers(opts.headers || {});
   if (!headers.has("Content-Type") && !(opts.body instanceof FormData)) {
@@ -8,7 +13,15 @@ async function request(path, opts = {}) {
   const token = localStorage.getItem("token");
   if (token && opts.auth !== false) headers.set("Authorization", `Token ${token}`);
 
-  const res = await fetch(`${API_BASE}${path}`, { ...opts, headers });
+  const isGet = !opts.method || opts.method === "GET";
+  const cacheKey = `${token || ""} ${path}`;
+  const cached = isGet ? etagCache.get(cacheKey) : null;
+  if (cached) headers.set("If-None-Match", cached.etag);
+
+  // cursor "next" links come back as absolute URLs
+  const url = /^https?:/.test(path) ? path : `${API_BASE}${path}`;
+  const res = await fetch(url, { ...opts, headers });
+  if (res.status === 304 && cached) return cached.data;
   const text = await res.text();
   let data;
   try { data = text ? JSON.parse(text) : null; } catch (e) { data = text; }
@@ -27,6 +40,8 @@ async function request(path, opts = {}) {
     err.body = data;
     throw err;
   }
+  const etag = res.headers.get("ETag");
+  if (isGet && etag) etagCache.set(cacheKey, { etag, data });
   return data;
 }
 
@@ -84,9 +99,20 @@ export async function updateService(id, data) {
   });
 }
 
+// Per-service queue state for delta polling: { version, tokens: Map(id -> token) }
+const queueCache = new Map();
+
+const byQueueOrder = (a, b) =>
+  (a.appointment_time || "").localeCompare(b.appointment_time || "") || a.token_number - b.token_number;
+
 export async function fetchTokensByService(serviceId) {
-  // backend expects query param ?service=ID
-  return request(`/tokens-by-service/?service=${serviceId}`);
+  // backend expects query param ?service=ID; ?since=VERSION returns only what changed
+  const cached = queueCache.get(serviceId);
+  const data = await request(`/tokens-by-service/?service=${serviceId}&since=${cached ? cached.version : 0}`);
+  const tokens = data.full || !cached ? new Map() : cached.tokens;
+  data.tokens.forEach((t) => tokens.set(t.id, t));
+  queueCache.set(serviceId, { version: data.version, tokens });
+  return [...tokens.values()].sort(byQueueOrder);
 }
 
 export async function updateTokenStatus(id, status) {
@@ -96,6 +122,15 @@ export async function updateTokenStatus(id, status) {
   });
 }
 
+// Atomically closes the service's calling token as `previous` and calls the
+// next waiting one; resolves to {version, called, tokens} (changed tokens only).
+export async function callNext(serviceId, previous = "completed") {
+  return request(`/services/${serviceId}/call-next/`, {
+    method: "POST",
+    body: JSON.stringify({ previous }),
+  });
+}
+
 export const createToken = async (serviceId, visitorName, appointmentTime, appointmentDate) => {
   const data = { service: serviceId, visitor_name: visitorName };
   if (appointmentTime) data.appointment_time = appointmentTime;
@@ -143,8 +178,20 @@ export const fetchMyService = async () => {
   return request("/service-staff/?me=true");
 };
 
-export const fetchMyTokens = async () => {
-  return request("/tokens/?user=me");
+// Follow cursor-paginated list endpoints until `limit` rows or the last page.
+async function fetchPages(path, limit) {
+  const rows = [];
+  let next = path;
+  while (next && rows.length < limit) {
+    const page = await request(next);
+    rows.push(...page.results);
+    next = page.next;
+  }
+  return rows.slice(0, limit);
+}
+
+export const fetchMyTokens = async (limit = 100) => {
+  return fetchPages("/tokens/?user=me", limit);
 };
 export const cancelAllTokens = async (serviceId, remarks) => {
   return request("/cancel-all-tokens/", {
@@ -153,8 +200,13 @@ export const cancelAllTokens = async (serviceId, remarks) => {
   });
 };
 
-export const fetchNotifications = async () => {
-  return request("/notifications/");
+export const fetchNotifications = async (limit = 100) => {
+  return fetchPages("/notifications/", limit);
+};
+
+// {unread, latest}: poll this and refetch the list only when it changes
+export const fetchNotificationBadge = async () => {
+  return request("/notifications/badge/");
 };
 
 export const markNotificationRead = async (id) => {
@@ -169,3 +221,19 @@ export const clearNotifications = async () => {
     method: "DELETE"
   });
 };
+
+// Live updates over Server-Sent Events (replaces tight polling).
+// onQueue fires when a watched service's queue changes, onNotification when the
+// logged-in user gets a new notification. Returns a function that closes the stream.
+export function subscribeLive({ services = [], onQueue, onNotification } = {}) {
+  const params = new URLSearchParams();
+  services.filter(Boolean).forEach((id) => params.append("service", id));
+  const token = localStorage.getItem("token");
+  if (token) params.set("token", token);
+  if (![...params.keys()].length) return () => {};
+
+  const source = new EventSource(`${API_BASE}/events/?${params}`);
+  if (onQueue) source.addEventListener("queue", (e) => onQueue(JSON.parse(e.data)));
+  if (onNotification) source.addEventListener("notification", (e) => onNotification(JSON.parse(e.data)));
+  return () => source.close();
+}
@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useRef } from "react";
-import { fetchServices, fetchTokensByService, updateTokenStatus, fetchProviders, apiPost, apiDelete, fetchAllAssignments, updateService, updateProvider } from "../api";
+import { fetchServices, fetchTokensByService, updateTokenStatus, fetchProviders, apiPost, apiDelete, fetchAllAssignments, updateService, updateProvider, subscribeLive } from "../api";
 import { LayoutDashboard, Building2, Stethoscope, Users, Plus, Trash2, Edit, CheckCircle, Clock, AlertCircle, Search, Zap, ArrowRight, ShieldCheck, UserPlus, Eye, EyeOff, MapPin, Unplug, ClipboardList } from "lucide-react";
 
 export default function AdminDashboard() {
@@ -135,8 +135,9 @@ function QueueTab({ setMessage }) {
       return;
     }
     loadQueue();
-    pollingRef.current = setInterval(loadQueue, 5000);
-    return () => clearInterval(pollingRef.current);
+    const unsubscribe = subscribeLive({ services: [selectedService], onQueue: loadQueue });
+    pollingRef.current = setInterval(loadQueue, 60000); // safety net if the live stream drops
+    return () => { unsubscribe(); clearInterval(pollingRef.current); };
   }, [selectedService]);
 
   return (
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from "react";
-import { fetchProviders, fetchServices, fetchTokensByService, updateTokenStatus, cancelAllTokens, fetchNotifications, markNotificationRead, clearNotifications } from "../api";
+import { fetchProviders, fetchServices, fetchTokensByService, updateTokenStatus, callNext, cancelAllTokens, fetchNotifications, fetchNotificationBadge, markNotificationRead, clearNotifications, subscribeLive } from "../api";
 import { Users, Clock, CheckCircle, XCircle, Play, SkipForward, AlertCircle, LayoutDashboard, Building2, Zap, ArrowRight, BellRing, FileText, X, Download, Ban } from "lucide-react";
 import HospitalDirectory from "../components/HospitalDirectory";
 import jsPDF from "jspdf";
@@ -24,6 +24,7 @@ export default function ProviderDashboard() {
     const [toasts, setToasts] = useState([]);
     const seenIds = React.useRef(new Set());
     const isFirstLoad = React.useRef(true);
+    const lastBadge = React.useRef(null);
 
     const addToast = (msg) => {
         const id = Date.now();
@@ -59,6 +60,11 @@ export default function ProviderDashboard() {
     useEffect(() => {
         const loadNotifs = async () => {
             try {
+                // the badge is a couple of indexed lookups; skip the list when it hasn't moved
+                const badge = await fetchNotificationBadge();
+                const badgeKey = `${badge.unread}:${badge.latest}`;
+                if (badgeKey === lastBadge.current) return;
+                lastBadge.current = badgeKey;
                 const data = await fetchNotifications();
                 const currentList = Array.isArray(data) ? data : [];
                 setNotifications(currentList);
@@ -75,8 +81,9 @@ export default function ProviderDashboard() {
             } catch { }
         };
         loadNotifs();
-        const interval = setInterval(loadNotifs, 10000);
-        return () => clearInterval(interval);
+        const unsubscribe = subscribeLive({ onNotification: loadNotifs });
+        const interval = setInterval(loadNotifs, 60000); // safety net if the live stream drops
+        return () => { unsubscribe(); clearInterval(interval); };
     }, []);
 
     useEffect(() => {
@@ -115,8 +122,9 @@ export default function ProviderDashboard() {
                 .catch(console.error);
         };
         loadTokens();
-        const interval = setInterval(loadTokens, 5000);
-        return () => clearInterval(interval);
+        const unsubscribe = subscribeLive({ services: [selectedService.id], onQueue: loadTokens });
+        const interval = setInterval(loadTokens, 60000);
+        return () => { unsubscribe(); clearInterval(interval); };
     }, [selectedService]);
 
     const handleStatusUpdate = async (tokenId, newStatus) => {
@@ -129,6 +137,16 @@ export default function ProviderDashboard() {
         }
     };
 
+    const handleCallNext = async () => {
+        try {
+            await callNext(selectedService.id);
+            const updated = await fetchTokensByService(selectedService.id);
+            setTokens(updated);
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
     const handleEmergencyCancel = async () => {
         if (!cancelReason) return alert("Please provide a reason.");
         if (!window.confirm("Are you sure you want to cancel ALL waiting tokens? This action cannot be undone.")) return;
@@ -522,7 +540,7 @@ export default function ProviderDashboard() {
 
                                                 {waitingTokens.length > 0 && (
                                                     <button
-                                                        onClick={() => handleStatusUpdate(waitingTokens[0].id, "calling")}
+                                                        onClick={handleCallNext}
                                                         className="btn-primary mt-8 scale-110 !px-12 flex flex-col items-center gap-1 mx-auto py-4"
                                                     >
                                                         <div className="flex items-center gap-2">
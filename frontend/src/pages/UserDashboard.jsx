@@ -1,5 +1,5 @@
 import React, { useEffect, useState, useRef } from "react";
-import { fetchProviders, fetchServices, fetchTokensByService, createToken, fetchMyTokens, apiDelete, fetchNotifications, markNotificationRead, clearNotifications } from "../api";
+import { fetchProviders, fetchServices, fetchTokensByService, createToken, fetchMyTokens, apiDelete, fetchNotifications, fetchNotificationBadge, markNotificationRead, clearNotifications, subscribeLive } from "../api";
 import { Building2, Stethoscope, User, Ticket, Clock, CheckCircle, AlertCircle, Calendar, ChevronRight, Search, Zap, BellRing, Trash2, X } from "lucide-react";
 
 // --- Components ---
@@ -95,6 +95,7 @@ export default function UserDashboard() {
   const [toasts, setToasts] = useState([]);
   const seenIds = useRef(new Set());
   const isFirstLoad = useRef(true);
+  const lastBadge = useRef(null);
 
   const addToast = (msg) => {
     const id = Date.now();
@@ -139,6 +140,11 @@ export default function UserDashboard() {
 
     const loadNotifs = async () => {
       try {
+        // the badge is a couple of indexed lookups; skip the list when it hasn't moved
+        const badge = await fetchNotificationBadge();
+        const badgeKey = `${badge.unread}:${badge.latest}`;
+        if (badgeKey === lastBadge.current) return;
+        lastBadge.current = badgeKey;
         const data = await fetchNotifications();
         const currentList = Array.isArray(data) ? data : [];
         setNotifications(currentList);
@@ -187,8 +193,9 @@ export default function UserDashboard() {
       } catch { }
     };
     loadNotifs();
-    const interval = setInterval(loadNotifs, 5000); // Poll every 5s for faster updates
-    return () => clearInterval(interval);
+    const unsubscribe = subscribeLive({ onNotification: loadNotifs });
+    const interval = setInterval(loadNotifs, 60000); // safety net if the live stream drops
+    return () => { unsubscribe(); clearInterval(interval); };
   }, []);
 
   const loadMyTokens = async () => {
@@ -251,8 +258,9 @@ export default function UserDashboard() {
   useEffect(() => {
     if (!selectedService) return;
     loadQueue();
-    const id = setInterval(loadQueue, 5000);
-    return () => clearInterval(id);
+    const unsubscribe = subscribeLive({ services: [selectedService], onQueue: loadQueue });
+    const id = setInterval(loadQueue, 60000);
+    return () => { unsubscribe(); clearInterval(id); };
   }, [selectedService]);
 
   const handleClearAll = async () => {
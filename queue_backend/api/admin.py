@@ -1,6 +1,6 @@
 # queue_backend/api/admin.py
 from django.contrib import admin
-from .models import Service, Token, AuditLog, Provider, UserProfile, ServiceStaff
+from .models import Service, Token, AuditLog, Provider, UserProfile, ServiceStaff, Job, RequestProfile
 
 @admin.register(Provider)
 class ProviderAdmin(admin.ModelAdmin):
@@ -39,3 +39,22 @@ class ServiceStaffAdmin(admin.ModelAdmin):
     list_display = ("user", "service", "created_at")
     list_filter = ("service",)
     search_fields = ("user__username", "service__name")
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "attempts", "run_after", "created_at")
+    list_filter = ("status", "kind")
+    readonly_fields = ("created_at", "locked_at", "last_error")
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ("id", "method", "path", "status", "duration", "query_count", "user", "created_at")
+    list_filter = ("method", "view")
+    search_fields = ("path", "view")
+    exclude = ("stats",)  # binary; download it from /api/profiles/<id>/pstats/
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
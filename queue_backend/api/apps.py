@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'queue_backend.api'
+
+    def ready(self):
+        # register background job handlers and auth cache invalidation
+        from . import authentication, notifications  # noqa: F401
@@ -0,0 +1,73 @@
+# queue_backend/api/authentication.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token as AuthToken
+
+from . import routers
+from .models import AuthTokenUsage
+
+
+def cache_key(key):
+    return f"auth-token:{key}"
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """
+    DRF token authentication that keeps the key -> token + user lookup in the
+    cache for AUTH_TOKEN_CACHE_SECONDS, so polling clients skip the
+    authtoken/auth_user join. Entries are dropped when the key is deleted or
+    its user saved (e.g. deactivated), see the receivers below; bulk
+    ``QuerySet.update()`` on users bypasses them and waits out the TTL. The
+    setting is 0 (no caching) unless the cache backend is shared by all
+    workers, since a per-process cache would only forget the key in one.
+
+    Keys older than AUTH_TOKEN_TTL seconds are refused when it is set, and
+    use of a key is noted at most once a day (see AuthTokenUsage).
+    """
+    def authenticate_credentials(self, key):
+        token = cache.get(cache_key(key)) if settings.AUTH_TOKEN_CACHE_SECONDS else None
+        if token is None:
+            try:
+                _, token = super().authenticate_credentials(key)
+            except exceptions.AuthenticationFailed:
+                # a key issued moments ago may not have reached the replica yet
+                if not routers.reading_replica():
+                    raise
+                with routers.primary():
+                    _, token = super().authenticate_credentials(key)
+            if settings.AUTH_TOKEN_CACHE_SECONDS:
+                cache.set(cache_key(key), token, settings.AUTH_TOKEN_CACHE_SECONDS)
+
+        if expired(token):
+            raise exceptions.AuthenticationFailed("Token has expired.")
+        AuthTokenUsage.touch(token.key)
+        return token.user, token
+
+
+def expired(token):
+    return bool(settings.AUTH_TOKEN_TTL) and token.created < timezone.now() - timedelta(seconds=settings.AUTH_TOKEN_TTL)
+
+
+def forget(*keys):
+    # after commit, so a racing request cannot re-cache the old row
+    keys = [cache_key(key) for key in keys]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_delete, sender=AuthToken)
+def forget_deleted_key(sender, instance, **kwargs):
+    forget(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def forget_user_keys(sender, instance, created, **kwargs):
+    if not created:
+        forget(*AuthToken.objects.filter(user_id=instance.pk).values_list("key", flat=True))
@@ -0,0 +1,69 @@
+# queue_backend/api/directory.py
+"""
+Shared cache of the provider and service directory.
+
+The directory (ResourceVersion.DIRECTORY) changes a few times a day but is
+read on every dashboard load, so its version number and the serialized
+list/retrieve responses are kept in the Django cache. Response entries are
+keyed by the version they were built at, so a write only has to drop the
+cached version number; old entries are never read again and expire. A
+version cached by a read racing a write can outlive the write by at most
+DIRECTORY_CACHE_SECONDS. Setting it to 0 turns the cache off.
+
+The drop only reaches the cache the writer uses, so every worker must share
+one backend (database, file or memcached); with a per-process cache such as
+locmem, other workers would serve the old directory until the entry expired.
+settings.DIRECTORY_CACHE_SECONDS is therefore 0 unless CACHE_SHARED.
+
+Entries are built from the primary so a lagging read replica cannot park old
+rows under a new version.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import routers
+from .models import ResourceVersion
+
+VERSION_KEY = "directory:version"
+
+
+def version():
+    if not settings.DIRECTORY_CACHE_SECONDS:
+        return ResourceVersion.current(ResourceVersion.DIRECTORY)
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        with routers.primary():
+            current = ResourceVersion.current(ResourceVersion.DIRECTORY)
+        # add, not set: never overwrite a number a writer has just dropped
+        cache.add(VERSION_KEY, current, settings.DIRECTORY_CACHE_SECONDS)
+    return current
+
+
+def bump():
+    ResourceVersion.bump(ResourceVersion.DIRECTORY)
+    # drop it now for this process' next read, and again on commit in case
+    # another request cached the old number in between
+    cache.delete(VERSION_KEY)
+    transaction.on_commit(lambda: cache.delete(VERSION_KEY))
+
+
+def get_or_build(kind, pk, query, build):
+    """
+    Return the cached response data for ``kind`` (list or one ``pk``) under
+    query string ``query``, calling ``build()`` on a miss. ``build`` returns
+    None for responses that must not be cached (errors).
+    """
+    if not settings.DIRECTORY_CACHE_SECONDS:
+        return build()
+    digest = hashlib.sha256(query.encode()).hexdigest()[:32]
+    key = f"directory:{kind}:{version()}:{pk}:{digest}"
+    data = cache.get(key)
+    if data is None:
+        with routers.primary():
+            data = build()
+        if data is not None:
+            cache.set(key, data, settings.DIRECTORY_CACHE_SECONDS)
+    return data
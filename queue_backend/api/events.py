@@ -0,0 +1,196 @@
+# queue_backend/api/events.py
+"""
+Live change feed behind GET /api/events/ (Server-Sent Events).
+
+Write paths append QueueEvent rows in their own transaction. Every ASGI worker
+runs one poller that reads new rows and fans them out to the streams connected
+to that worker, so the database sees a single small query per worker per
+interval no matter how many dashboards are open, and a change made in any
+process (WSGI or ASGI) reaches every subscriber.
+
+Rows are inserted inside request transactions, so a lower id can commit after
+a higher one the poller has already passed. Ids the poller skips over are
+re-read for GAP_WAIT seconds, and delivered when their transaction commits.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import QueueEvent
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0         # seconds between feed reads while anyone is subscribed
+HEARTBEAT_INTERVAL = 15.0   # keep-alive comment so proxies don't drop idle streams
+RECONNECT_MS = 3000         # client retry hint
+QUEUE_SIZE = 100            # per-stream backlog before events are dropped
+BATCH_SIZE = 500
+RETENTION = timedelta(minutes=10)
+PRUNE_EVERY = 60            # polls between pruning old rows
+GAP_WAIT = 30.0             # seconds a skipped id is re-read in case its transaction commits late
+MAX_GAPS = 1000             # skipped ids watched per jump; larger jumps are sequence gaps, not writers
+
+
+def service_channel(service_id):
+    return f"service:{service_id}"
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+# -------------------------
+# Publishing (sync, from views)
+# -------------------------
+def emit_queue_change(service_id, appointment_date, tokens):
+    """
+    Record that tokens of one service-day were created or changed state.
+    """
+    tokens = list(tokens)
+    if not tokens:
+        return
+    QueueEvent.objects.create(
+        channel=service_channel(service_id),
+        kind="queue",
+        payload={
+            "service": service_id,
+            "date": appointment_date.isoformat() if appointment_date else None,
+            "tokens": [{"id": t.id, "token_number": t.token_number, "status": t.status} for t in tokens],
+        },
+    )
+
+
+def emit_notifications(notifications):
+    """
+    Record new notifications so each recipient's stream is told to refresh.
+    """
+    QueueEvent.objects.bulk_create([
+        QueueEvent(channel=user_channel(n.user_id), kind="notification", payload={"id": n.id})
+        for n in notifications
+    ])
+
+
+def format_event(event):
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(event.payload)}\n\n"
+
+
+# -------------------------
+# Fan-out (async, per worker)
+# -------------------------
+def _latest_event_id():
+    return QueueEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def _events_after(last_id, channels=None, gaps=()):
+    events = QueueEvent.objects.filter(Q(id__gt=last_id) | Q(id__in=gaps)) if gaps else \
+        QueueEvent.objects.filter(id__gt=last_id)
+    if channels is not None:
+        events = events.filter(channel__in=channels)
+    return list(events.order_by("id")[:BATCH_SIZE])
+
+
+def _prune():
+    QueueEvent.objects.filter(created_at__lt=timezone.now() - RETENTION).delete()
+
+
+class Broker:
+    """
+    Per-process registry of open streams and the poller that feeds them.
+    The poller starts with the first subscriber and stops with the last.
+    """
+    def __init__(self):
+        self.streams = defaultdict(set)
+        self.last_id = None
+        self.gaps = {}  # skipped id -> time.monotonic() until which it is re-read
+        self._task = None
+
+    @property
+    def subscriber_count(self):
+        return len({q for subs in self.streams.values() for q in subs})
+
+    async def subscribe(self, channels):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        for channel in channels:
+            self.streams[channel].add(queue)
+        if self._task is None or self._task.done() or self._task.get_loop() is not asyncio.get_running_loop():
+            self._task = asyncio.create_task(self._poll())
+        return queue
+
+    def unsubscribe(self, queue, channels):
+        for channel in channels:
+            subs = self.streams.get(channel)
+            if subs is None:
+                continue
+            subs.discard(queue)
+            if not subs:
+                del self.streams[channel]
+
+    def dispatch(self, event):
+        for queue in self.streams.get(event.channel, ()):
+            if not queue.full():
+                # a stalled client just misses events; the next one makes it refetch
+                queue.put_nowait(event)
+
+    def advance(self, event_id):
+        """Move the cursor past ``event_id``, watching any ids it skips."""
+        if self.gaps.pop(event_id, None) is None and event_id > self.last_id:
+            first = max(self.last_id + 1, event_id - MAX_GAPS)
+            self.gaps.update(dict.fromkeys(range(first, event_id), time.monotonic() + GAP_WAIT))
+            self.last_id = event_id
+
+    async def _poll(self):
+        self.last_id = await sync_to_async(_latest_event_id)()
+        self.gaps = {}
+        polls = 0
+        while self.streams:
+            events = []
+            try:
+                events = await sync_to_async(_events_after)(self.last_id, gaps=list(self.gaps))
+                for event in events:
+                    self.advance(event.id)
+                    self.dispatch(event)
+                now = time.monotonic()
+                self.gaps = {gap: until for gap, until in self.gaps.items() if until > now}
+                polls += 1
+                if polls % PRUNE_EVERY == 0:
+                    await sync_to_async(_prune)()
+            except Exception:
+                # keep streams open through a DB blip; the next poll catches up
+                logger.exception("Event feed poll failed")
+            if len(events) < BATCH_SIZE:
+                await asyncio.sleep(POLL_INTERVAL)
+
+
+broker = Broker()
+
+
+async def stream(channels, last_event_id=None):
+    """
+    Async generator of SSE frames for the given channels. Events missed since
+    ``last_event_id`` (the browser sends it on reconnect) are replayed first.
+    """
+    queue = await broker.subscribe(channels)
+    try:
+        yield f"retry: {RECONNECT_MS}\n\n"
+        replayed = set()
+        if last_event_id is not None:
+            for event in await sync_to_async(_events_after)(last_event_id, channels):
+                replayed.add(event.id)
+                yield format_event(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event.id not in replayed:
+                yield format_event(event)
+    finally:
+        broker.unsubscribe(queue, channels)
@@ -0,0 +1,125 @@
+# queue_backend/api/jobs.py
+"""
+Background jobs backed by the Job table.
+
+enqueue() inserts a row in the caller's transaction, so a job exists exactly
+when the change that caused it commits (an outbox). `manage.py run_jobs`
+claims due rows in batches, runs their handlers on a thread pool and deletes
+them when they succeed. A failing job is retried with exponential backoff
+and left as "failed" after MAX_ATTEMPTS. Delivery is at-least-once: a worker
+that dies mid-batch has its jobs reclaimed after LEASE.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2        # seconds before the first retry, doubled each attempt
+BACKOFF_MAX = 600
+LEASE = timedelta(minutes=5)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """
+    Register ``func(payload)`` as the handler for jobs of ``kind``.
+    """
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload, delay=None):
+    return Job.objects.create(kind=kind, payload=payload, run_after=timezone.now() + (delay or timedelta()))
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+
+def claim(batch_size=BATCH_SIZE):
+    """
+    Lock up to ``batch_size`` due jobs, mark them running and return them.
+    Concurrent workers skip rows another worker has locked.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = Job.objects.filter(
+            Q(status=Job.PENDING, run_after__lte=now) | Q(status=Job.RUNNING, locked_at__lt=now - LEASE)
+        ).order_by("run_after", "id")
+        due = due.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+        claimed = list(due[:batch_size])
+        if claimed:
+            Job.objects.filter(pk__in=[job.pk for job in claimed]).update(
+                status=Job.RUNNING, locked_at=now, attempts=F("attempts") + 1)
+    for job in claimed:
+        job.status, job.locked_at, job.attempts = Job.RUNNING, now, job.attempts + 1
+    return claimed
+
+
+def execute(job):
+    """
+    Run one job's handler; returns None on success or the error text.
+    """
+    try:
+        func = HANDLERS.get(job.kind)
+        if func is None:
+            raise LookupError(f"No handler registered for job kind {job.kind!r}")
+        func(job.payload)
+        return None
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.id, job.kind)
+        if connection.errors_occurred and not connection.is_usable():
+            connection.close()  # reconnect for the next job on this thread
+        return traceback.format_exc()
+
+
+def finish(results):
+    """
+    Record the outcome of claimed jobs: delete the successful ones in one
+    statement, reschedule or fail the rest.
+    """
+    Job.objects.filter(pk__in=[job.pk for job, error in results if error is None]).delete()
+    now = timezone.now()
+    for job, error in results:
+        if error is None:
+            continue
+        if job.attempts >= MAX_ATTEMPTS:
+            changes = {"status": Job.FAILED}
+        else:
+            changes = {"status": Job.PENDING, "run_after": now + backoff(job.attempts)}
+        Job.objects.filter(pk=job.pk).update(locked_at=None, last_error=error, **changes)
+
+
+def run_batch(batch_size=BATCH_SIZE, pool=None):
+    """
+    Claim and run one batch, on ``pool`` (an Executor) if given. Returns the
+    number of jobs claimed.
+    """
+    claimed = claim(batch_size)
+    if not claimed:
+        return 0
+    errors = pool.map(execute, claimed) if pool else map(execute, claimed)
+    finish(list(zip(claimed, errors)))
+    return len(claimed)
+
+
+def drain(batch_size=BATCH_SIZE, pool=None):
+    """
+    Run batches until nothing is due. Returns the number of jobs claimed.
+    """
+    total = 0
+    while processed := run_batch(batch_size, pool):
+        total += processed
+    return total
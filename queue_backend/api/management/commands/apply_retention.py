@@ -0,0 +1,110 @@
+import time
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token as AuthToken
+
+from queue_backend.api.models import AuthTokenUsage, Notification
+from queue_backend.api.notifications import notifications_changed
+
+
+class Command(BaseCommand):
+    help = ('Deletes old notifications and idle API keys in short primary-key batches. '
+            'Windows default to settings.RETENTION_POLICIES; 0 disables a policy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--read-notifications-days', type=int, help='Delete read notifications older than this')
+        parser.add_argument('--notifications-days', type=int, help='Delete any notification older than this')
+        parser.add_argument('--auth-tokens-days', type=int, help='Delete API keys not used for this long')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Primary keys covered per batch')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted')
+
+    def handle(self, *args, **options):
+        policies = dict(settings.RETENTION_POLICIES)
+        for policy, option in (('read_notifications', 'read_notifications_days'),
+                               ('notifications', 'notifications_days'),
+                               ('auth_tokens', 'auth_tokens_days')):
+            if options[option] is not None:
+                policies[policy] = options[option]
+        self.batch_size = options['batch_size']
+        self.pause = options['pause']
+        self.dry_run = options['dry_run']
+
+        now = timezone.now()
+        cutoffs = {policy: now - timedelta(days=days) for policy, days in policies.items() if days > 0}
+        if 'read_notifications' in cutoffs or 'notifications' in cutoffs:
+            self.prune_notifications(cutoffs.get('read_notifications'), cutoffs.get('notifications'))
+        if 'auth_tokens' in cutoffs:
+            self.prune_auth_tokens(cutoffs['auth_tokens'])
+
+    def report(self, table, batch, span, rows, started):
+        verb = 'would delete' if self.dry_run else 'deleted'
+        self.stdout.write(f'{table:<13} batch {batch:>4}  {span:<40} {verb} {rows:>6} rows '
+                          f'in {(time.perf_counter() - started) * 1000:7.1f} ms')
+        if self.pause:
+            time.sleep(self.pause)
+
+    def prune_notifications(self, read_cutoff, any_cutoff):
+        expired = reduce(or_, [
+            condition for cutoff, condition in (
+                (read_cutoff, Q(is_read=True, timestamp__lt=read_cutoff)),
+                (any_cutoff, Q(timestamp__lt=any_cutoff)),
+            ) if cutoff
+        ])
+        newest_cutoff = max(c for c in (read_cutoff, any_cutoff) if c)
+
+        total, batch, low = 0, 0, 0
+        while True:
+            first = Notification.objects.filter(id__gte=low).order_by('id').values_list('id', 'timestamp').first()
+            # ids follow insertion time, so once a window starts past the
+            # newest cutoff nothing after it can match
+            if first is None or first[1] >= newest_cutoff:
+                break
+            low, high = first[0], first[0] + self.batch_size
+            batch += 1
+            started = time.perf_counter()
+            with transaction.atomic():
+                # lock what goes so unread counters see exactly these rows
+                rows = list(Notification.objects.select_for_update().filter(expired, id__gte=low, id__lt=high)
+                            .values_list('id', 'user_id', 'is_read'))
+                if rows and not self.dry_run:
+                    Notification.objects.filter(id__in=[pk for pk, _, _ in rows]).delete()
+                    unread = {}
+                    for _, user_id, is_read in rows:
+                        unread[user_id] = unread.get(user_id, 0) - (not is_read)
+                    notifications_changed(*unread, unread=unread)
+            total += len(rows)
+            self.report('notifications', batch, f'ids {low}-{high - 1}', len(rows), started)
+            low = high
+        self.stdout.write(self.style.SUCCESS(f'Notifications: {total} rows in {batch} batches'))
+
+    def prune_auth_tokens(self, cutoff):
+        # keys issued before the cutoff and not seen since
+        idle = AuthToken.objects.filter(created__lt=cutoff).exclude(
+            key__in=AuthTokenUsage.objects.filter(last_used__gte=cutoff.date()).values('key'))
+
+        total, batch, last = 0, 0, ''
+        while True:
+            keys = list(AuthToken.objects.filter(key__gt=last).order_by('key').values_list('key', flat=True)
+                        [:self.batch_size])
+            if not keys:
+                break
+            batch += 1
+            started = time.perf_counter()
+            with transaction.atomic():
+                doomed = list(idle.filter(key__gte=keys[0], key__lte=keys[-1]).values_list('key', flat=True))
+                if not self.dry_run:
+                    AuthToken.objects.filter(key__in=doomed).delete()
+                    AuthTokenUsage.objects.filter(key__gte=keys[0], key__lte=keys[-1]).filter(
+                        Q(key__in=doomed) | Q(last_used__lt=cutoff.date())).delete()
+            total += len(doomed)
+            self.report('auth tokens', batch, f'keys {keys[0][:8]}…-{keys[-1][:8]}…', len(doomed), started)
+            last = keys[-1]
+        self.stdout.write(self.style.SUCCESS(f'Auth tokens: {total} rows in {batch} batches'))
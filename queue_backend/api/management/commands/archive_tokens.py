@@ -0,0 +1,52 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from queue_backend.api.models import ArchivedToken, Token
+
+
+class Command(BaseCommand):
+    help = ('Moves tokens of past days from the live Token table into ArchivedToken in batches, '
+            'keeping their ids. Run nightly so the live table holds about one day of queues.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=0,
+                            help='Past days to leave in the live table (0 = archive everything before today)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tokens moved per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now().date() - timedelta(days=options['keep_days'])
+        # tokens booked before appointment dates existed fall back to their issue time
+        past = Token.objects.filter(
+            Q(appointment_date__lt=cutoff)
+            | Q(appointment_date__isnull=True, issued_at__lt=timezone.make_aware(datetime.combine(cutoff, datetime.min.time())))
+        )
+        fields = ArchivedToken.copied_fields()
+
+        total, batch, last_id = 0, 0, 0
+        while True:
+            started = time.perf_counter()
+            with transaction.atomic():
+                rows = list(past.select_for_update().filter(id__gt=last_id).order_by('id').values(*fields)
+                            [:options['batch_size']])
+                if not rows:
+                    break
+                ids = [row['id'] for row in rows]
+                ArchivedToken.objects.bulk_create([ArchivedToken(**row) for row in rows])
+                Token.objects.filter(id__in=ids).delete()
+            batch += 1
+            total += len(rows)
+            last_id = ids[-1]
+            self.stdout.write(f'batch {batch:>4}  ids {ids[0]}-{ids[-1]}  moved {len(rows):>6} tokens '
+                              f'in {(time.perf_counter() - started) * 1000:7.1f} ms')
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total} tokens dated before {cutoff} in {batch} batches; '
+            f'{Token.objects.count()} remain live'))
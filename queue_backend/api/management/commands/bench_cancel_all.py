@@ -0,0 +1,91 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from queue_backend.api.models import Job, Notification, Provider, ResourceVersion, Service, Token
+from queue_backend.api.notifications import NOTIFY_CANCELLED
+
+User = get_user_model()
+
+
+def legacy_cancel(service_id, remarks):
+    """
+    The per-token implementation CancelAllTokensView used before the bulk
+    rewrite, kept here as the baseline.
+    """
+    today = timezone.now().date()
+    tokens_to_cancel = Token.objects.filter(service_id=service_id, appointment_date=today, status='waiting')
+    count = tokens_to_cancel.count()
+    for token in tokens_to_cancel:
+        if token.user:
+            Notification.objects.create(
+                user=token.user,
+                message=f"Your appointment #{token.token_number} has been cancelled. Reason: {remarks}"
+            )
+    tokens_to_cancel.update(status='cancelled', remarks=remarks)
+    return count
+
+
+class Command(BaseCommand):
+    help = ('Compares queries and time of the old per-token cancel-all loop with the bulk endpoint, which '
+            'leaves the notifications to one queued job')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, nargs='+', default=[10, 100, 500],
+                            help='Queue sizes to cancel')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        self.admin = User.objects.create_user(username=f'bench-admin-{tag}')
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        patients = []
+        remarks = f'benchmark {tag}'
+
+        self.stdout.write(f'{"tokens":>7} | {"legacy queries":>14} {"legacy ms":>10} | {"bulk queries":>12} {"bulk ms":>8}')
+        try:
+            for size in options['tokens']:
+                while len(patients) < size:
+                    patients.append(User.objects.create_user(username=f'bench-{tag}-{len(patients)}'))
+
+                service = self._queue(size, patients, tag)
+                with CaptureQueriesContext(connection) as legacy:
+                    started = time.perf_counter()
+                    legacy_cancel(service.id, 'benchmark')
+                    legacy_ms = (time.perf_counter() - started) * 1000
+                service.delete()
+
+                service = self._queue(size, patients, tag)
+                with CaptureQueriesContext(connection) as bulk:
+                    started = time.perf_counter()
+                    response = client.post('/api/cancel-all-tokens/', {'service': service.id, 'remarks': remarks},
+                                           format='json')
+                    bulk_ms = (time.perf_counter() - started) * 1000
+                if response.status_code != 200 or response.data['count'] != size:
+                    raise CommandError(f'cancel-all returned {response.status_code}: {response.data}')
+                service.delete()
+
+                self.stdout.write(f'{size:>7} | {len(legacy):>14} {legacy_ms:>10.1f} | {len(bulk):>12} {bulk_ms:>8.1f}')
+        finally:
+            Job.objects.filter(kind=NOTIFY_CANCELLED, payload__remarks=remarks).delete()
+            users = User.objects.filter(username__contains=tag)
+            ResourceVersion.objects.filter(
+                key__in=[ResourceVersion.notifications_key(pk) for pk in users.values_list('id', flat=True)]
+            ).delete()
+            users.delete()
+
+    def _queue(self, size, patients, tag):
+        provider = Provider.objects.get_or_create(name=f'bench-cancel-{tag}', admin=self.admin)[0]
+        service = Service.objects.create(name=f'bench-cancel-{tag}', provider=provider, status='Active')
+        today = timezone.now().date()
+        Token.objects.bulk_create([
+            Token(service=service, token_number=i + 1, status='waiting', user=patients[i], appointment_date=today)
+            for i in range(size)
+        ])
+        return service
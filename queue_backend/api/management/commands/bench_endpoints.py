@@ -0,0 +1,174 @@
+import json
+import platform
+import statistics
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token as AuthToken
+from rest_framework.test import APIClient
+
+from queue_backend.api.models import Notification, Service, Token
+
+from .generate_load_data import PASSWORD
+
+User = get_user_model()
+
+
+def scenarios(ctx):
+    """
+    (name, client, method, path, body factory, writes) for each hot endpoint.
+    ``client`` is anon, patient or staff; requests that write are rolled back
+    so every run sees the same dataset.
+    """
+    service, provider = ctx['service'], ctx['provider']
+    return [
+        ('tokens-by-service', 'anon', 'get', f'/api/tokens-by-service/?service={service}', None, False),
+        ('tokens-list', 'patient', 'get', '/api/tokens/?user=me', None, False),
+        ('tokens-create', 'patient', 'post', '/api/tokens/', lambda: {'service': service}, True),
+        ('notifications', 'patient', 'get', '/api/notifications/', None, False),
+        ('login', 'anon', 'post', '/api/login/', lambda: {'username': ctx['username'], 'password': PASSWORD}, True),
+        ('register', 'anon', 'post', '/api/register/', lambda: {
+            'username': f'bench-{uuid.uuid4().hex[:12]}', 'password': PASSWORD, 'password2': PASSWORD,
+            'phone': '9999999999', 'age': 30, 'dob': '1990-01-01'}, True),
+        ('cancel-all-tokens', 'staff', 'post', '/api/cancel-all-tokens/',
+         lambda: {'service': service, 'remarks': 'benchmark'}, True),
+        ('providers', 'anon', 'get', '/api/providers/', None, False),
+        ('services', 'anon', 'get', f'/api/services/?provider={provider}', None, False),
+    ]
+
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+class Command(BaseCommand):
+    help = ('Runs the hot API endpoints through the test client against the current (generated) dataset and '
+            'reports p50/p95/p99 latency, queries and bytes per request as JSON; --compare flags regressions '
+            'against a saved run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='load', help='Prefix the dataset was generated with')
+        parser.add_argument('--iterations', type=int, default=100, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint first')
+        parser.add_argument('--only', nargs='+', help='Endpoint names to run')
+        parser.add_argument('--output', help='Write the JSON report here (e.g. to keep as a baseline)')
+        parser.add_argument('--compare', help='Baseline JSON report to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative growth of p95 latency and bytes before it counts as a regression')
+
+    def handle(self, *args, **options):
+        ctx = self.dataset(options['prefix'])
+        clients = {'anon': APIClient(), 'patient': self.client_for(ctx['patient']), 'staff': self.client_for(ctx['staff'])}
+        selected = [s for s in scenarios(ctx) if not options['only'] or s[0] in options['only']]
+        if options['only'] and len(selected) != len(options['only']):
+            known = ', '.join(s[0] for s in scenarios(ctx))
+            raise CommandError(f'--only takes endpoint names: {known}')
+
+        report = {
+            'meta': {
+                'vendor': connection.vendor,
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'tokens': Token.objects.count(),
+                'created': timezone.now().isoformat(),
+            },
+            'endpoints': {},
+        }
+        # the login/register attempt limits would turn most of those runs into 429s
+        with override_settings(AUTH_THROTTLE_RATES={}):
+            for name, client, method, path, body, writes in selected:
+                report['endpoints'][name] = self.measure(
+                    clients[client], method, path, body, writes, options['iterations'], options['warmup'])
+
+        rendered = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(rendered + '\n')
+        self.stdout.write(rendered)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline, report, options['tolerance'])
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(self.style.ERROR(f'REGRESSION {line}'))
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}'))
+
+    def dataset(self, prefix):
+        patient = User.objects.filter(username=f'{prefix}-user-0').first()
+        staff = User.objects.filter(username=f'{prefix}-admin-0').first()
+        if patient is None or staff is None:
+            raise CommandError(f'No "{prefix}" dataset here; run generate_load_data --prefix {prefix} first')
+        # the busiest queue today, and its provider's service list
+        busiest = (Token.objects.filter(appointment_date=timezone.now().date()).values('service')
+                   .annotate(n=Count('id')).order_by('-n').first())
+        if busiest is None:
+            raise CommandError('The dataset has no tokens for today; regenerate it')
+        service = Service.objects.select_related('provider__admin').get(pk=busiest['service'])
+        if service.provider is not None:
+            staff = service.provider.admin  # cancel-all needs the queue's own admin
+        if not Notification.objects.filter(user=patient).exists():
+            self.stderr.write('warning: the patient has no notifications; that endpoint measures an empty inbox')
+        return {'patient': patient, 'staff': staff, 'username': patient.username,
+                'service': service.id, 'provider': service.provider_id}
+
+    def client_for(self, user):
+        # a real key, so authentication is part of what is measured
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {AuthToken.objects.get_or_create(user=user)[0].key}')
+        return client
+
+    def measure(self, client, method, path, body, writes, iterations, warmup):
+        latencies, queries, sizes, statuses = [], [], [], set()
+        for i in range(warmup + iterations):
+            data = body() if body else None
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                if writes:
+                    with transaction.atomic():
+                        response = getattr(client, method)(path, data, format='json')
+                        transaction.set_rollback(True)
+                else:
+                    response = getattr(client, method)(path, data, format='json')
+                elapsed = (time.perf_counter() - started) * 1000
+            if i < warmup:
+                continue
+            latencies.append(elapsed)
+            queries.append(len(captured))
+            sizes.append(len(response.content))
+            statuses.add(response.status_code)
+        return {
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries': max(queries),
+            'bytes': max(sizes),
+            'status': sorted(statuses),
+        }
+
+    def compare(self, baseline, report, tolerance):
+        regressions = []
+        for name, now in report['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(name)
+            if before is None:
+                continue
+            if now['queries'] > before['queries']:
+                regressions.append(f'{name}: queries {before["queries"]} -> {now["queries"]}')
+            for metric in ('p95_ms', 'bytes'):
+                if now[metric] > before[metric] * (1 + tolerance):
+                    growth = f' (+{(now[metric] / before[metric] - 1) * 100:.0f}%)' if before[metric] else ''
+                    regressions.append(f'{name}: {metric} {before[metric]} -> {now[metric]}{growth}')
+            if now['status'] != before['status']:
+                regressions.append(f'{name}: status {before["status"]} -> {now["status"]}')
+        return regressions
@@ -0,0 +1,73 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from queue_backend.api import jobs
+from queue_backend.api.models import Job, Notification, ResourceVersion, Service, Token
+from queue_backend.api.notifications import NOTIFY_STATUS
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measures the status-change request with notifications queued, and job worker throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=1000, help='Notification jobs per run')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help='Worker pool sizes to try')
+        parser.add_argument('--batch', type=int, default=jobs.BATCH_SIZE, help='Jobs claimed per round')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        count = options['jobs']
+        today = timezone.now().date()
+        service = Service.objects.create(name=f'bench-jobs-{tag}', status='Active')
+        users = User.objects.bulk_create([User(username=f'bench-{tag}-{i}') for i in range(count)])
+        tokens = Token.objects.bulk_create([
+            Token(service=service, token_number=i + 1, status='waiting', user=user, appointment_date=today)
+            for i, user in enumerate(users)
+        ])
+        try:
+            self._request(tokens[0], tag)
+            self.stdout.write(f'{"workers":>7} | {"jobs":>6} {"seconds":>8} {"jobs/s":>8}')
+            for workers in options['workers']:
+                Job.objects.bulk_create([
+                    Job(kind=NOTIFY_STATUS, payload={'token': token.id, 'status': 'calling'}) for token in tokens
+                ])
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    done = jobs.drain(options['batch'], pool)
+                elapsed = time.perf_counter() - started
+                failed = Job.objects.filter(payload__token__in=[t.id for t in tokens]).count()
+                self.stdout.write(f'{workers:>7} | {done:>6} {elapsed:>8.2f} {done / elapsed:>8.1f}'
+                                  + (f'  ({failed} not done)' if failed else ''))
+        finally:
+            Job.objects.filter(kind=NOTIFY_STATUS, payload__token__in=[t.id for t in tokens]).delete()
+            ResourceVersion.objects.filter(
+                key__in=[ResourceVersion.notifications_key(user.id) for user in users]).delete()
+            service.delete()
+            User.objects.filter(username__contains=tag).delete()
+
+    def _request(self, token, tag):
+        staff = User.objects.create_user(username=f'bench-staff-{tag}')
+        client = APIClient()
+        client.force_authenticate(user=staff)
+        with CaptureQueriesContext(connection) as queued:
+            started = time.perf_counter()
+            client.patch(f'/api/tokens/{token.id}/', {'status': 'calling'}, format='json')
+            request_ms = (time.perf_counter() - started) * 1000
+        with CaptureQueriesContext(connection) as fanout:
+            started = time.perf_counter()
+            jobs.drain()
+            fanout_ms = (time.perf_counter() - started) * 1000
+        if not Notification.objects.filter(user_id=token.user_id).exists():
+            raise CommandError('The status change job did not write a notification')
+        self.stdout.write(f'Status change request: {len(queued)} queries, {request_ms:.1f} ms '
+                          f'(fan-out moved to the worker: {len(fanout)} queries, {fanout_ms:.1f} ms)')
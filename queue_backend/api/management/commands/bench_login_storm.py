@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from .bench_endpoints import Command as EndpointBenchmark, percentile
+from .generate_load_data import PASSWORD
+
+
+class Command(BaseCommand):
+    help = ('Measures tokens-by-service polling latency while threads hammer /api/login/, once per '
+            'PASSWORD_HASH_CONCURRENCY value, against the generated dataset. Attempt limits are off so '
+            'every login reaches the password hasher.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='load', help='Prefix the dataset was generated with')
+        parser.add_argument('--storm-threads', type=int, default=16, help='Threads logging in back to back')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds each phase polls for')
+        parser.add_argument('--poll-interval', type=float, default=0.01, help='Pause between polls')
+        parser.add_argument('--hash-limits', type=int, nargs='+', default=[0, 2],
+                            help='PASSWORD_HASH_CONCURRENCY values to run the storm with (0 = no cap)')
+        parser.add_argument('--max-slowdown', type=float,
+                            help='Fail if the polling p95 of the last --hash-limits run exceeds the quiet p95 '
+                                 'by more than this factor')
+
+    def handle(self, *args, **options):
+        ctx = EndpointBenchmark(stdout=self.stdout, stderr=self.stderr).dataset(options['prefix'])
+        poll_path = f'/api/tokens-by-service/?service={ctx["service"]}'
+        login = {'username': ctx['username'], 'password': PASSWORD}
+
+        # every shed login is a 503, which django.request would log
+        request_log = logging.getLogger('django.request')
+        level = request_log.level
+        request_log.setLevel(logging.CRITICAL)
+        try:
+            rows = self.run_phases(poll_path, login, options)
+        finally:
+            request_log.setLevel(level)
+
+        self.stdout.write(f'{"phase":<16}{"poll p50":>10}{"p95":>10}{"p99":>10}{"polls":>8}{"logins/s":>10}{"503s":>7}')
+        for name, latencies, logins, busy in rows:
+            self.stdout.write(
+                f'{name:<16}{percentile(latencies, 50):>8.2f}ms{percentile(latencies, 95):>8.2f}ms'
+                f'{percentile(latencies, 99):>8.2f}ms{len(latencies):>8}{logins / options["duration"]:>10.1f}{busy:>7}')
+
+        if options['max_slowdown'] is not None:
+            quiet, capped = percentile(rows[0][1], 95), percentile(rows[-1][1], 95)
+            if capped > quiet * options['max_slowdown']:
+                raise CommandError(f'Polling p95 went from {quiet:.2f}ms to {capped:.2f}ms under the login storm')
+            self.stdout.write(self.style.SUCCESS(f'Polling p95 stayed within {options["max_slowdown"]}x'))
+
+    def run_phases(self, poll_path, login, options):
+        rows = []
+        with override_settings(AUTH_THROTTLE_RATES={}):
+            APIClient().get(poll_path)  # warm the queue snapshot and URL resolver
+            rows.append(('quiet', *self.phase(poll_path, login, options, storm=False)))
+            for limit in options['hash_limits']:
+                with override_settings(PASSWORD_HASH_CONCURRENCY=limit):
+                    rows.append((f'storm, {limit or "no"} cap', *self.phase(poll_path, login, options, storm=True)))
+        return rows
+
+    def phase(self, poll_path, login, options, storm):
+        """Poll for --duration seconds, with the storm running if asked; (latencies ms, logins, 503s)."""
+        stop = threading.Event()
+        outcomes = []
+        lock = threading.Lock()
+
+        def hammer():
+            client = APIClient()
+            seen = []
+            try:
+                while not stop.is_set():
+                    seen.append(client.post('/api/login/', login, format='json').status_code)
+            finally:
+                connections.close_all()
+                with lock:
+                    outcomes.extend(seen)
+
+        threads = [threading.Thread(target=hammer) for _ in range(options['storm_threads'] if storm else 0)]
+        for thread in threads:
+            thread.start()
+        if threads:
+            time.sleep(0.5)  # let the hashes pile up before measuring
+
+        client = APIClient()
+        latencies = []
+        deadline = time.monotonic() + options['duration']
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            response = client.get(poll_path)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                stop.set()
+                raise CommandError(f'Polling returned {response.status_code}')
+            time.sleep(options['poll_interval'])
+
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if storm and not any(code == 200 for code in outcomes):
+            raise CommandError(f'No login succeeded during the storm (statuses {sorted(set(outcomes))})')
+        return latencies, outcomes.count(200), outcomes.count(503)
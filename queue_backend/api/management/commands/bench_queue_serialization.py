@@ -0,0 +1,85 @@
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from queue_backend.api.models import Provider, Service, Token
+from queue_backend.api.serializers import COMPACT_TOKEN_FIELDS, TokenSerializer, compact_tokens
+
+from .bench_endpoints import percentile
+
+STATUSES = ('completed', 'completed', 'skipped', 'calling', 'waiting', 'waiting', 'waiting')
+
+
+class Command(BaseCommand):
+    help = ('Builds one service-day queue and times turning it into JSON with TokenSerializer and with the '
+            '?view=compact path of tokens-by-service (query, rows and rendering each time). The queue is '
+            'rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=1000, help='Tokens in the queue')
+        parser.add_argument('--iterations', type=int, default=30, help='Timed builds per path')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed builds per path first')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            queryset = self.queue(options['tokens'])
+            paths = {
+                'serializer': lambda: TokenSerializer(TokenSerializer.eager(queryset), many=True).data,
+                'compact': lambda: compact_tokens(queryset),
+            }
+            self.check_same_rows(paths)
+            results = {name: self.measure(build, options['iterations'], options['warmup'])
+                       for name, build in paths.items()}
+            transaction.set_rollback(True)
+
+        tokens = options['tokens']
+        self.stdout.write(f'{tokens} tokens on {connection.vendor}, {options["iterations"]} builds per path')
+        self.stdout.write(f'{"path":<12}{"p50":>10}{"p95":>10}{"tokens/s":>12}{"queries":>9}{"bytes":>10}')
+        for name, r in results.items():
+            self.stdout.write(f'{name:<12}{r["p50"]:>8.2f}ms{r["p95"]:>8.2f}ms'
+                              f'{tokens / r["p50"] * 1000:>12,.0f}{r["queries"]:>9}{r["bytes"]:>10,}')
+        speedup = results['serializer']['p50'] / results['compact']['p50']
+        self.stdout.write(self.style.SUCCESS(f'compact is {speedup:.1f}x faster at p50'))
+
+    def queue(self, count):
+        tag = uuid.uuid4().hex[:8]
+        admin = get_user_model().objects.create_user(username=f'bench-{tag}')
+        provider = Provider.objects.create(name=f'bench-{tag}', admin=admin)
+        service = Service.objects.create(name='bench queue', provider=provider, status='Active')
+        today = timezone.now().date()
+        opening = datetime.combine(today, datetime.min.time()) + timedelta(hours=9)
+        Token.objects.bulk_create([
+            Token(service=service, token_number=i + 1, status=STATUSES[i % len(STATUSES)],
+                  visitor_name=f'Visitor {i}', appointment_date=today,
+                  appointment_time=(opening + timedelta(minutes=i // 4)).time(), remarks='benchmark')
+            for i in range(count)
+        ], batch_size=500)
+        return Token.objects.filter(service=service, appointment_date=today).order_by(
+            'appointment_time', 'token_number')
+
+    def check_same_rows(self, paths):
+        # compact rows must be exactly the serializer's rows cut down to the compact fields
+        full = [{field: row[field] for field in COMPACT_TOKEN_FIELDS} for row in paths['serializer']()]
+        if full != paths['compact']():
+            raise CommandError('compact rows differ from the TokenSerializer rows')
+
+    def measure(self, build, iterations, warmup):
+        renderer = JSONRenderer()
+        timings = []
+        for i in range(warmup + iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                body = renderer.render(build())
+                elapsed = (time.perf_counter() - started) * 1000
+            if i >= warmup:
+                timings.append(elapsed)
+        return {'p50': percentile(timings, 50), 'p95': percentile(timings, 95),
+                'mean': statistics.fmean(timings), 'queries': len(captured), 'bytes': len(body)}
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from queue_backend.api import events
+from queue_backend.api.models import QueueEvent, Service
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as fh:
+            for line in fh:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Opens many idle SSE subscribers against one ASGI worker and measures memory and fan-out latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=2000, help='Idle streams to open')
+        parser.add_argument('--services', type=int, default=1, help='Spread subscribers over this many services')
+        parser.add_argument('--connect-batch', type=int, default=200, help='Streams opened concurrently')
+
+    def handle(self, *args, **options):
+        # each stream costs a file descriptor on both ends
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        if options['subscribers'] * 2 + 100 > hard:
+            raise CommandError(f'File descriptor limit {hard} is too low for {options["subscribers"]} subscribers')
+
+        services = [Service.objects.create(name=f'sse-bench-{i}', status='Active') for i in range(options['services'])]
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'core.asgi:application', '--port', str(port),
+             '--workers', '1', '--log-level', 'warning', '--no-access-log'],
+            cwd=settings.BASE_DIR, env=os.environ.copy(),
+        )
+        try:
+            self._wait_for(port)
+            baseline = _rss_mb(server.pid)
+            result = asyncio.run(self._run(port, services, options, server.pid))
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+            for service in services:
+                service.delete()
+
+        subscribers = options['subscribers']
+        self.stdout.write(f'Subscribers held:        {result["connected"]}/{subscribers}')
+        self.stdout.write(f'Connect time:            {result["connect_s"]:.2f}s')
+        if baseline is not None and result['rss'] is not None:
+            per_stream = (result['rss'] - baseline) * 1024 / max(result['connected'], 1)
+            self.stdout.write(f'Worker RSS:              {baseline:.1f} MB idle -> {result["rss"]:.1f} MB ({per_stream:.1f} KB/stream)')
+        self.stdout.write(f'Fan-out to all streams:  {result["fanout_s"]:.3f}s (includes poll interval {events.POLL_INTERVAL}s)')
+        if result['connected'] < subscribers or result['delivered'] < result['connected']:
+            raise CommandError(f'Only {result["delivered"]} of {subscribers} streams received the event')
+        self.stdout.write(self.style.SUCCESS('Every subscriber received the event'))
+
+    def _wait_for(self, port, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError('ASGI server did not start')
+
+    async def _open(self, port, service_id):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(
+            f'GET /api/events/?service={service_id} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n'.encode()
+        )
+        await writer.drain()
+        # headers, then the retry hint proves the stream is subscribed
+        await reader.readuntil(b'retry:')
+        return reader, writer
+
+    async def _run(self, port, services, options, pid):
+        started = time.perf_counter()
+        streams = []
+        batch = options['connect_batch']
+        for offset in range(0, options['subscribers'], batch):
+            opened = await asyncio.gather(
+                *(self._open(port, services[i % len(services)].id)
+                  for i in range(offset, min(offset + batch, options['subscribers']))),
+                return_exceptions=True,
+            )
+            streams.extend(s for s in opened if not isinstance(s, BaseException))
+        connect_s = time.perf_counter() - started
+        await asyncio.sleep(2)  # let the worker settle before sampling memory
+        rss = _rss_mb(pid)
+
+        fired = time.perf_counter()
+        for service in services:
+            await asyncio.to_thread(
+                QueueEvent.objects.create,
+                channel=events.service_channel(service.id), kind='queue', payload={'service': service.id},
+            )
+        results = await asyncio.gather(
+            *(asyncio.wait_for(reader.readuntil(b'event: queue'), 30) for reader, _ in streams),
+            return_exceptions=True,
+        )
+        fanout_s = time.perf_counter() - fired
+        for _, writer in streams:
+            writer.close()
+        return {
+            'connected': len(streams),
+            'connect_s': connect_s,
+            'rss': rss,
+            'fanout_s': fanout_s,
+            'delivered': sum(not isinstance(r, BaseException) for r in results),
+        }
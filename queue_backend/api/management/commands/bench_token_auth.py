@@ -0,0 +1,63 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .bench_endpoints import Command as EndpointBenchmark, percentile, scenarios
+
+
+class Command(BaseCommand):
+    help = ('Measures the patient polling endpoints with API key lookups uncached (what a per-process cache '
+            'such as locmem gets) and cached in a shared file-based cache (AUTH_TOKEN_CACHE_SECONDS), '
+            'reporting queries per request, how many of them look up the key, and latency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='load', help='Prefix the dataset was generated with')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint and mode')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per endpoint and mode first')
+        parser.add_argument('--cache-seconds', type=int, default=60, help='AUTH_TOKEN_CACHE_SECONDS when cached')
+
+    def handle(self, *args, **options):
+        bench = EndpointBenchmark(stdout=self.stdout, stderr=self.stderr)
+        ctx = bench.dataset(options['prefix'])
+        client = bench.client_for(ctx['patient'])
+        paths = [(name, path) for name, who, method, path, body, writes in scenarios(ctx)
+                 if who == 'patient' and method == 'get']
+        paths.append(('notifications-badge', '/api/notifications/badge/'))
+
+        rows = []
+        with tempfile.TemporaryDirectory() as location:
+            shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                  'LOCATION': location}}
+            for mode, seconds in (('uncached', 0), ('cached', options['cache_seconds'])):
+                with override_settings(CACHES=shared, AUTH_TOKEN_CACHE_SECONDS=seconds):
+                    for name, path in paths:
+                        rows.append((name, mode, *self.measure(client, path, options)))
+
+        self.stdout.write(f'{"endpoint":<22}{"mode":<10}{"queries":>8}{"auth":>6}{"p50":>10}{"p95":>10}')
+        for name, mode, queries, auth, latencies in rows:
+            self.stdout.write(f'{name:<22}{mode:<10}{queries:>8}{auth:>6}'
+                              f'{percentile(latencies, 50):>8.2f}ms{percentile(latencies, 95):>8.2f}ms')
+
+        leftover = [name for name, mode, queries, auth, latencies in rows if mode == 'cached' and auth]
+        if leftover:
+            raise CommandError(f'Cached runs still looked the key up: {", ".join(leftover)}')
+        self.stdout.write(self.style.SUCCESS('With a shared cache no request looked the key up'))
+
+    def measure(self, client, path, options):
+        """(queries per request, key lookups per request, latencies ms) once warmed up."""
+        latencies, queries, auth = [], 0, 0
+        for i in range(options['warmup'] + options['iterations']):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(path)
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise CommandError(f'{path} returned {response.status_code}')
+            if i >= options['warmup']:
+                latencies.append(elapsed)
+                queries = max(queries, len(captured))
+                auth = max(auth, sum('authtoken_token' in q['sql'] for q in captured))
+        return queries, auth, latencies
@@ -0,0 +1,70 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, OperationalError
+
+from queue_backend.api.models import Service, ServiceDayCounter, Token
+
+
+class Command(BaseCommand):
+    help = 'Fires parallel bookings at one service-day and checks token numbers are unique and gap-free'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=300, help='Total bookings to issue')
+        parser.add_argument('--workers', type=int, default=32, help='Parallel booking threads')
+        parser.add_argument('--retries', type=int, default=20, help='Retries per booking when the DB reports a lock')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark service and its tokens')
+
+    def handle(self, *args, **options):
+        bookings = options['bookings']
+        retries = options['retries']
+        service = Service.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}', status='Active')
+        day = date.today()
+
+        def book(i):
+            for attempt in range(retries + 1):
+                try:
+                    with transaction.atomic():
+                        number = ServiceDayCounter.next_number(service.id, day)
+                        Token.objects.create(
+                            service=service, token_number=number, status='waiting',
+                            appointment_date=day, visitor_name=f'bench {i}',
+                        )
+                    return number
+                except OperationalError:
+                    # SQLite reports "database is locked" past its busy timeout
+                    if attempt == retries:
+                        raise
+                    time.sleep(0.01 * (attempt + 1))
+
+        def worker(chunk):
+            # one connection per thread, closed when its share is booked
+            try:
+                return [book(i) for i in chunk]
+            finally:
+                connection.close()
+
+        workers = max(1, min(options['workers'], bookings))
+        chunks = [range(w, bookings, workers) for w in range(workers)]
+
+        self.stdout.write(f'Booking {bookings} tokens with {workers} workers on {connection.vendor}...')
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            returned = [n for numbers in pool.map(worker, chunks) for n in numbers]
+        elapsed = time.perf_counter() - started
+
+        stored = sorted(Token.objects.filter(service=service, appointment_date=day).values_list('token_number', flat=True))
+        expected = list(range(1, bookings + 1))
+        ok = sorted(returned) == expected and stored == expected
+
+        self.stdout.write(f'Elapsed: {elapsed:.3f}s ({bookings / elapsed:.1f} bookings/s)')
+        if not options['keep']:
+            service.delete()
+
+        if not ok:
+            duplicates = len(stored) - len(set(stored))
+            raise CommandError(f'Token numbers are not unique and gap-free ({duplicates} duplicates, {len(stored)} stored)')
+        self.stdout.write(self.style.SUCCESS(f'All {bookings} token numbers unique and gap-free'))
@@ -0,0 +1,207 @@
+import random
+import time
+from datetime import datetime, time as day_time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from queue_backend.api.models import Notification, NotificationCounter, Provider, Service, ServiceDayCounter, Token
+
+User = get_user_model()
+
+# every generated account logs in with this
+PASSWORD = 'load123'
+PAST_STATUSES = ('completed', 'skipped', 'cancelled')
+TOKEN_COLUMNS = ('service_id', 'token_number', 'status', 'issued_at', 'user_id', 'visitor_name',
+                 'appointment_date', 'appointment_time', 'version', 'called_at', 'finished_at')
+
+
+def parse_mix(value):
+    """``completed=80,skipped=10,cancelled=10`` -> ([statuses], [weights])."""
+    try:
+        pairs = [part.split('=') for part in value.split(',') if part]
+        mix = {status.strip(): float(weight) for status, weight in pairs}
+    except ValueError:
+        raise CommandError('--status-mix must look like completed=80,skipped=10,cancelled=10')
+    unknown = set(mix) - set(PAST_STATUSES)
+    if unknown or not any(mix.values()):
+        raise CommandError(f'--status-mix takes weights for {", ".join(PAST_STATUSES)}')
+    return list(mix), list(mix.values())
+
+
+class Command(BaseCommand):
+    help = ('Generates a reproducible synthetic dataset (providers, services, users and a queue history '
+            'per service-day) with chunked bulk inserts, for load and capacity testing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--providers', type=int, default=10)
+        parser.add_argument('--services-per-provider', type=int, default=5)
+        parser.add_argument('--users', type=int, default=1000, help='Patient accounts booking the tokens')
+        parser.add_argument('--days', type=int, default=30, help='Days of history, ending today')
+        parser.add_argument('--tokens-per-day', type=int, default=100, help='Tokens per service-day')
+        parser.add_argument('--status-mix', default='completed=80,skipped=10,cancelled=10',
+                            help='Relative weights of final statuses on past days')
+        parser.add_argument('--walk-in-ratio', type=float, default=0.2,
+                            help='Share of tokens issued to a visitor name instead of an account')
+        parser.add_argument('--today-progress', type=float, default=0.5,
+                            help="Share of today's queue already served; one token is calling, the rest wait")
+        parser.add_argument('--notifications-per-user', type=int, default=5,
+                            help='Average inbox size of a patient; about a third are unread')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--prefix', default='load', help='Prefix of generated usernames and names')
+        parser.add_argument('--skip-stats', action='store_true', help='Do not rebuild ServiceDayStats afterwards')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.mix = parse_mix(options['status_mix'])
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users prefixed "{prefix}-" already exist; pick another --prefix')
+
+        started = time.perf_counter()
+        admins = self.users(f'{prefix}-admin', options['providers'])
+        providers = self.insert(Provider, (
+            Provider(name=f'{prefix} provider {i}', location=f'{i} Load Street', admin_id=admin)
+            for i, admin in enumerate(admins)
+        ))
+        services = self.insert(Service, (
+            Service(provider_id=provider.id, name=f'{prefix} service {p}.{s}', status='Active')
+            for p, provider in enumerate(providers) for s in range(options['services_per_provider'])
+        ))
+        patients = self.users(f'{prefix}-user', options['users'])
+
+        today = timezone.now().date()
+        days = [today - timedelta(days=offset) for offset in range(options['days'] - 1, -1, -1)]
+        tokens_started = time.perf_counter()
+        tokens = self.insert_raw(Token, TOKEN_COLUMNS, self.tokens(services, days, patients, options))
+        tokens_elapsed = time.perf_counter() - tokens_started
+        self.counters(services, days, options['tokens_per_day'])
+        notifications = self.insert_raw(Notification, ('user_id', 'message', 'is_read', 'timestamp'),
+                                        self.notifications(patients, options['notifications_per_user'], days[0]))
+        NotificationCounter.reconcile()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {len(providers)} providers, {len(services)} services, {len(admins) + len(patients)} users, '
+            f'{tokens} tokens and {notifications} notifications in {time.perf_counter() - started:.1f}s '
+            f'({tokens / tokens_elapsed if tokens_elapsed else 0:,.0f} tokens/s)'))
+        if not options['skip_stats'] and tokens:
+            call_command('backfill_service_stats', date_from=str(days[0]), date_to=str(days[-1]), stdout=self.stdout)
+
+    def chunks(self, model, rows):
+        """Group ``rows`` by --chunk-size, reporting throughput after each chunk."""
+        count, chunk = 0, []
+        started = time.perf_counter()
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                count += len(chunk)
+                chunk = []
+                self.report(model, count, started)
+        if chunk:
+            yield chunk
+            self.report(model, count + len(chunk), started)
+
+    def report(self, model, count, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{model._meta.model_name:<17} {count:>12,} rows  {count / elapsed:>10,.0f} rows/s')
+
+    def insert(self, model, rows):
+        """bulk_create ``rows`` one chunk per transaction; returns the saved objects."""
+        created = []
+        for chunk in self.chunks(model, rows):
+            with transaction.atomic():
+                created.extend(model.objects.bulk_create(chunk))
+        return created
+
+    def insert_raw(self, model, columns, rows):
+        """
+        Insert tuples in ``columns`` order with executemany and return their
+        number. Building and compiling model instances caps bulk_create at a
+        few thousand rows/s, far too slow for multi-million token runs.
+        """
+        quote = connection.ops.quote_name
+        sql = (f'INSERT INTO {quote(model._meta.db_table)} ({", ".join(map(quote, columns))}) '
+               f'VALUES ({", ".join(["%s"] * len(columns))})')
+        count = 0
+        for chunk in self.chunks(model, rows):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, chunk)
+            count += len(chunk)
+        return count
+
+    def users(self, name, count):
+        # hashing once keeps account creation from dominating the run
+        password = make_password(PASSWORD)
+        for chunk in self.chunks(User, (User(username=f'{name}-{i}', password=password) for i in range(count))):
+            User.objects.bulk_create(chunk)
+        return list(User.objects.filter(username__startswith=f'{name}-').order_by('id').values_list('id', flat=True))
+
+    def tokens(self, services, days, patients, options):
+        """Yield TOKEN_COLUMNS tuples, already adapted for the database."""
+        rnd = self.random
+        ops = connection.ops
+        per_day = options['tokens_per_day']
+        today = days[-1]
+        now = timezone.now()
+        served = int(per_day * options['today_progress'])
+        statuses, weights = self.mix
+
+        def stamp(value):
+            return None if value is None else ops.adapt_datetimefield_value(value)
+
+        for service in services:
+            # versions keep growing across a service's days, like ServiceDayCounter
+            version = 0
+            for day in days:
+                db_day = ops.adapt_datefield_value(day)
+                issued_at = timezone.make_aware(datetime.combine(day, day_time(9)))
+                outcomes = rnd.choices(statuses, weights, k=per_day)
+                if day == today:
+                    outcomes[served:] = ['calling'] + ['waiting'] * (per_day - served - 1)
+                for number, status in enumerate(outcomes[:per_day], 1):
+                    version += 1
+                    issued_at += timedelta(seconds=rnd.randint(10, 240))
+                    if day == today:
+                        issued_at = min(issued_at, now)
+
+                    called_at = finished_at = None
+                    if status in ('calling', 'completed', 'skipped'):
+                        called_at = issued_at + timedelta(seconds=rnd.randint(60, 3600))
+                    if status in ('completed', 'skipped'):
+                        finished_at = called_at + timedelta(seconds=rnd.randint(60, 1200))
+                    elif status == 'cancelled':
+                        finished_at = issued_at + timedelta(seconds=rnd.randint(60, 3600))
+
+                    walk_in = not patients or rnd.random() < options['walk_in_ratio']
+                    yield (
+                        service.id, number, status, stamp(issued_at),
+                        None if walk_in else rnd.choice(patients), f'Visitor {number}' if walk_in else None,
+                        db_day, ops.adapt_timefield_value(issued_at.time().replace(microsecond=0)),
+                        version, stamp(called_at), stamp(finished_at),
+                    )
+
+    def counters(self, services, days, per_day):
+        # next bookings continue after the generated numbers and versions
+        self.insert(ServiceDayCounter, (
+            ServiceDayCounter(service_id=service.id, date=day, last_number=per_day,
+                              version=(i + 1) * per_day, reset_version=(i + 1) * per_day)
+            for service in services for i, day in enumerate(days)
+        ))
+
+    def notifications(self, patients, per_user, since):
+        # spread in time order across users, so ids follow timestamps as in production
+        rnd = self.random
+        stamp = connection.ops.adapt_datetimefield_value
+        start = timezone.make_aware(datetime.combine(since, day_time()))
+        total = len(patients) * per_user
+        step = (timezone.now() - start) / max(total, 1)
+        for i in range(total):
+            yield (rnd.choice(patients), f'Your appointment #{rnd.randint(1, 200)} has been updated.',
+                   rnd.random() > 0.3, stamp(start + step * i))
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
-from api.models import Provider, Service, Token
+from queue_backend.api.models import Provider, Service, Token
 
 User = get_user_model()
 
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from queue_backend.api import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Shows hit/miss counts for the shared queue snapshot cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        counts = snapshots.stats()
+        total = counts['hits'] + counts['misses']
+        ratio = counts['hits'] / total if total else 0.0
+
+        self.stdout.write(f'Backend: {settings.CACHES["default"]["BACKEND"]}')
+        self.stdout.write(f'Hits:    {counts["hits"]}')
+        self.stdout.write(f'Misses:  {counts["misses"]}')
+        self.stdout.write(f'Hit ratio: {ratio:.1%} ({counts["hits"]} queue queries + serializations saved)')
+
+        if options['reset']:
+            snapshots.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,38 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from queue_backend.api import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (notification fan-out) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Threads running job handlers')
+        parser.add_argument('--batch', type=int, default=jobs.BATCH_SIZE, help='Jobs claimed per round')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to sleep when no job is due')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        stopping = []
+        # finish the batch in hand on SIGTERM (deploys) instead of abandoning it to the lease
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+        processed = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='job') as pool:
+            try:
+                while not stopping:
+                    claimed = jobs.run_batch(options['batch'], pool)
+                    processed += claimed
+                    if not claimed:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll'])
+            except KeyboardInterrupt:
+                pass
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Processed {processed} jobs in {elapsed:.1f}s')
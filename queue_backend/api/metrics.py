@@ -0,0 +1,140 @@
+# queue_backend/api/metrics.py
+"""
+Per-view request metrics in the Prometheus text format.
+
+MetricsMiddleware records each request here under its resolved URL name and
+method. Samples accumulate in process memory and every few seconds the
+process writes its totals to its own file in settings.METRICS_DIR, so
+recording never waits on another worker. GET /api/metrics adds up the files
+of every gunicorn worker on the host.
+
+Clear METRICS_DIR when deploying. Counters of workers that have exited stay
+in their files so totals never go backwards. A recycled pid overwrites the old
+file with fresh totals, which reads as a counter reset that Prometheus'
+rate() already handles.
+"""
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000)
+
+COUNTERS = {
+    "queue_http_requests_total": "Requests by view, method and status code",
+    "queue_http_db_duration_seconds_total": "Time spent in database queries",
+}
+HISTOGRAMS = {
+    "queue_http_request_duration_seconds": ("Request latency up to the response headers", LATENCY_BUCKETS),
+    "queue_http_db_queries": ("Database queries per request", QUERY_BUCKETS),
+    "queue_http_response_size_bytes": ("Response body size (streams not included)", SIZE_BUCKETS),
+}
+
+_lock = threading.Lock()
+_samples = {}           # (metric, labels) -> float, or [bucket counts..., +Inf count, sum]
+_last_flush = time.monotonic()
+
+
+def _bucket(value, bounds):
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            return i
+    return len(bounds)
+
+
+def _observe(metric, labels, value):
+    bounds = HISTOGRAMS[metric][1]
+    sample = _samples.get((metric, labels))
+    if sample is None:
+        sample = _samples[(metric, labels)] = [0] * (len(bounds) + 2)
+    sample[_bucket(value, bounds)] += 1
+    sample[-1] += value
+
+
+def record(view, method, status, seconds, queries, db_seconds, size=None):
+    """Add one finished request; ``size`` is None for streamed responses."""
+    labels = (("view", view), ("method", method))
+    global _last_flush
+    with _lock:
+        key = ("queue_http_requests_total", labels + (("status", str(status)),))
+        _samples[key] = _samples.get(key, 0) + 1
+        key = ("queue_http_db_duration_seconds_total", labels)
+        _samples[key] = _samples.get(key, 0) + db_seconds
+        _observe("queue_http_request_duration_seconds", labels, seconds)
+        _observe("queue_http_db_queries", labels, queries)
+        if size is not None:
+            _observe("queue_http_response_size_bytes", labels, size)
+        due = time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        flush()
+
+
+def flush():
+    """Write this process' totals to its file (atomically, via rename)."""
+    with _lock:
+        rows = [[metric, list(labels), value] for (metric, labels), value in _samples.items()]
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(rows, f)
+    os.replace(tmp, path)
+
+
+def collect():
+    """Sum the files of every worker into ``{(metric, labels): value}``."""
+    flush()
+    totals = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name)) as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            continue  # a worker's file vanished or is being cleaned up
+        for metric, labels, value in rows:
+            key = (metric, tuple(tuple(pair) for pair in labels))
+            if isinstance(value, list):
+                current = totals.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    current[i] += v
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escape = {ord("\\"): "\\\\", ord('"'): '\\"', ord("\n"): "\\n"}
+    return "{" + ",".join(f'{k}="{str(v).translate(escape)}"' for k, v in pairs) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (0.0.4)."""
+    totals = collect()
+    lines = []
+    for metric, help_text in COUNTERS.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f"{metric}{_labels(labels)} {value:g}"
+                  for (name, labels), value in sorted(totals.items()) if name == metric]
+    for metric, (help_text, bounds) in HISTOGRAMS.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for (name, labels), value in sorted(totals.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip([f"{b:g}" for b in bounds] + ["+Inf"], value[:-1]):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {value[-1]:g}")
+            lines.append(f"{metric}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
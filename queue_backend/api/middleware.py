@@ -0,0 +1,164 @@
+# queue_backend/api/middleware.py
+import cProfile
+import hashlib
+import io
+import marshal
+import pstats
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics, routers
+from .authentication import TokenAuthentication
+from .models import RequestProfile
+
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+
+class MetricsMiddleware:
+    """
+    Times every request and counts its database queries (through an execute
+    wrapper on each connection, so nothing is kept per query), then records
+    them in metrics.py under the resolved URL name. Put it first in
+    MIDDLEWARE so the time includes the other middleware.
+    """
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db = {"queries": 0, "seconds": 0.0}
+
+        def count(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db["queries"] += 1
+                db["seconds"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        metrics.record(
+            view=(match.url_name or match.view_name) if match else "unmatched",
+            method=request.method if request.method in METHODS else "other",
+            status=response.status_code,
+            seconds=elapsed,
+            queries=db["queries"],
+            db_seconds=db["seconds"],
+            size=None if response.streaming else len(response.content),
+        )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Runs a request under cProfile and records its SQL when a staff user asks
+    for it with an ``X-Profile: 1`` header or a ``?_profile=1`` query flag.
+    The capture is saved as a RequestProfile (see /api/profiles/) and its id
+    returned in an ``X-Profile-Id`` header. Requests without the flag only pay
+    for the flag check. Goes after AuthenticationMiddleware; API keys are
+    checked here too, since DRF only authenticates inside the view.
+    """
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if "HTTP_X_PROFILE" not in request.META and "_profile" not in request.META.get("QUERY_STRING", ""):
+            return self.get_response(request)
+        user = self.staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        queries = []
+
+        def capture(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append({"sql": sql, "seconds": round(time.perf_counter() - started, 6)})
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(capture))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)  # takes the profiler's stats over
+        stats.sort_stats("cumulative").print_stats(40)
+        match = request.resolver_match
+        profile = RequestProfile.objects.create(
+            user=user,
+            method=request.method,
+            path=request.get_full_path()[:500],
+            view=(match.url_name or match.view_name) if match else "",
+            status=response.status_code,
+            duration=duration,
+            query_count=len(queries),
+            query_seconds=sum(q["seconds"] for q in queries),
+            queries=queries,
+            summary=summary.getvalue(),
+            stats=marshal.dumps(stats.stats),
+        )
+        self.prune()
+        response["X-Profile-Id"] = str(profile.id)
+        return response
+
+    @staticmethod
+    def staff_user(request):
+        user = getattr(request, "user", None)
+        if user is None or not user.is_authenticated:
+            try:
+                user, _ = TokenAuthentication().authenticate(request) or (None, None)
+            except AuthenticationFailed:
+                return None
+        return user if user is not None and user.is_staff else None
+
+    @staticmethod
+    def prune():
+        # keep the newest PROFILE_KEEP captures
+        older = list(RequestProfile.objects.order_by("-id").values_list("id", flat=True)[
+            settings.PROFILE_KEEP:settings.PROFILE_KEEP + 1])
+        if older:
+            RequestProfile.objects.filter(id__lte=older[0]).delete()
+
+
+class ReplicaPinMiddleware:
+    """
+    Lets the request's reads use a read replica (see routers.py), keyed for
+    read-your-writes pinning by its API key or session cookie, hashed. Only
+    installed when replicas are configured.
+    """
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        identity = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if identity:
+            identity = hashlib.sha256(identity.encode()).hexdigest()
+        with routers.replica_reads(identity, writing=request.method not in SAFE_METHODS):
+            return self.get_response(request)
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_token_remarks_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceDayCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('last_number', models.IntegerField(default=0)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_counters', to='api.service')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('service', 'date'), name='uniq_counter_service_date')],
+            },
+        ),
+    ]
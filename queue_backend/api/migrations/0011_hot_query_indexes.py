@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_servicedaycounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-timestamp'], name='notification_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['service', 'appointment_date', 'appointment_time', 'token_number'], name='token_service_day_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['service', 'appointment_date', 'status'], name='token_service_day_status_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_notificationcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthTokenUsage',
+            fields=[
+                ('key', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('last_used', models.DateField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_authtokenusage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedToken',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('token_number', models.IntegerField()),
+                ('status', models.CharField(max_length=20)),
+                ('issued_at', models.DateTimeField()),
+                ('visitor_name', models.CharField(blank=True, max_length=150, null=True)),
+                ('appointment_date', models.DateField(blank=True, null=True)),
+                ('appointment_time', models.TimeField(blank=True, null=True)),
+                ('remarks', models.TextField(blank=True, null=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_tokens', to='api.service')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-id'], name='archived_token_user_idx'), models.Index(fields=['service', 'appointment_date'], name='archived_token_service_day_idx')],
+            },
+        ),
+    ]
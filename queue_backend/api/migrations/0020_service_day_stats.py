@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_archivedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedtoken',
+            name='called_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedtoken',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='called_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ServiceDayStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('issued', models.IntegerField(default=0)),
+                ('waiting', models.IntegerField(default=0)),
+                ('calling', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('first_issued_at', models.DateTimeField(blank=True, null=True)),
+                ('last_issued_at', models.DateTimeField(blank=True, null=True)),
+                ('waited', models.IntegerField(default=0)),
+                ('wait_seconds', models.FloatField(default=0)),
+                ('served', models.IntegerField(default=0)),
+                ('service_seconds', models.FloatField(default=0)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_stats', to='api.service')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'service'], name='stats_date_service_idx')],
+                'constraints': [models.UniqueConstraint(fields=('service', 'date'), name='uniq_stats_service_date')],
+            },
+        ),
+    ]
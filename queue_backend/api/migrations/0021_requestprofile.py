@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_service_day_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('view', models.CharField(blank=True, default='', max_length=100)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duration', models.FloatField(help_text='seconds')),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('query_seconds', models.FloatField(default=0)),
+                ('queries', models.JSONField(default=list)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('stats', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def mark_existing_keys_used(apps, schema_editor):
+    # usage is only recorded from 0018 on; count every key that predates it as
+    # used today, so the first apply_retention run does not log out active users
+    AuthToken = apps.get_model('authtoken', 'Token')
+    AuthTokenUsage = apps.get_model('api', 'AuthTokenUsage')
+    today = timezone.now().date()
+    keys = AuthToken.objects.order_by('key').values_list('key', flat=True)
+    batch = []
+    for key in keys.iterator(chunk_size=1000):
+        batch.append(AuthTokenUsage(key=key, last_used=today))
+        if len(batch) == 1000:
+            AuthTokenUsage.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    AuthTokenUsage.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_requestprofile'),
+        ('authtoken', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_existing_keys_used, migrations.RunPython.noop),
+    ]
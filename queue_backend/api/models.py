@@ -1,6 +1,13 @@
 # queue_backend/api/models.py
-from django.db import models
+import copy
+from collections import defaultdict
+
+from django.db import connection, models, transaction
+from django.db.models import Count, F, Max, Value
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 
 class Provider(models.Model):
     name = models.CharField(max_length=150)
@@ -33,11 +40,151 @@ class Token(models.Model):
     appointment_date = models.DateField(null=True, blank=True)
     appointment_time = models.TimeField(null=True, blank=True)
     remarks = models.TextField(blank=True, null=True)
+    # ServiceDayCounter.version of this token's last change
+    version = models.BigIntegerField(default=0)
+    # when the token was last called, and when it left the queue (for ServiceDayStats)
+    called_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # tokens-by-service poll: filter (service, day), order by time/number
+            models.Index(fields=["service", "appointment_date", "appointment_time", "token_number"],
+                         name="token_service_day_order_idx"),
+            # cancel-all: waiting tokens for a service-day
+            models.Index(fields=["service", "appointment_date", "status"], name="token_service_day_status_idx"),
+            # delta polls: what changed in a service-day since a version
+            models.Index(fields=["service", "appointment_date", "version"], name="token_service_day_version_idx"),
+            # ?user=me history pages
+            models.Index(fields=["user", "-id"], name="token_user_history_idx"),
+        ]
 
     def __str__(self):
         who = self.visitor_name or (self.user.username if self.user else "User")
         return f"#{self.token_number} - {who} - {self.status}"
 
+    @classmethod
+    def cancel_waiting(cls, versions, date, remarks):
+        """
+        Cancel every waiting token of the given services on ``date``. Returns
+        (the cancelled tokens, the same tokens as they were before, in the same
+        order). ``versions`` maps service id -> queue version to stamp on its
+        tokens (bump the counters first so locks are always taken counter then
+        token). On Postgres and SQLite this is one UPDATE ... RETURNING, which
+        locks the rows it changes; run it inside the caller's transaction.
+        """
+        if not versions:
+            return [], []
+        service_ids = sorted(versions)
+        if connection.vendor not in ("postgresql", "sqlite"):
+            return cls._cancel_waiting_locked(versions, date, remarks)
+
+        table = connection.ops.quote_name(cls._meta.db_table)
+        cases = " ".join("WHEN %s THEN %s" for _ in service_ids)
+        placeholders = ", ".join("%s" for _ in service_ids)
+        now = timezone.now()
+        params = ["cancelled", remarks, connection.ops.adapt_datetimefield_value(now)]
+        params += [value for sid in service_ids for value in (sid, versions[sid])]
+        params += service_ids + [connection.ops.adapt_datefield_value(date), "waiting"]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET status = %s, remarks = %s, finished_at = %s, version = CASE service_id {cases} END "
+                f"WHERE service_id IN ({placeholders}) AND appointment_date = %s AND status = %s "
+                f"RETURNING id, token_number, user_id, service_id",
+                params,
+            )
+            rows = cursor.fetchall()
+        cancelled = [
+            cls(id=pk, token_number=number, user_id=user_id, service_id=service_id, status="cancelled",
+                appointment_date=date, remarks=remarks, version=versions[service_id], finished_at=now)
+            for pk, number, user_id, service_id in sorted(rows)
+        ]
+        before = [copy.copy(token) for token in cancelled]
+        for token in before:
+            token.status, token.finished_at = "waiting", None
+        return cancelled, before
+
+    @classmethod
+    def call_next(cls, service_id, date, version, previous="completed"):
+        """
+        Close the service-day's current ``calling`` token(s) as ``previous`` and
+        move the first waiting token to ``calling``, stamping both with
+        ``version``. Returns (closed tokens, called token or None, copies of
+        the changed tokens as they were, in the same order). Bump the
+        counter first: its row lock serializes callers of the same queue, and
+        the waiting row is picked with SKIP LOCKED where the backend has it so
+        a token held by another writer is passed over instead of waited on.
+        """
+        queue = cls.objects.filter(service_id=service_id, appointment_date=date)
+        current = list(queue.select_for_update().filter(status="calling").order_by("id"))
+
+        waiting = queue.filter(status="waiting").order_by("appointment_time", "token_number")
+        waiting = waiting.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+        called = waiting.first()
+
+        before = [copy.copy(token) for token in current + ([called] if called else [])]
+        now = timezone.now()
+        if current:
+            cls.objects.filter(pk__in=[t.pk for t in current]).update(status=previous, version=version, finished_at=now)
+            for token in current:
+                token.status, token.version, token.finished_at = previous, version, now
+        if called:
+            cls.objects.filter(pk=called.pk).update(status="calling", version=version, called_at=now)
+            called.status, called.version, called.called_at = "calling", version, now
+        return current, called, before
+
+    @classmethod
+    def _cancel_waiting_locked(cls, versions, date, remarks):
+        # portable fallback: lock, then one UPDATE per service
+        tokens = list(cls.objects.select_for_update().filter(
+            service_id__in=versions, appointment_date=date, status="waiting").order_by("id"))
+        before = [copy.copy(token) for token in tokens]
+        now = timezone.now()
+        for service_id, version in versions.items():
+            cls.objects.filter(pk__in=[t.pk for t in tokens if t.service_id == service_id]).update(
+                status="cancelled", remarks=remarks, version=version, finished_at=now)
+        for token in tokens:
+            token.status, token.remarks, token.version = "cancelled", remarks, versions[token.service_id]
+            token.finished_at = now
+        return tokens, before
+
+
+class ArchivedToken(models.Model):
+    """
+    Tokens of past days, moved out of Token by `manage.py archive_tokens`
+    with their original ids so the live table only holds today's and future
+    queues. Same columns as Token; history reads page over both tables.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    token_number = models.IntegerField()
+    status = models.CharField(max_length=20)
+    issued_at = models.DateTimeField()
+    visitor_name = models.CharField(max_length=150, blank=True, null=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name="archived_tokens")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name="archived_tokens")
+    appointment_date = models.DateField(null=True, blank=True)
+    appointment_time = models.TimeField(null=True, blank=True)
+    remarks = models.TextField(blank=True, null=True)
+    version = models.BigIntegerField(default=0)
+    called_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-id"], name="archived_token_user_idx"),
+            models.Index(fields=["service", "appointment_date"], name="archived_token_service_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"#{self.token_number} - {self.status} (archived)"
+
+    @classmethod
+    def copied_fields(cls):
+        # column attnames shared with Token, i.e. everything but archived_at
+        return [f.attname for f in Token._meta.concrete_fields]
+
 
 class AuditLog(models.Model):
     action = models.CharField(max_length=150)
@@ -73,5 +220,365 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-timestamp", "-id"], name="notification_user_recent_idx"),
+        ]
+
     def __str__(self):
         return f"To {self.user.username}: {self.message[:30]}"
+
+
+class NotificationCounter(models.Model):
+    """
+    Unread notifications per user, kept in step by every write path through
+    add() so the bell badge never has to count (or download) the inbox.
+    Changes are applied as increments, so concurrent writers never lose each
+    other's updates.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name="notification_counter")
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread"
+
+    @classmethod
+    def add(cls, deltas):
+        """
+        Apply ``{user_id: change in unread}``: one statement to create missing
+        rows and one UPDATE per distinct change (usually just +1).
+        """
+        deltas = {uid: delta for uid, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        cls.objects.bulk_create([cls(user_id=uid) for uid in sorted(deltas)], ignore_conflicts=True)
+        by_delta = defaultdict(list)
+        for uid, delta in deltas.items():
+            by_delta[delta].append(uid)
+        for delta, user_ids in sorted(by_delta.items()):
+            cls.objects.filter(user_id__in=user_ids).update(unread=F("unread") + delta)
+
+    @classmethod
+    def unread_for(cls, user_id):
+        return cls.objects.filter(user_id=user_id).values_list("unread", flat=True).first() or 0
+
+    @classmethod
+    def reconcile(cls):
+        """
+        Recount unread notifications and correct counters that drifted (rows
+        edited outside the API, restores). Returns the number corrected. A
+        write racing the recount can be miscounted, so run it when quiet.
+        """
+        actual = dict(Notification.objects.filter(is_read=False).values("user").annotate(n=Count("id"))
+                      .values_list("user", "n"))
+        stored = dict(cls.objects.values_list("user_id", "unread"))
+        wrong = {uid: actual.get(uid, 0) for uid in actual.keys() | stored.keys()
+                 if actual.get(uid, 0) != stored.get(uid, 0)}
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(user_id=uid) for uid in sorted(wrong)], ignore_conflicts=True)
+            for uid, unread in sorted(wrong.items()):
+                cls.objects.filter(user_id=uid).update(unread=unread)
+        return len(wrong)
+
+
+class ServiceDayCounter(models.Model):
+    """
+    Per service-day queue state: the last token number handed out, and a
+    version bumped on every change to that day's tokens (clients poll with
+    ?since=<version> and receive only what changed).
+
+    ``reset_version`` marks changes a delta cannot express (a token deleted
+    or moved away); clients older than it get a full snapshot instead. A new
+    day starts above every earlier version of the service, so a cursor from
+    yesterday also forces a full snapshot.
+    """
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name="day_counters")
+    date = models.DateField()
+    last_number = models.IntegerField(default=0)
+    version = models.BigIntegerField(default=0)
+    reset_version = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["service", "date"], name="uniq_counter_service_date"),
+        ]
+
+    def __str__(self):
+        return f"{self.service_id} @ {self.date}: #{self.last_number} v{self.version}"
+
+    @classmethod
+    def issue(cls, service_id, date):
+        """
+        Atomically claim the next token number for (service, date) and bump
+        the day's version. Returns ``(token_number, version)``.
+
+        On Postgres and SQLite this is a single UPDATE ... RETURNING, which
+        row-locks on Postgres and takes the write lock on SQLite, so two
+        concurrent bookings can never receive the same number. The first
+        booking of a day seeds the counter from tokens already issued.
+        Call inside the transaction that inserts the token so a failed insert
+        gives its number back.
+        """
+        return cls._bump(service_id, date, number=True)
+
+    @classmethod
+    def next_number(cls, service_id, date):
+        return cls.issue(service_id, date)[0]
+
+    @classmethod
+    def bump_version(cls, service_id, date, reset=False):
+        """
+        Record a change to one of the day's tokens and return the new version
+        to stamp on it. ``reset`` forces clients behind this version to resync.
+        """
+        if date is None:
+            return 0
+        return cls._bump(service_id, date, reset=reset)[1]
+
+    @classmethod
+    def _bump(cls, service_id, date, number=False, reset=False):
+        if connection.vendor not in ("postgresql", "sqlite"):
+            return cls._bump_locked(service_id, date, number, reset)
+
+        table = connection.ops.quote_name(cls._meta.db_table)
+        db_date = connection.ops.adapt_datefield_value(date)
+
+        def assignments(prefix=""):
+            # right-hand sides see the old row, so version + 1 is the new version
+            sets = [f"version = {prefix}version + 1"]
+            if number:
+                sets.append(f"last_number = {prefix}last_number + 1")
+            if reset:
+                sets.append(f"reset_version = {prefix}version + 1")
+            return ", ".join(sets)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {assignments()} "
+                f"WHERE service_id = %s AND date = %s RETURNING last_number, version",
+                [service_id, db_date],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                # first change of the day; ON CONFLICT covers a racing first booking
+                first = cls._first_version(service_id)
+                cursor.execute(
+                    f"INSERT INTO {table} (service_id, date, last_number, version, reset_version) "
+                    f"VALUES (%s, %s, %s, %s, %s) "
+                    f"ON CONFLICT (service_id, date) DO UPDATE SET {assignments(table + '.')} "
+                    f"RETURNING last_number, version",
+                    [service_id, db_date, cls._seed(service_id, date) + int(number), first, first],
+                )
+                row = cursor.fetchone()
+        return row[0], row[1]
+
+    @classmethod
+    def _bump_locked(cls, service_id, date, number, reset):
+        # portable fallback for backends without UPDATE ... RETURNING
+        with transaction.atomic():
+            counter, created = cls.objects.select_for_update().get_or_create(
+                service_id=service_id, date=date,
+                defaults={"last_number": cls._seed(service_id, date), "version": cls._first_version(service_id) - 1},
+            )
+            counter.version += 1
+            counter.last_number += int(number)
+            if reset or created:
+                counter.reset_version = counter.version
+            counter.save(update_fields=["last_number", "version", "reset_version"])
+            return counter.last_number, counter.version
+
+    @staticmethod
+    def _seed(service_id, date):
+        # legacy rows issued before the counter existed
+        return Token.objects.filter(service_id=service_id, appointment_date=date).aggregate(
+            m=Max("token_number"))["m"] or 0
+
+    @classmethod
+    def _first_version(cls, service_id):
+        return (cls.objects.filter(service_id=service_id).aggregate(m=Max("version"))["m"] or 0) + 1
+
+
+class ServiceDayStats(models.Model):
+    """
+    Running totals for one service-day, updated in the same transaction as
+    every token create, transition and delete (see stats.py) so dashboards
+    read one row per service-day instead of scanning tokens. Status columns
+    hold the number of tokens currently in that status; ``waited``/
+    ``wait_seconds`` cover issue -> latest call of every called token and
+    ``served``/``service_seconds`` call -> completion of completed ones
+    (stats.contribution).
+    """
+    STATUSES = ("waiting", "calling", "completed", "skipped", "cancelled")
+
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name="day_stats")
+    date = models.DateField()
+    issued = models.IntegerField(default=0)
+    waiting = models.IntegerField(default=0)
+    calling = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    first_issued_at = models.DateTimeField(null=True, blank=True)
+    last_issued_at = models.DateTimeField(null=True, blank=True)
+    waited = models.IntegerField(default=0)
+    wait_seconds = models.FloatField(default=0)
+    served = models.IntegerField(default=0)
+    service_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["service", "date"], name="uniq_stats_service_date"),
+        ]
+        indexes = [
+            # all-services date range (admin dashboard)
+            models.Index(fields=["date", "service"], name="stats_date_service_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.service_id} @ {self.date}: {self.issued} issued"
+
+    @property
+    def average_wait(self):
+        return self.wait_seconds / self.waited if self.waited else None
+
+    @property
+    def average_service(self):
+        return self.service_seconds / self.served if self.served else None
+
+    @classmethod
+    def add(cls, service_id, date, issued_at=None, **deltas):
+        """
+        Increment the (service, date) row by ``deltas`` (field -> change) and
+        widen its issue-time range to ``issued_at``. Two statements; the row
+        is created on first use.
+        """
+        updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if issued_at is not None:
+            updates["first_issued_at"] = Least(Coalesce("first_issued_at", Value(issued_at)), Value(issued_at))
+            updates["last_issued_at"] = Greatest(Coalesce("last_issued_at", Value(issued_at)), Value(issued_at))
+        if date is None or not updates:
+            return
+        cls.objects.bulk_create([cls(service_id=service_id, date=date)], ignore_conflicts=True)
+        cls.objects.filter(service_id=service_id, date=date).update(**updates)
+
+
+class QueueEvent(models.Model):
+    """
+    Short-lived change feed read by the live event stream (see events.py).
+    Rows are appended by the token write paths and pruned after a few minutes.
+    """
+    channel = models.CharField(max_length=50)
+    kind = models.CharField(max_length=20)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.id} {self.channel} {self.kind}"
+
+
+class ResourceVersion(models.Model):
+    """
+    Change counter per cacheable resource ("directory" for providers and
+    services, "notifications:<user id>" per inbox). Read endpoints build their
+    ETag from it instead of querying and hashing the response body.
+    """
+    DIRECTORY = "directory"
+
+    key = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+    @staticmethod
+    def notifications_key(user_id):
+        return f"notifications:{user_id}"
+
+    @classmethod
+    def bump(cls, *keys):
+        # two statements however many keys: make sure the rows exist, then
+        # increment them all (safe when another request creates one first)
+        if not keys:
+            return
+        cls.objects.bulk_create([cls(key=key) for key in keys], ignore_conflicts=True)
+        cls.objects.filter(key__in=keys).update(version=F("version") + 1)
+
+    @classmethod
+    def current(cls, key):
+        return cls.objects.filter(key=key).values_list("version", flat=True).first() or 0
+
+
+class Job(models.Model):
+    """
+    Durable outbox of background work (see jobs.py). Request handlers insert
+    a row in their own transaction, so the job exists exactly when the change
+    that caused it commits; `manage.py run_jobs` claims and runs it.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (RUNNING, "Running"), (FAILED, "Failed")]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="job_claim_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.kind} ({self.status}, {self.attempts} attempts)"
+
+
+class AuthTokenUsage(models.Model):
+    """
+    Day an API key (rest_framework.authtoken) was last used, recorded by
+    authentication.TokenAuthentication so `manage.py apply_retention` can
+    drop keys nobody uses any more. Keyed by the token key rather than a
+    foreign key so deleting keys stays a plain range DELETE.
+    """
+    key = models.CharField(max_length=40, primary_key=True)
+    last_used = models.DateField()
+
+    def __str__(self):
+        return f"{self.key[:8]}… {self.last_used}"
+
+    @classmethod
+    def touch(cls, key):
+        # at most one write per key per day per cache
+        today = timezone.now().date()
+        if cache.add(f"auth-token-used:{key}:{today.isoformat()}", True, 60 * 60 * 24):
+            cls.objects.bulk_create([cls(key=key, last_used=today)], update_conflicts=True,
+                                    unique_fields=["key"], update_fields=["last_used"])
+
+
+class RequestProfile(models.Model):
+    """
+    One request captured by ProfilingMiddleware (staff only, on demand): the
+    cProfile stats in the format pstats.Stats loads, a text summary, and the
+    SQL statements it ran with their timings.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name="+")
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view = models.CharField(max_length=100, blank=True, default="")
+    status = models.PositiveSmallIntegerField()
+    duration = models.FloatField(help_text="seconds")
+    query_count = models.PositiveIntegerField(default=0)
+    query_seconds = models.FloatField(default=0)
+    queries = models.JSONField(default=list)
+    summary = models.TextField(blank=True, default="")
+    stats = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration * 1000:.0f} ms)"
@@ -0,0 +1,100 @@
+# queue_backend/api/notifications.py
+"""
+User notifications: message text, inbox change counters, and the background
+jobs that deliver token status updates and bulk cancellations. Every write path goes through
+deliver()/notifications_changed() so unread counters, ETag versions and live
+events stay in step with the Notification table.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+from . import events, jobs
+from .models import Notification, NotificationCounter, ResourceVersion, Token
+
+NOTIFY_STATUS = "notify_status"
+NOTIFY_CANCELLED = "notify_cancelled"
+
+
+def status_message(token, service):
+    """
+    The notification text for a token entering its current status, or None.
+    """
+    provider_name = service.provider.name if service.provider else "Hospital"
+    label = f"Token #{token.token_number} at {provider_name} ({service.name})"
+    if token.status == 'calling':
+        return f"📢 ALERT: Token #{token.token_number} is now CALLED at {provider_name} ({service.name}). Please proceed immediately."
+    if token.status == 'skipped':
+        return f"{label} has been marked as SKIPPED."
+    if token.status == 'cancelled':
+        return f"{label} has been CANCELLED."
+    if token.status == 'completed':
+        return f"{label} session marked as COMPLETED."
+    return None
+
+
+def notifications_changed(*user_ids, unread=None):
+    """
+    Record that these users' inboxes changed. ``unread`` maps user id ->
+    change in their unread count, when there is one.
+    """
+    NotificationCounter.add(unread or {})
+    ResourceVersion.bump(*(ResourceVersion.notifications_key(uid) for uid in sorted(set(user_ids))))
+
+
+def deliver(notifications):
+    """
+    Book-keeping for freshly inserted notifications: unread counters, inbox
+    versions and the live event to each recipient.
+    """
+    unread = Counter(n.user_id for n in notifications if not n.is_read)
+    notifications_changed(*(n.user_id for n in notifications), unread=unread)
+    events.emit_notifications(notifications)
+
+
+def cancelled_message(token_number, remarks):
+    return f"Your appointment #{token_number} has been cancelled. Reason: {remarks}"
+
+
+def enqueue_status_change(token):
+    """
+    Queue the "your token is now <status>" notification for ``token``'s
+    user. Call inside the transaction that changed the status.
+    """
+    if token.user_id:
+        jobs.enqueue(NOTIFY_STATUS, {"token": token.id, "status": token.status})
+
+
+def enqueue_cancelled(tokens, remarks):
+    """
+    Queue one job that tells every user among ``tokens`` their appointment
+    was cancelled. Call inside the transaction that cancelled them.
+    """
+    ids = [token.id for token in tokens if token.user_id]
+    if ids:
+        jobs.enqueue(NOTIFY_CANCELLED, {"tokens": ids, "remarks": remarks})
+
+
+@jobs.handler(NOTIFY_STATUS)
+def notify_status(payload):
+    token = Token.objects.select_related("service__provider").filter(pk=payload["token"]).first()
+    if token is None or token.user_id is None:
+        return  # deleted since; nobody to tell
+    # report the status the job was queued for even if the token has moved on
+    token.status = payload["status"]
+    message = status_message(token, token.service)
+    if not message:
+        return
+    with transaction.atomic():
+        deliver([Notification.objects.create(user_id=token.user_id, message=message)])
+
+
+@jobs.handler(NOTIFY_CANCELLED)
+def notify_cancelled(payload):
+    tokens = Token.objects.filter(pk__in=payload["tokens"], user__isnull=False).values_list(
+        "user_id", "token_number")
+    with transaction.atomic():
+        deliver(Notification.objects.bulk_create([
+            Notification(user_id=user_id, message=cancelled_message(number, payload["remarks"]))
+            for user_id, number in tokens
+        ]))
@@ -0,0 +1,103 @@
+# queue_backend/api/pagination.py
+from heapq import merge
+from operator import attrgetter
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class MergedQuerySet:
+    """
+    Read-only concatenation of querysets over disjoint rows (e.g. live and
+    archived tokens) for CursorPagination, which only orders, filters by
+    position and slices. Each slice reads that many rows from every part and
+    merges them, so a page is still one indexed range read per table.
+    Single-field orderings only.
+    """
+    def __init__(self, *querysets, ordering=None):
+        self.querysets = querysets
+        self.ordering = ordering
+
+    def order_by(self, *ordering):
+        assert len(ordering) == 1, "MergedQuerySet orders by a single field"
+        return MergedQuerySet(*(qs.order_by(*ordering) for qs in self.querysets), ordering=ordering[0])
+
+    def filter(self, *args, **kwargs):
+        return MergedQuerySet(*(qs.filter(*args, **kwargs) for qs in self.querysets), ordering=self.ordering)
+
+    def __getitem__(self, k):
+        assert isinstance(k, slice) and self.ordering, "slice an ordered MergedQuerySet"
+        field = self.ordering.lstrip("-")
+        rows = merge(*(list(qs[:k.stop]) for qs in self.querysets),
+                     key=attrgetter(field), reverse=self.ordering.startswith("-"))
+        return list(rows)[k]
+
+
+class KeysetQuerySet:
+    """
+    Adapts a queryset ordered by (field, id) for CursorPagination, which only
+    filters on the first ordering field. Given a "value|id" position it reads
+    strictly after that row, so rows sharing a value are neither skipped nor
+    repeated and no page needs an offset past them.
+    """
+    def __init__(self, queryset, field):
+        self.queryset = queryset
+        self.field = field
+
+    def order_by(self, *ordering):
+        return KeysetQuerySet(self.queryset.order_by(*ordering), self.field)
+
+    def filter(self, **kwargs):
+        (lookup, position), = kwargs.items()
+        value, pk = position.rsplit("|", 1)
+        op = lookup.rpartition("__")[2]
+        after = Q(**{lookup: value}) | Q(**{self.field: value, f"id__{op}": pk})
+        return KeysetQuerySet(self.queryset.filter(after), self.field)
+
+    def __getitem__(self, k):
+        return self.queryset[k]
+
+
+class TokenCursorPagination(CursorPagination):
+    """
+    Keyset pagination for token history: each page is an indexed range read
+    after the cursor, so cost stays flat however many tokens exist.
+    Page size defaults to settings.API_PAGE_SIZE; clients may pass ?page_size=.
+    """
+    page_size = None  # settings.API_PAGE_SIZE, read per request
+    ordering = "-id"
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+    def get_page_size(self, request):
+        return super().get_page_size(request) or getattr(settings, "API_PAGE_SIZE", 50)
+
+
+class NotificationCursorPagination(TokenCursorPagination):
+    """
+    Newest first by (timestamp, id). Notifications bulk-created for a queue
+    share a timestamp, so the cursor carries both and resumes after the exact
+    row (KeysetQuerySet), an indexed range read on (user, -timestamp, -id).
+    """
+    ordering = ("-timestamp", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return super().paginate_queryset(KeysetQuerySet(queryset, "timestamp"), request, view)
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor and cursor.position is not None:
+            value, _, pk = cursor.position.rpartition("|")
+            try:
+                valid = parse_datetime(value) is not None and pk.isdigit()
+            except ValueError:
+                valid = False
+            if not valid:
+                raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def _get_position_from_instance(self, instance, ordering):
+        return f"{instance.timestamp.isoformat()}|{instance.pk}"
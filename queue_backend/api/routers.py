@@ -0,0 +1,115 @@
+# queue_backend/api/routers.py
+"""
+Read replicas (settings.REPLICA_DATABASES, from DATABASE_REPLICA_URLS).
+
+Only reads made while ReplicaPinMiddleware is handling a safe (GET, HEAD,
+OPTIONS) request go to a replica, and only outside transactions, so
+management commands, the job worker and every read-modify-write path keep
+reading the primary. Each request sticks to one replica. Once a request writes, it reads the primary
+for the rest of its run, and so does its client (same API key or session
+cookie) for REPLICA_PIN_SECONDS after it (read-your-writes). Writes to the
+cache table, sessions and bookkeeping models do not count, so a read-only
+poll that touches them stays on the replica. A replica that cannot be
+connected to is skipped for REPLICA_RETRY_SECONDS.
+"""
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# apps whose rows must be read back right after they are written
+PRIMARY_ONLY_APPS = {"sessions", "django_cache"}
+# bookkeeping rows written while serving reads (key usage, profiles); the
+# client never reads them back, so writing them does not pin it to the primary
+UNPINNED_MODELS = {"api.authtokenusage", "api.requestprofile"}
+
+_request = contextvars.ContextVar("replica_request", default=None)
+_down = {}  # alias -> time.monotonic() until which it is skipped
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request.get()
+        if (state is None or state["pinned"] or model._meta.app_label in PRIMARY_ONLY_APPS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        if state["replica"] is None:
+            state["replica"] = _healthy_replica() or DEFAULT_DB_ALIAS
+        return state["replica"]
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if (state is not None and model._meta.app_label not in PRIMARY_ONLY_APPS
+                and model._meta.label_lower not in UNPINNED_MODELS):
+            state["pinned"] = state["wrote"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+
+def _healthy_replica():
+    now = time.monotonic()
+    candidates = [alias for alias in settings.REPLICA_DATABASES if _down.get(alias, 0) <= now]
+    for alias in random.sample(candidates, len(candidates)):
+        connection = connections[alias]
+        if connection.connection is None:
+            try:
+                connection.ensure_connection()
+            except DatabaseError:
+                logger.warning("replica %s unreachable; reading from the primary for %ss",
+                               alias, settings.REPLICA_RETRY_SECONDS, exc_info=True)
+                _down[alias] = now + settings.REPLICA_RETRY_SECONDS
+                continue
+        return alias
+    return None
+
+
+def pin_key(identity):
+    return f"replica-pin:{identity}"
+
+
+@contextmanager
+def replica_reads(identity=None, writing=False):
+    """
+    Let reads in this block use a replica unless ``identity`` wrote within
+    the pin window, or the block is ``writing`` (its reads feed writes and
+    must not be stale). Yields the state; ``state["wrote"]`` says whether
+    the block wrote.
+    """
+    pinned = writing or bool(identity and cache.get(pin_key(identity)))
+    state = {"pinned": pinned, "wrote": False, "replica": None}
+    token = _request.set(state)
+    try:
+        yield state
+    finally:
+        _request.reset(token)
+    if state["wrote"] and identity:
+        cache.set(pin_key(identity), True, settings.REPLICA_PIN_SECONDS)
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside this block."""
+    state = _request.get()
+    if state is None or state["pinned"]:
+        yield
+        return
+    state["pinned"] = True
+    try:
+        yield
+    finally:
+        state["pinned"] = state["wrote"]
+
+
+def reading_replica():
+    state = _request.get()
+    return state is not None and not state["pinned"] and state["replica"] not in (None, DEFAULT_DB_ALIAS)
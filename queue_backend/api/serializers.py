@@ -1,6 +1,8 @@
 # queue_backend/api/serializers.py
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
 # import local models module (defensive)
 from . import models as _models
@@ -14,10 +16,84 @@ ProviderModel = getattr(_models, "Provider", None)
 AuditLogModel = getattr(_models, "AuditLog", None)
 
 
+# -------------------------
+# Sparse fieldsets
+# -------------------------
+def requested_shape(request):
+    """
+    ``(fields, omit, expand)`` name sets from a GET request's ?fields=, ?omit=
+    and ?expand= (comma separated), or None when it asks for the default shape.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    params = request.query_params
+    shape = tuple({name for name in params.get(key, "").split(",") if name} for key in ("fields", "omit", "expand"))
+    return shape if any(shape) else None
+
+
+class SparseFieldsMixin:
+    """
+    Lets GET requests choose what the top-level serializer returns:
+    ?fields=a,b keeps only those fields, ?omit=a,b drops them, and ?expand=x
+    nests the related object in place of its id (for names in ``expandable``).
+    Unknown names are ignored. Without them the output is unchanged.
+
+    Views pass their querysets through ``optimize()`` so only the relations a
+    rendered field reads (``relations``) are joined and, for shaped requests,
+    columns no field reads are deferred.
+    """
+    # field -> relation paths it reads
+    relations = {}
+    # field -> (serializer nested by ?expand=, relation path it reads)
+    expandable = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        shape = self._shape()
+        if shape is None:
+            return fields
+        only, omit, expand = shape
+        for name in expand & self.expandable.keys():
+            fields[name] = self.expandable[name][0](read_only=True)
+        return {name: field for name, field in fields.items()
+                if (not only or name in only) and name not in omit}
+
+    def _shape(self):
+        # nested serializers (expanded ones too) keep their default shape
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return None if parent is not None else requested_shape(self.context.get("request"))
+
+    @classmethod
+    def eager(cls, queryset):
+        # every relation the default shape reads, in the same query
+        return queryset.select_related(*{path for paths in cls.relations.values() for path in paths})
+
+    def optimize(self, queryset):
+        model = queryset.model
+        columns, joins = {model._meta.pk.name}, set()
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            joins.update(self.relations.get(name, ()))
+            if isinstance(field, serializers.BaseSerializer) and name in self.expandable:
+                joins.add(self.expandable[name][1])
+            if field.source != "*":
+                columns.add(field.source.split(".")[0])
+        if joins:
+            queryset = queryset.select_related(*joins)
+        if self._shape() is None:
+            return queryset
+        columns.update(path.split("__")[0] for path in joins)
+        deferred = [f.name for f in model._meta.concrete_fields if f.name not in columns]
+        return queryset.defer(*deferred) if deferred else queryset
+
+
 # -------------------------
 # Provider Serializer
 # -------------------------
-class ProviderSerializer(serializers.ModelSerializer):
+class ProviderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = _models.Provider
         fields = "__all__"
@@ -34,9 +110,12 @@ if ServiceModel is None:
         name = serializers.CharField()
         description = serializers.CharField(allow_blank=True, required=False)
 else:
-    class ServiceSerializer(serializers.ModelSerializer):
+    class ServiceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
         provider_name = serializers.ReadOnlyField(source='provider.name')
 
+        relations = {"provider_name": ("provider",)}
+        expandable = {"provider": (ProviderSerializer, "provider")}
+
         class Meta:
             model = ServiceModel
             fields = "__all__"
@@ -74,10 +153,14 @@ if TokenModel is None:
                 return svc.provider.name
             return None
 else:
-    class TokenSerializer(serializers.ModelSerializer):
+    class TokenSerializer(SparseFieldsMixin, serializers.ModelSerializer):
         service_name = serializers.SerializerMethodField(read_only=True)
         provider_name = serializers.SerializerMethodField(read_only=True)
 
+        # service_name/provider_name walk token -> service -> provider
+        relations = {"service_name": ("service",), "provider_name": ("service__provider",)}
+        expandable = {"service": (ServiceSerializer, "service__provider")}
+
         class Meta:
             model = TokenModel
             # compute fields from model to avoid brittle list building
@@ -96,7 +179,13 @@ else:
                 # "status": {"read_only": True},  <-- removed to allow updates
                 "issued_at": {"read_only": True},
                 "user": {"read_only": True},
+                "version": {"read_only": True},
+                "called_at": {"read_only": True},
+                "finished_at": {"read_only": True},
             }
+            if ServiceModel is not None:
+                # the service a token is created for is returned with its provider name
+                extra_kwargs["service"] = {"queryset": ServiceModel.objects.select_related("provider")}
 
         def get_service_name(self, obj):
             # obj.service may be FK instance or id
@@ -117,6 +206,28 @@ else:
             return None
 
 
+# fields the public queue board shows (?view=compact on tokens-by-service)
+COMPACT_TOKEN_FIELDS = ("id", "token_number", "status", "visitor_name", "appointment_date", "appointment_time")
+
+
+def compact_tokens(queryset):
+    """
+    Queue-board rows as plain dicts, built straight from one ``values_list``
+    query: no model instances, no joins and no serializer fields per row.
+    """
+    rows = []
+    for pk, number, status, visitor, day, at in queryset.values_list(*COMPACT_TOKEN_FIELDS):
+        rows.append({
+            "id": pk,
+            "token_number": number,
+            "status": status,
+            "visitor_name": visitor,
+            "appointment_date": day.isoformat() if day else None,
+            "appointment_time": at.isoformat() if at else None,
+        })
+    return rows
+
+
 # -------------------------
 # AuditLog Serializer (optional)
 # -------------------------
@@ -182,12 +293,16 @@ class RegisterSerializer(serializers.ModelSerializer):
         age = validated_data.pop("age")
         dob = validated_data.pop("dob")
         password = validated_data.pop("password")
-        
-        user = User.objects.create_user(
-            username=validated_data.get("username"),
-            email=validated_data.get("email", ""),
-            password=password
+        # RegisterView hashes outside its transaction and passes the result in
+        encoded = validated_data.pop("encoded_password", None) or make_password(password)
+
+        # what create_user() does, minus hashing the password again
+        user = User(
+            username=User.normalize_username(validated_data.get("username")),
+            email=User.objects.normalize_email(validated_data.get("email", "")),
+            password=encoded,
         )
+        user.save()
         
         # Create UserProfile
         _models.UserProfile.objects.create(user=user, phone=phone, age=age, dob=dob)
@@ -217,14 +332,51 @@ class StaffCreateSerializer(serializers.ModelSerializer):
         )
         return user
 
-class ServiceStaffSerializer(serializers.ModelSerializer):
+class ServiceStaffSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Retrieve nested data for display
     user_name = serializers.ReadOnlyField(source='user.username')
     service_name = serializers.ReadOnlyField(source='service.name')
     provider_name = serializers.ReadOnlyField(source='service.provider.name')
     provider_location = serializers.ReadOnlyField(source='service.provider.location')
 
+    relations = {
+        "user_name": ("user",),
+        "service_name": ("service",),
+        "provider_name": ("service__provider",),
+        "provider_location": ("service__provider",),
+    }
+    expandable = {"service": (ServiceSerializer, "service__provider")}
+
     class Meta:
         model = _models.ServiceStaff
         fields = ['id', 'user', 'user_name', 'service', 'service_name', 'provider_name', 'provider_location', 'created_at']
         read_only_fields = ['created_at']
+
+
+class ServiceDayStatsSerializer(serializers.ModelSerializer):
+    service_name = serializers.ReadOnlyField(source='service.name')
+    average_wait = serializers.FloatField(read_only=True)
+    average_service = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = _models.ServiceDayStats
+        fields = ['service', 'service_name', 'date', 'issued', 'waiting', 'calling', 'completed', 'skipped',
+                  'cancelled', 'first_issued_at', 'last_issued_at', 'average_wait', 'average_service']
+
+    @staticmethod
+    def eager(queryset):
+        return queryset.select_related("service")
+
+
+class RequestProfileSerializer(serializers.ModelSerializer):
+    username = serializers.ReadOnlyField(source='user.username')
+
+    class Meta:
+        model = _models.RequestProfile
+        fields = ['id', 'created_at', 'username', 'method', 'path', 'view', 'status', 'duration',
+                  'query_count', 'query_seconds']
+
+
+class RequestProfileDetailSerializer(RequestProfileSerializer):
+    class Meta(RequestProfileSerializer.Meta):
+        fields = RequestProfileSerializer.Meta.fields + ['summary', 'queries']
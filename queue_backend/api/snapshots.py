@@ -0,0 +1,74 @@
+# queue_backend/api/snapshots.py
+"""
+Shared cache of the serialized queue for one service-day.
+
+Every viewer of a queue gets the same list, so it is serialized once and kept
+in the Django cache (locmem, file or database backend). Entries record the
+queue and directory versions they were built from and are ignored once either
+moves on, so a snapshot rebuilt from a racing read can never be served stale;
+the token write paths also drop the entry on commit to free it early.
+
+Hit/miss counters live in the same cache, so with a shared backend (file,
+database) they add up across all gunicorn workers.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+TIMEOUT = 60 * 60
+HITS_KEY = "queue-snapshot:hits"
+MISSES_KEY = "queue-snapshot:misses"
+
+
+# representations cached per service-day: the full TokenSerializer rows and
+# the queue board's ?view=compact rows
+VIEWS = ("full", "compact")
+
+
+def _key(service_id, date, view="full"):
+    key = f"queue-snapshot:{service_id}:{date.isoformat()}"
+    return key if view == "full" else f"{key}:{view}"
+
+
+def get_or_build(service_id, date, version, directory, build, view="full"):
+    """
+    Return the cached ``view`` list for (service, date) at ``version``/``directory``,
+    calling ``build()`` and storing its result on a miss.
+    """
+    key = _key(service_id, date, view)
+    entry = cache.get(key)
+    if entry and entry["version"] == version and entry["directory"] == directory:
+        _count(HITS_KEY)
+        return entry["data"]
+
+    data = build()
+    cache.set(key, {"version": version, "directory": directory, "data": data}, TIMEOUT)
+    _count(MISSES_KEY)
+    return data
+
+
+def invalidate(service_id, date):
+    """
+    Drop the snapshot once the current transaction commits.
+    """
+    if date is None:
+        return
+    keys = [_key(service_id, date, view) for view in VIEWS]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def stats():
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {"hits": counts.get(HITS_KEY, 0), "misses": counts.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # first count (or evicted); add() loses to a racing creator, then incr
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
@@ -0,0 +1,79 @@
+# queue_backend/api/stats.py
+"""
+Incremental upkeep of ServiceDayStats. Token write paths call these inside
+the transaction that changes the tokens, after bumping the day's
+ServiceDayCounter, whose row lock already orders writers of a service-day.
+
+What a token adds to its row depends only on its current state
+(contribution()); a change applies the difference between the token's state
+before and after it. `manage.py backfill_service_stats` sums the same
+definition in SQL (aggregates()), so a rebuilt row equals the live one.
+"""
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Min, Q, Sum
+
+from .models import ServiceDayStats
+
+FIELDS = {f.name for f in ServiceDayStats._meta.concrete_fields}
+
+# a token counts towards waits once it has been called, and towards service
+# times once it was completed after a call
+WAITED = Q(called_at__isnull=False, issued_at__isnull=False)
+SERVED = Q(status="completed", called_at__isnull=False, finished_at__isnull=False)
+
+
+def contribution(token):
+    """What ``token`` in its current state adds to its service-day row."""
+    row = {"issued": 1, token.status: 1}
+    if token.called_at and token.issued_at:
+        row["waited"] = 1
+        row["wait_seconds"] = (token.called_at - token.issued_at).total_seconds()
+    if token.status == "completed" and token.called_at and token.finished_at:
+        row["served"] = 1
+        row["service_seconds"] = (token.finished_at - token.called_at).total_seconds()
+    return row
+
+
+def _duration(end, start, when):
+    return Sum(ExpressionWrapper(F(end) - F(start), output_field=DurationField()), filter=when)
+
+
+def aggregates():
+    """contribution() summed in SQL, for a queryset grouped by service-day."""
+    aggregates = {status: Count("id", filter=Q(status=status)) for status in ServiceDayStats.STATUSES}
+    aggregates.update(
+        issued=Count("id"),
+        first_issued_at=Min("issued_at"),
+        last_issued_at=Max("issued_at"),
+        waited=Count("id", filter=WAITED),
+        wait=_duration("called_at", "issued_at", WAITED),
+        served=Count("id", filter=SERVED),
+        service=_duration("finished_at", "called_at", SERVED),
+    )
+    return aggregates
+
+
+def _apply(service_id, date, deltas, issued_at=None):
+    ServiceDayStats.add(service_id, date, issued_at=issued_at,
+                        **{field: delta for field, delta in deltas.items() if field in FIELDS})
+
+
+def issued(token):
+    _apply(token.service_id, token.appointment_date, contribution(token), issued_at=token.issued_at)
+
+
+def removed(token):
+    """``token``, in the state it was in, left its service-day (deleted or moved)."""
+    _apply(token.service_id, token.appointment_date, {k: -v for k, v in contribution(token).items()})
+
+
+def transitioned(service_id, date, changes):
+    """
+    ``changes`` are (token before, token after) pairs of one service-day.
+    """
+    deltas = {}
+    for before, after in changes:
+        for field, value in contribution(after).items():
+            deltas[field] = deltas.get(field, 0) + value
+        for field, value in contribution(before).items():
+            deltas[field] = deltas.get(field, 0) - value
+    _apply(service_id, date, deltas)
@@ -1,8 +1,34 @@
+import asyncio
+import base64
+import hashlib
+import json
+import marshal
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token as AuthToken
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 from django.contrib.auth import get_user_model
-from .models import Service, Token
+from . import events, jobs, routers, snapshots, throttles, views
+from .notifications import deliver
+from .models import Provider, Service, ServiceStaff, Token, ServiceDayCounter, Notification, QueueEvent, Job, NotificationCounter, AuthTokenUsage, ArchivedToken, ServiceDayStats, RequestProfile
 
 User = get_user_model()
 
@@ -48,6 +74,7 @@ class AuthTests(APITestCase):
 
 class ServiceTests(APITestCase):
     def setUp(self):
+        cache.clear()  # directory responses are cached per version, which every test restarts at 0
         self.user = User.objects.create_user(username='testuser', password='testpassword123')
         self.client.force_authenticate(user=self.user)
         # Create a provider for this user
@@ -116,3 +143,1238 @@ class TokenTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         token.refresh_from_db()
         self.assertEqual(token.status, 'called')
+
+
+class TokenCounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+        self.day = date(2030, 1, 15)
+
+    def test_next_number_increments_per_service_day(self):
+        self.assertEqual(ServiceDayCounter.next_number(self.service.id, self.day), 1)
+        self.assertEqual(ServiceDayCounter.next_number(self.service.id, self.day), 2)
+        # a different day starts again from 1
+        self.assertEqual(ServiceDayCounter.next_number(self.service.id, date(2030, 1, 16)), 1)
+        self.assertEqual(ServiceDayCounter.objects.get(service=self.service, date=self.day).last_number, 2)
+
+    def test_counter_seeds_from_existing_tokens(self):
+        Token.objects.create(service=self.service, token_number=7, status='waiting', appointment_date=self.day)
+        self.assertEqual(ServiceDayCounter.next_number(self.service.id, self.day), 8)
+
+    def test_create_token_uses_counter(self):
+        data = {'service': self.service.id, 'appointment_date': self.day.isoformat()}
+        numbers = [self.client.post('/api/tokens/', data, format='json').data['token_number'] for _ in range(3)]
+        self.assertEqual(numbers, [1, 2, 3])
+
+
+class QueryPlanTests(APITestCase):
+    """
+    The polled queries must be answered from an index, never a full table scan
+    or an in-memory sort, so their latency does not grow with the Token table.
+    """
+    def explain(self, queryset):
+        if connection.vendor == 'sqlite':
+            return queryset.explain(), r'\bSCAN\b|TEMP B-TREE'
+        if connection.vendor == 'postgresql':
+            # tiny test tables would always be seq-scanned; force the planner's hand
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                return queryset.explain(), r'Seq Scan|\bSort\b'
+        self.skipTest(f'No plan check for {connection.vendor}')
+
+    def assertIndexed(self, queryset):
+        plan, bad = self.explain(queryset)
+        self.assertIsNone(re.search(bad, plan), plan)
+
+    def test_tokens_by_service_plan(self):
+        self.assertIndexed(
+            Token.objects.filter(service_id=1, appointment_date=date.today()).order_by("appointment_time", "token_number")
+        )
+
+    def test_cancel_all_plan(self):
+        self.assertIndexed(Token.objects.filter(service_id=1, appointment_date=date.today(), status='waiting'))
+
+    def test_notifications_plan(self):
+        self.assertIndexed(Notification.objects.filter(user_id=1).order_by('-timestamp', '-id'))
+
+    def test_token_history_plan(self):
+        self.assertIndexed(Token.objects.filter(user_id=1, id__lt=1000).order_by('-id'))
+
+
+class EventStreamTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+
+    def test_token_writes_emit_queue_events(self):
+        response = self.client.post('/api/tokens/', {'service': self.service.id}, format='json')
+        self.client.patch(f"/api/tokens/{response.data['id']}/", {'status': 'calling'}, format='json')
+        feed = QueueEvent.objects.filter(channel=events.service_channel(self.service.id)).order_by('id')
+        self.assertEqual([e.payload['tokens'][0]['status'] for e in feed], ['waiting', 'calling'])
+
+    def test_cancel_all_emits_notification_events(self):
+        Token.objects.create(service=self.service, token_number=1, status='waiting',
+                             appointment_date=date.today(), user=self.user)
+        ServiceStaff.objects.create(user=self.user, service=self.service)
+        self.client.post('/api/cancel-all-tokens/', {'service': self.service.id, 'remarks': 'closed'}, format='json')
+        jobs.drain()
+        self.assertTrue(QueueEvent.objects.filter(channel=events.user_channel(self.user.id), kind='notification').exists())
+
+    def test_stream_requires_a_channel(self):
+        response = self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_stream_refuses_expired_keys(self):
+        key = AuthToken.objects.create(user=self.user)
+        AuthToken.objects.filter(pk=key.pk).update(created=timezone.now() - timedelta(days=2))
+        with self.settings(AUTH_TOKEN_TTL=60 * 60 * 24):
+            response = self.client.get(f'/api/events/?service={self.service.id}&token={key.key}')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get('/api/events/?token=unknown').status_code, 401)
+
+    @mock.patch.object(events, 'POLL_INTERVAL', 0.01)
+    async def test_stream_delivers_and_replays_events(self):
+        response = await self.async_client.get(f'/api/events/?service={self.service.id}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = response.streaming_content
+        self.assertTrue((await anext(frames)).startswith(b'retry:'))
+
+        token = await Token.objects.acreate(service=self.service, token_number=1, status='waiting')
+        await sync_to_async(events.emit_queue_change)(self.service.id, None, [token])
+        frame = await asyncio.wait_for(anext(frames), 5)
+        self.assertIn(b'event: queue', frame)
+        await frames.aclose()
+
+        # reconnecting with Last-Event-ID replays what was missed
+        response = await self.async_client.get(f'/api/events/?service={self.service.id}', headers={'Last-Event-ID': '0'})
+        frames = response.streaming_content
+        await anext(frames)
+        self.assertIn(b'event: queue', await asyncio.wait_for(anext(frames), 5))
+        await frames.aclose()
+
+    @mock.patch.object(events, 'POLL_INTERVAL', 0.01)
+    async def test_stream_delivers_events_committed_out_of_id_order(self):
+        response = await self.async_client.get(f'/api/events/?service={self.service.id}')
+        frames = response.streaming_content
+        await anext(frames)
+
+        # the writer holding the lower id commits after the one holding the higher id
+        channel = events.service_channel(self.service.id)
+        first = await sync_to_async(events._latest_event_id)() + 1
+        await QueueEvent.objects.acreate(id=first + 1, channel=channel, kind='queue', payload={})
+        self.assertIn(f'id: {first + 1}\n'.encode(), await asyncio.wait_for(anext(frames), 5))
+        await QueueEvent.objects.acreate(id=first, channel=channel, kind='queue', payload={})
+        self.assertIn(f'id: {first}\n'.encode(), await asyncio.wait_for(anext(frames), 5))
+        await frames.aclose()
+
+
+class DeltaSyncTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+        self.url = f'/api/tokens-by-service/?service={self.service.id}'
+
+    def book(self):
+        return self.client.post('/api/tokens/', {'service': self.service.id}, format='json').data
+
+    def poll(self, since):
+        return self.client.get(f'{self.url}&since={since}').data
+
+    def test_since_returns_only_changed_tokens(self):
+        first, second = self.book(), self.book()
+        snapshot = self.poll(0)
+        self.assertTrue(snapshot['full'])
+        self.assertEqual([t['id'] for t in snapshot['tokens']], [first['id'], second['id']])
+
+        self.assertEqual(self.poll(snapshot['version']), {'version': snapshot['version'], 'full': False, 'tokens': []})
+
+        self.client.patch(f"/api/tokens/{first['id']}/", {'status': 'calling'}, format='json')
+        delta = self.poll(snapshot['version'])
+        self.assertFalse(delta['full'])
+        self.assertGreater(delta['version'], snapshot['version'])
+        self.assertEqual([(t['id'], t['status']) for t in delta['tokens']], [(first['id'], 'calling')])
+
+    def test_delete_forces_full_snapshot(self):
+        first, second = self.book(), self.book()
+        version = self.poll(0)['version']
+        self.client.delete(f"/api/tokens/{first['id']}/")
+        delta = self.poll(version)
+        self.assertTrue(delta['full'])
+        self.assertEqual([t['id'] for t in delta['tokens']], [second['id']])
+
+    def test_new_day_versions_start_above_previous_days(self):
+        yesterday = date.fromordinal(date.today().toordinal() - 1)
+        for _ in range(3):
+            ServiceDayCounter.issue(self.service.id, yesterday)
+        stale = ServiceDayCounter.objects.get(service=self.service, date=yesterday).version
+        self.book()
+        self.assertTrue(self.poll(stale)['full'])
+
+    def test_plain_request_still_returns_list(self):
+        self.book()
+        self.assertIsInstance(self.client.get(self.url).data, list)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        from .models import Provider
+        self.provider = Provider.objects.create(name="Test Hospital", admin=self.user)
+        self.service = Service.objects.create(name='Test Service', provider=self.provider)
+
+    def assertRevalidates(self, url, change):
+        first = self.client.get(url)
+        etag = first['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], etag)
+
+    def test_tokens_by_service(self):
+        self.assertRevalidates(
+            f'/api/tokens-by-service/?service={self.service.id}',
+            lambda: self.client.post('/api/tokens/', {'service': self.service.id}, format='json'),
+        )
+
+    def test_services_and_providers(self):
+        rename = lambda: self.client.patch(f'/api/services/{self.service.id}/', {'name': 'Renamed'}, format='json')
+        self.assertRevalidates(f'/api/services/?provider={self.provider.id}', rename)
+        self.assertRevalidates('/api/providers/', rename)
+
+    def test_notifications(self):
+        notification = Notification.objects.create(user=self.user, message='hello')
+        self.assertRevalidates(
+            '/api/notifications/',
+            lambda: self.client.patch(f'/api/notifications/{notification.id}/', {'is_read': True}, format='json'),
+        )
+
+    def test_filters_get_distinct_etags(self):
+        etag = self.client.get('/api/services/')['ETag']
+        self.assertNotEqual(self.client.get(f'/api/services/?provider={self.provider.id}')['ETag'], etag)
+
+
+class QueueSnapshotTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+        self.url = f'/api/tokens-by-service/?service={self.service.id}'
+
+    def book(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/tokens/', {'service': self.service.id}, format='json').data
+
+    def test_repeat_reads_hit_the_snapshot(self):
+        self.book()
+        first = self.client.get(self.url).data
+        second = self.client.get(self.url).data
+        self.assertEqual(first, second)
+        self.assertEqual(snapshots.stats(), {'hits': 1, 'misses': 1})
+
+    def test_write_paths_refresh_the_snapshot(self):
+        token = self.book()
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"/api/tokens/{token['id']}/", {'status': 'calling'}, format='json')
+        self.assertEqual(self.client.get(self.url).data[0]['status'], 'calling')
+
+        ServiceStaff.objects.create(user=self.user, service=self.service)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/cancel-all-tokens/', {'service': self.service.id}, format='json')
+        self.book()
+        self.assertEqual(len(self.client.get(self.url).data), 2)
+        self.assertEqual(snapshots.stats()['hits'], 0)
+
+    def test_stale_snapshot_is_never_served(self):
+        self.book()
+        self.client.get(self.url)
+        # a write that skipped invalidation still moves the version on
+        ServiceDayCounter.bump_version(self.service.id, date.today())
+        self.client.get(self.url)
+        self.assertEqual(snapshots.stats(), {'hits': 0, 'misses': 2})
+
+    def test_compact_view(self):
+        token = self.book()
+        compact = self.client.get(f'{self.url}&view=compact').data
+        full = self.client.get(self.url).data
+        self.assertEqual(set(compact[0]), {'id', 'token_number', 'status', 'visitor_name',
+                                           'appointment_date', 'appointment_time'})
+        self.assertEqual(compact, [{field: full[0][field] for field in compact[0]}])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"/api/tokens/{token['id']}/", {'status': 'calling'}, format='json')
+        self.assertEqual(self.client.get(f'{self.url}&view=compact').data[0]['status'], 'calling')
+        delta = self.client.get(f'{self.url}&view=compact&since=1').data
+        self.assertEqual([t['status'] for t in delta['tokens']], ['calling'])
+        self.assertEqual(self.client.get(f'{self.url}&view=wide').status_code, 400)
+
+
+class ListQueryCountTests(APITestCase):
+    """
+    List endpoints must cost the same number of queries whatever their size.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.rows = 0
+
+    def add_rows(self, n):
+        for _ in range(n):
+            self.rows += 1
+            owner = User.objects.create_user(username=f'owner{self.rows}')
+            provider = Provider.objects.create(name=f'Hospital {self.rows}', admin=owner)
+            service = Service.objects.create(name=f'Service {self.rows}', provider=provider)
+            ServiceStaff.objects.create(user=owner, service=service)
+            Token.objects.create(service=service, token_number=1, status='waiting', user=self.user,
+                                 appointment_date=date.today())
+            Token.objects.create(service=self.service, token_number=self.rows, status='waiting',
+                                 appointment_date=date.today())
+            Notification.objects.create(user=self.user, message=f'note {self.rows}')
+
+    def assertConstantQueries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_rows(5)
+        cache.clear()
+        with self.assertNumQueries(len(small)):
+            self.client.get(url)
+
+    def test_list_endpoints(self):
+        self.service = Service.objects.create(name='Busy Service')
+        self.add_rows(1)
+        for url in ['/api/tokens/', '/api/tokens/?user=me', f'/api/tokens-by-service/?service={self.service.id}',
+                    '/api/services/', '/api/providers/', '/api/service-staff/', '/api/notifications/']:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+
+class HistoryPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+
+    def collect(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url, pages = response.data['next'], pages + 1
+            self.assertLess(pages, 50, 'the cursor stopped advancing')
+        return ids, pages
+
+    def test_token_history_follows_cursor(self):
+        tokens = [Token.objects.create(service=self.service, token_number=i, status='waiting', user=self.user,
+                                       appointment_date=date(2030, 1, 1 + i)) for i in range(5)]
+        ids, pages = self.collect('/api/tokens/?user=me&page_size=2')
+        self.assertEqual(ids, [t.id for t in reversed(tokens)])
+        self.assertEqual(pages, 3)
+        with self.settings(API_PAGE_SIZE=4):
+            self.assertEqual(self.collect('/api/tokens/?user=me'), (ids, 2))
+
+    def test_token_filters(self):
+        for i, status_ in enumerate(['waiting', 'completed', 'cancelled']):
+            Token.objects.create(service=self.service, token_number=i, status=status_, user=self.user,
+                                 appointment_date=date(2030, 1, 10 + i))
+        ids, _ = self.collect('/api/tokens/?user=me&status=waiting,completed&date_from=2030-01-11')
+        self.assertEqual(Token.objects.get(id__in=ids).status, 'completed')
+        self.assertEqual(self.client.get('/api/tokens/?date_from=tomorrow').status_code, 400)
+
+    def test_notifications_follow_cursor_and_filter(self):
+        notes = [Notification.objects.create(user=self.user, message=str(i), is_read=i % 2 == 0) for i in range(5)]
+        ids, pages = self.collect('/api/notifications/?page_size=2')
+        self.assertEqual(ids, [n.id for n in reversed(notes)])
+        unread, _ = self.collect(f'/api/notifications/?is_read=false&date_from={date.today()}&date_to={date.today()}')
+        self.assertEqual(unread, [notes[3].id, notes[1].id])
+
+    def test_notifications_sharing_a_timestamp_page_exactly(self):
+        notes = Notification.objects.bulk_create([Notification(user=self.user, message=str(i)) for i in range(7)])
+        Notification.objects.update(timestamp=timezone.now())
+        expected = [n.id for n in reversed(notes)]
+        # ties longer than the offset cutoff are where an offset cursor breaks down
+        with mock.patch.object(views.NotificationCursorPagination, 'offset_cutoff', 2):
+            for size in (2, 3):
+                with self.subTest(page_size=size):
+                    self.assertEqual(self.collect(f'/api/notifications/?page_size={size}')[0], expected)
+            tampered = base64.b64encode(b'p=yesterday|1').decode()
+            self.assertEqual(self.client.get(f'/api/notifications/?cursor={tampered}').status_code, 404)
+            url, ids = '/api/notifications/?page_size=2', []
+            while url:
+                page = self.client.get(url).data
+                url, ids = page['next'], [row['id'] for row in page['results']]
+            back = []
+            url = page['previous']
+            while url and len(back) < len(expected):
+                page = self.client.get(url).data
+                back = [row['id'] for row in page['results']] + back
+                url = page['previous']
+            self.assertEqual(back + ids, expected)
+
+
+class BulkCancelTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.provider = Provider.objects.create(name='Test Hospital', admin=self.user)
+        self.services = [Service.objects.create(name=f'S{i}', provider=self.provider) for i in range(2)]
+        self.other = Service.objects.create(name='Elsewhere')
+
+    def book(self, service, n, status_='waiting'):
+        start = Token.objects.filter(service=service).count()
+        for i in range(n):
+            patient = User.objects.create_user(username=f'p{service.id}-{start + i}')
+            Token.objects.create(service=service, token_number=start + i + 1, status=status_, user=patient,
+                                 appointment_date=date.today())
+
+    def cancel(self, **data):
+        return self.client.post('/api/cancel-all-tokens/', {'remarks': 'closed', **data}, format='json')
+
+    def test_cancels_several_services_and_notifies(self):
+        self.book(self.services[0], 2)
+        self.book(self.services[1], 1)
+        self.book(self.services[1], 1, status_='completed')
+        self.book(self.other, 1)
+        response = self.cancel(service=[s.id for s in self.services])
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(Token.objects.filter(status='cancelled').count(), 3)
+        self.assertEqual(Token.objects.get(service=self.other).status, 'waiting')
+        self.assertFalse(Notification.objects.exists())  # written by one job, off the request path
+        self.assertEqual(jobs.drain(), 1)
+        self.assertEqual(Notification.objects.filter(message__contains='Reason: closed').count(), 3)
+        # delta clients see the cancellations
+        version = ServiceDayCounter.objects.get(service=self.services[0], date=date.today()).version
+        self.assertEqual(set(Token.objects.filter(status='cancelled', service=self.services[0]).values_list('version', flat=True)), {version})
+
+    def test_cancels_whole_provider(self):
+        self.book(self.services[0], 1)
+        self.book(self.services[1], 1)
+        self.assertEqual(self.cancel(provider=self.provider.id).data['count'], 2)
+
+    def test_query_count_does_not_grow_with_tokens(self):
+        self.book(self.services[0], 1)
+        ServiceDayCounter.bump_version(self.services[0].id, date.today())
+        with CaptureQueriesContext(connection) as few:
+            self.cancel(service=self.services[0].id)
+        self.book(self.services[0], 20)
+        with self.assertNumQueries(len(few)):
+            self.cancel(service=self.services[0].id)
+
+    def test_bad_input(self):
+        self.assertEqual(self.cancel().status_code, 400)
+        self.assertEqual(self.cancel(service='abc').status_code, 400)
+
+    def test_unknown_service_is_rejected(self):
+        self.book(self.services[0], 1)
+        response = self.cancel(service=[self.services[0].id, 999999])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Token.objects.get().status, 'waiting')
+        self.assertFalse(ServiceDayCounter.objects.filter(service_id=999999).exists())
+
+    def test_idle_queues_keep_their_version(self):
+        self.book(self.services[0], 1)
+        response = self.cancel(service=[s.id for s in self.services])
+        self.assertEqual(response.data['services'], {self.services[0].id: 1, self.services[1].id: 0})
+        self.assertFalse(ServiceDayCounter.objects.filter(service=self.services[1]).exists())
+
+    def test_only_managers_can_cancel(self):
+        self.book(self.services[0], 1)
+        self.book(self.other, 1)
+        outsider = User.objects.create_user(username='outsider')
+        self.client.force_authenticate(user=outsider)
+        self.assertEqual(self.cancel(provider=self.provider.id).status_code, 403)
+        self.assertEqual(self.cancel(service=self.services[0].id).status_code, 403)
+
+        # staff assigned to a service may cancel that service, not its neighbours or provider
+        ServiceStaff.objects.create(user=outsider, service=self.services[0])
+        self.assertEqual(self.cancel(service=[self.services[0].id, self.other.id]).status_code, 403)
+        self.assertEqual(self.cancel(provider=self.provider.id).status_code, 403)
+        self.assertEqual(set(Token.objects.values_list('status', flat=True)), {'waiting'})
+        self.assertEqual(self.cancel(service=self.services[0].id).data['count'], 1)
+
+        self.client.force_authenticate(user=User.objects.create_user(username='ops', is_staff=True))
+        self.assertEqual(self.cancel(service=self.other.id).data['count'], 1)
+
+
+class CallNextTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+        for i in range(3):
+            patient = User.objects.create_user(username=f'patient{i}')
+            Token.objects.create(service=self.service, token_number=i + 1, status='waiting', user=patient,
+                                 appointment_date=date.today())
+
+    def call_next(self, **data):
+        return self.client.post(f'/api/services/{self.service.id}/call-next/', data, format='json')
+
+    def statuses(self):
+        return list(Token.objects.filter(service=self.service).order_by('token_number').values_list('status', flat=True))
+
+    def test_calls_in_order_and_closes_current(self):
+        first = self.call_next()
+        self.assertEqual([t['token_number'] for t in first.data['tokens']], [1])
+        second = self.call_next(previous='skipped')
+        self.assertEqual({t['token_number']: t['status'] for t in second.data['tokens']}, {1: 'skipped', 2: 'calling'})
+        self.assertEqual(self.statuses(), ['skipped', 'calling', 'waiting'])
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(jobs.drain(), 3)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_empty_queue_closes_current_only(self):
+        for _ in range(4):
+            response = self.call_next()
+        self.assertIsNone(response.data['called'])
+        self.assertEqual([(t['token_number'], t['status']) for t in response.data['tokens']], [(3, 'completed')])
+        self.assertEqual(self.call_next().data['tokens'], [])
+        self.assertEqual(self.statuses(), ['completed'] * 3)
+
+    def test_bad_previous(self):
+        self.assertEqual(self.call_next(previous='waiting').status_code, 400)
+
+
+class CallNextConcurrencyTests(APITransactionTestCase):
+    """
+    Parallel "next" presses on one queue each get a different token and leave
+    exactly one token calling.
+    """
+    databases = '__all__'  # threads may read a configured replica before writing
+
+    def test_parallel_callers(self):
+        user = User.objects.create_user(username='counter')
+        service = Service.objects.create(name='Busy Service')
+        Token.objects.bulk_create([
+            Token(service=service, token_number=i + 1, status='waiting', appointment_date=date.today())
+            for i in range(10)
+        ])
+        callers = 6
+        barrier = threading.Barrier(callers)
+        called, errors = [], []
+
+        def press():
+            # the test client re-raises any thread's request exception, so read
+            # failures from the status code instead
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user=user)
+            barrier.wait()
+            try:
+                for attempt in range(50):
+                    response = client.post(f'/api/services/{service.id}/call-next/', format='json')
+                    if response.status_code != 500:
+                        break
+                    # SQLite reports a locked database instead of waiting
+                    time.sleep(0.01 * (attempt + 1))
+                called.append(response.data['called'])
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=press) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(called)), callers)
+        tokens = Token.objects.filter(service=service)
+        self.assertEqual(tokens.filter(status='calling').count(), 1)
+        self.assertEqual(tokens.filter(status='completed').count(), callers - 1)
+        self.assertEqual(set(tokens.exclude(status='waiting').values_list('id', flat=True)), set(called))
+
+
+class JobQueueTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+        self.token = Token.objects.create(service=self.service, token_number=1, status='waiting', user=self.user,
+                                          appointment_date=date.today())
+
+    def test_status_change_notifies_through_job(self):
+        self.client.patch(f'/api/tokens/{self.token.id}/', {'status': 'calling'}, format='json')
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(Job.objects.get().payload, {'token': self.token.id, 'status': 'calling'})
+
+        self.assertEqual(jobs.drain(), 1)
+        self.assertIn('is now CALLED', Notification.objects.get(user=self.user).message)
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_job_backs_off_then_fails(self):
+        job = jobs.enqueue('explode', {})
+        with mock.patch.dict(jobs.HANDLERS, explode=mock.Mock(side_effect=RuntimeError('boom'))), \
+                self.assertLogs('queue_backend.api.jobs', 'ERROR'):
+            for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+                self.assertEqual(jobs.run_batch(), 1)
+                job.refresh_from_db()
+                self.assertEqual(job.attempts, attempt)
+                self.assertIn('boom', job.last_error)
+                # not due again until its backoff passes
+                self.assertEqual(jobs.run_batch(), 0)
+                Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(jobs.run_batch(), 0)
+
+    def test_abandoned_running_job_is_reclaimed(self):
+        job = jobs.enqueue('noop', {})
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, locked_at=job.created_at - jobs.LEASE * 2)
+        noop = mock.Mock()
+        with mock.patch.dict(jobs.HANDLERS, noop=noop):
+            self.assertEqual(jobs.drain(), 1)
+        noop.assert_called_once_with({})
+
+
+class NotificationCounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+
+    def notify(self, n):
+        deliver(Notification.objects.bulk_create([Notification(user=self.user, message=str(i)) for i in range(n)]))
+
+    def badge(self):
+        return self.client.get('/api/notifications/badge/').data
+
+    def test_badge_follows_every_write_path(self):
+        self.assertEqual(self.badge(), {'unread': 0, 'latest': None})
+        self.notify(3)
+        token = Token.objects.create(service=self.service, token_number=1, status='waiting', user=self.user,
+                                     appointment_date=date.today())
+        ServiceStaff.objects.create(user=self.user, service=self.service)
+        self.client.post('/api/cancel-all-tokens/', {'service': self.service.id, 'remarks': 'closed'}, format='json')
+        jobs.drain()
+        newest = Notification.objects.latest('id')
+        self.assertEqual(self.badge(), {'unread': 4, 'latest': newest.id})
+
+        first, second, third = Notification.objects.order_by('id')[:3]
+        self.client.patch(f'/api/notifications/{first.id}/', {'is_read': True}, format='json')
+        self.client.patch(f'/api/notifications/{first.id}/', {'is_read': True}, format='json')
+        self.client.delete(f'/api/notifications/{second.id}/')
+        self.client.patch(f'/api/notifications/{third.id}/', {'is_read': True}, format='json')
+        self.client.patch(f'/api/notifications/{third.id}/', {'is_read': False}, format='json')
+        self.assertEqual(self.badge()['unread'], 2)
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+        self.client.patch(f'/api/tokens/{token.id}/', {'status': 'calling'}, format='json')
+        jobs.drain()
+        self.assertEqual(self.badge()['unread'], 3)
+        self.client.delete('/api/notifications/clear_all/')
+        self.assertEqual(self.badge()['unread'], 0)
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+    def test_reconcile_repairs_drift(self):
+        self.notify(2)
+        Notification.objects.create(user=self.user, message='behind the counter\'s back')
+        self.assertEqual(NotificationCounter.reconcile(), 1)
+        self.assertEqual(self.badge()['unread'], 3)
+
+
+class NotificationCounterConcurrencyTests(APITransactionTestCase):
+    databases = '__all__'  # threads may read a configured replica before writing
+
+    def test_parallel_writes_match_recount(self):
+        user = User.objects.create_user(username='busy')
+        Notification.objects.bulk_create([Notification(user=user, message=str(i)) for i in range(20)])
+        NotificationCounter.reconcile()
+        to_read = list(Notification.objects.values_list('id', flat=True))
+        errors = []
+
+        def work(i):
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user=user)
+            try:
+                for attempt in range(50):
+                    try:
+                        if i % 2:
+                            with transaction.atomic():
+                                deliver([Notification.objects.create(user=user, message=f'new {i}')])
+                            break
+                        # every reader marks the same rows; each may only count once
+                        responses = [client.patch(f'/api/notifications/{pk}/', {'is_read': True}, format='json')
+                                     for pk in to_read[:10]]
+                        if all(r.status_code == 200 for r in responses):
+                            break
+                    except OperationalError:
+                        pass
+                    # SQLite reports a locked database instead of waiting
+                    time.sleep(0.01 * (attempt + 1))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(NotificationCounter.unread_for(user.id), Notification.objects.filter(is_read=False).count())
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+
+class RetentionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+
+    def age(self, queryset, days, field='timestamp'):
+        queryset.update(**{field: timezone.now() - timedelta(days=days)})
+
+    def retain(self, *args):
+        out = StringIO()
+        call_command('apply_retention', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_notification_policies(self):
+        # (age in days, read) in insertion order, as real timestamps are
+        rows = [(200, False), (40, True), (40, False), (10, True), (0, False), (0, True)]
+        notes = [Notification.objects.create(user=self.user, message=str(i), is_read=read)
+                 for i, (_, read) in enumerate(rows)]
+        deliver(notes)
+        for note, (days, _) in zip(notes, rows):
+            self.age(Notification.objects.filter(pk=note.pk), days)
+
+        self.retain('--read-notifications-days', '30', '--notifications-days', '180', '--auth-tokens-days', '0')
+        self.assertEqual(sorted(Notification.objects.values_list('message', flat=True)), ['2', '3', '4', '5'])
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+    def test_dry_run_reports_batches(self):
+        for i in range(5):
+            Notification.objects.create(user=self.user, message=str(i), is_read=True)
+        self.age(Notification.objects.all(), 40)
+        out = self.retain('--dry-run', '--auth-tokens-days', '0')
+        self.assertEqual(out.count('would delete'), 3)
+        self.assertIn('Notifications: 5 rows in 3 batches', out)
+        self.assertEqual(Notification.objects.count(), 5)
+
+    def test_idle_auth_tokens(self):
+        stale, used, fresh = (AuthToken.objects.create(user=User.objects.create_user(username=name))
+                              for name in ('stale', 'used', 'fresh'))
+        self.age(AuthToken.objects.exclude(pk=fresh.pk), 100, field='created')
+        cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {used.key}')
+        self.client.get('/api/notifications/badge/')
+        self.assertTrue(AuthTokenUsage.objects.filter(key=used.key).exists())
+
+        self.retain('--auth-tokens-days', '90', '--read-notifications-days', '0', '--notifications-days', '0')
+        self.assertEqual(set(AuthToken.objects.values_list('key', flat=True)), {used.key, fresh.key})
+
+    def test_keys_predating_usage_tracking_survive_first_run(self):
+        legacy = AuthToken.objects.create(user=User.objects.create_user(username='legacy'))
+        self.age(AuthToken.objects.all(), 400, field='created')
+        backfill = import_module('queue_backend.api.migrations.0022_backfill_authtokenusage')
+        backfill.mark_existing_keys_used(django_apps, None)
+
+        self.retain('--auth-tokens-days', '90', '--read-notifications-days', '0', '--notifications-days', '0')
+        self.assertTrue(AuthToken.objects.filter(key=legacy.key).exists())
+
+
+class TokenArchiveTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+        today = date.today()
+        # past and current/future days interleaved by id
+        days = [-3, 0, -2, 1, -1, 0]
+        self.tokens = [Token.objects.create(service=self.service, token_number=i + 1, status='completed',
+                                            user=self.user, remarks=f'r{i}', appointment_date=today + timedelta(days=d))
+                       for i, d in enumerate(days)]
+
+    def archive(self, *args):
+        call_command('archive_tokens', '--batch-size', '2', *args, stdout=StringIO())
+
+    def test_rollover_moves_past_days_intact(self):
+        self.archive()
+        self.assertEqual(Token.objects.count(), 3)
+        moved = ArchivedToken.objects.get(pk=self.tokens[2].pk)
+        self.assertEqual((moved.token_number, moved.status, moved.remarks, moved.user_id, moved.issued_at),
+                         (3, 'completed', 'r2', self.user.id, self.tokens[2].issued_at))
+        self.archive('--keep-days', '5')
+        self.assertEqual(ArchivedToken.objects.count(), 3)
+
+    def test_history_reads_both_tables(self):
+        self.archive()
+        ids, url = [], '/api/tokens/?user=me&page_size=2'
+        while url:
+            with self.assertNumQueries(2):  # one range read per table
+                response = self.client.get(url)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [t.id for t in reversed(self.tokens)])
+        self.assertEqual(response.data['results'][-1]['service_name'], 'Test Service')
+
+        back = self.client.get(response.data['previous']).data['results']
+        self.assertEqual([row['id'] for row in back], [self.tokens[3].id, self.tokens[2].id])
+        older = self.client.get(f'/api/tokens/?user=me&date_to={date.today() - timedelta(days=2)}').data['results']
+        self.assertEqual([row['id'] for row in older], [self.tokens[2].id, self.tokens[0].id])
+
+
+class ServiceDayStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.service = Service.objects.create(name='Test Service')
+        cache.clear()
+
+    def book(self, n):
+        return [self.client.post('/api/tokens/', {'service': self.service.id}, format='json').data['id'] for _ in range(n)]
+
+    def row(self):
+        return ServiceDayStats.objects.filter(service=self.service, date=date.today()).values(
+            'issued', 'waiting', 'calling', 'completed', 'skipped', 'cancelled', 'waited', 'served').get()
+
+    def test_incremental_matches_backfill(self):
+        ids = self.book(6)
+        self.client.post(f'/api/services/{self.service.id}/call-next/', format='json')
+        self.client.post(f'/api/services/{self.service.id}/call-next/', {'previous': 'skipped'}, format='json')
+        self.client.post(f'/api/services/{self.service.id}/call-next/', format='json')
+        self.client.patch(f'/api/tokens/{ids[3]}/', {'status': 'calling'}, format='json')
+        self.client.delete(f'/api/tokens/{ids[4]}/')
+        ServiceStaff.objects.create(user=self.user, service=self.service)
+        self.client.post('/api/cancel-all-tokens/', {'service': self.service.id, 'remarks': 'x'}, format='json')
+        live = self.row()
+        self.assertEqual(live, {'issued': 5, 'waiting': 0, 'calling': 2, 'completed': 1, 'skipped': 1,
+                                'cancelled': 1, 'waited': 4, 'served': 1})
+
+        call_command('backfill_service_stats', stdout=StringIO())
+        self.assertEqual(self.row(), live)
+
+    def test_backfill_matches_live_after_recalls_moves_and_deletes(self):
+        ids = self.book(7)
+        call_next = lambda **data: self.client.post(f'/api/services/{self.service.id}/call-next/', data, format='json')
+        status = lambda i, value: self.client.patch(f'/api/tokens/{ids[i]}/', {'status': value}, format='json')
+        call_next()
+        call_next(previous='skipped')
+        status(0, 'calling')            # a skipped patient called back
+        status(0, 'completed')
+        status(1, 'waiting')            # sent back to the queue, then called again
+        call_next()
+        status(2, 'completed')          # completed without being called
+        call_next()
+        self.client.delete(f'/api/tokens/{ids[3]}/')   # deleted after being called
+        self.client.patch(f'/api/tokens/{ids[4]}/', {'appointment_date': str(date.today() + timedelta(days=1))},
+                          format='json')
+        ServiceStaff.objects.create(user=self.user, service=self.service)
+        self.client.post('/api/cancel-all-tokens/', {'service': self.service.id, 'remarks': 'x'}, format='json')
+
+        fields = [f.name for f in ServiceDayStats._meta.concrete_fields if f.name not in ('id', 'service')]
+        rows = lambda: {row.pop('date'): {k: round(v, 3) if isinstance(v, float) else v for k, v in row.items()}
+                        for row in ServiceDayStats.objects.filter(service=self.service).values(*fields)}
+        live = rows()
+        self.assertEqual((live[date.today()]['waited'], live[date.today()]['served']), (2, 2))
+        call_command('backfill_service_stats', stdout=StringIO())
+        self.assertEqual(rows(), live)
+
+    def test_range_endpoint_is_one_read(self):
+        self.book(2)
+        ServiceDayStats.objects.create(service=self.service, date=date.today() - timedelta(days=40), issued=9)
+        with self.assertNumQueries(1):
+            rows = self.client.get('/api/service-stats/').data
+        self.assertEqual([(r['service_name'], r['issued']) for r in rows], [('Test Service', 2)])
+        rows = self.client.get(f'/api/service-stats/?date_from={date.today() - timedelta(days=60)}'
+                               f'&service={self.service.id}').data
+        self.assertEqual([r['issued'] for r in rows], [9, 2])
+
+
+class LoadDataGeneratorTests(APITestCase):
+    def generate(self, prefix, *args):
+        call_command('generate_load_data', '--prefix', prefix, '--providers', '2', '--services-per-provider', '2',
+                     '--users', '5', '--days', '3', '--tokens-per-day', '10', '--chunk-size', '7', *args,
+                     stdout=StringIO())
+        return Token.objects.filter(service__name__startswith=f'{prefix} ').order_by('id')
+
+    def test_seeded_dataset_continues_like_live_data(self):
+        tokens = self.generate('a')
+        self.assertEqual(tokens.count(), 2 * 2 * 3 * 10)
+        today = list(tokens.filter(service__name='a service 0.0', appointment_date=date.today())
+                     .values_list('status', flat=True))
+        self.assertEqual(today[5:], ['calling'] + ['waiting'] * 4)
+        same = self.generate('b').values_list('status', 'user__username', 'called_at')
+        self.assertEqual([(s, u and u[1:]) for s, u, _ in same],
+                         [(s, u and u[1:]) for s, u, _ in tokens.values_list('status', 'user__username', 'called_at')])
+
+        service = Service.objects.get(name='a service 1.1')
+        stats = ServiceDayStats.objects.get(service=service, date=date.today())
+        self.assertEqual((stats.issued, stats.calling, stats.waiting), (10, 1, 4))
+        user = User.objects.get(username='a-user-0')
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/api/tokens/', {'service': service.id}, format='json')
+        self.assertEqual(response.data['token_number'], 11)
+
+
+class EndpointBenchmarkTests(APITestCase):
+    def test_report_and_compare(self):
+        call_command('generate_load_data', '--providers', '1', '--services-per-provider', '1', '--users', '2',
+                     '--days', '1', '--tokens-per-day', '5', stdout=StringIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = f'{tmp}/baseline.json'
+            args = ['bench_endpoints', '--iterations', '3', '--warmup', '1']
+            call_command(*args, '--output', baseline, stdout=StringIO(), stderr=StringIO())
+            with open(baseline) as f:
+                report = json.load(f)
+            self.assertEqual(report['endpoints']['tokens-create']['status'], [201])
+            self.assertEqual(Token.objects.count(), 5)  # writes are rolled back
+            self.assertLessEqual(report['endpoints']['providers']['p50_ms'],
+                                 report['endpoints']['providers']['p99_ms'])
+
+            report['endpoints']['providers']['queries'] -= 1
+            with open(baseline, 'w') as f:
+                json.dump(report, f)
+            err = StringIO()
+            with self.assertRaisesMessage(CommandError, '1 regression(s)'):
+                # a wide tolerance leaves only the query-count regression, whatever the timings
+                call_command(*args, '--only', 'providers', '--compare', baseline, '--tolerance', '1000',
+                             stdout=StringIO(), stderr=err)
+            self.assertIn('providers: queries', err.getvalue())
+
+    def test_token_auth_cache(self):
+        call_command('generate_load_data', '--providers', '1', '--services-per-provider', '1', '--users', '2',
+                     '--days', '1', '--tokens-per-day', '5', stdout=StringIO())
+        out = StringIO()
+        call_command('bench_token_auth', '--iterations', '2', '--warmup', '1', stdout=out)
+        rows = {tuple(line.split()[:2]): line.split()[2:4] for line in out.getvalue().splitlines()[1:-1]}
+        uncached, cached = rows[('notifications-badge', 'uncached')], rows[('notifications-badge', 'cached')]
+        self.assertEqual((uncached[1], cached[1]), ('1', '0'))
+        self.assertEqual(int(uncached[0]) - int(cached[0]), 1)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.tmp = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(METRICS_DIR=self.tmp, METRICS_TOKEN='scrape-secret'))
+        self.service = Service.objects.create(name='Test Service')
+
+    def scrape(self, **headers):
+        response = self.client.get('/api/metrics', **headers)
+        self.assertEqual(response.status_code, 200)
+        return dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                    if not line.startswith('#'))
+
+    def test_per_view_series_summed_across_workers(self):
+        series = ('queue_http_requests_total{view="tokens-by-service",method="GET",status="200"}',
+                  'queue_http_db_queries_count{view="tokens-by-service",method="GET"}')
+        before = self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        for _ in range(3):
+            self.client.get(f'/api/tokens-by-service/?service={self.service.id}')
+        after = self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        for name in series:
+            self.assertEqual(float(after[name]) - float(before.get(name, 0)), 3)
+        self.assertIn('queue_http_request_duration_seconds_bucket{view="tokens-by-service",method="GET",le="+Inf"}',
+                      after)
+
+        # another worker's flushed totals are added in
+        with open(f'{self.tmp}/999999.json', 'w') as f:
+            json.dump([['queue_http_requests_total',
+                        [['view', 'tokens-by-service'], ['method', 'GET'], ['status', '200']], 10]], f)
+        merged = self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(float(merged[series[0]]) - float(after[series[0]]), 10)
+
+    def test_requires_staff_or_scrape_token(self):
+        self.assertIn(self.client.get('/api/metrics').status_code, (401, 403))
+        self.assertIn(self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, (401, 403))
+        self.client.force_authenticate(User.objects.create_user(username='ops', is_staff=True))
+        self.scrape()
+
+
+class RequestProfilingTests(APITestCase):
+    def setUp(self):
+        self.service = Service.objects.create(name='Test Service')
+        self.staff = User.objects.create_user(username='ops', is_staff=True)
+        self.patient = User.objects.create_user(username='patient')
+        self.url = f'/api/tokens-by-service/?service={self.service.id}'
+
+    def key(self, user):
+        return f'Token {AuthToken.objects.create(user=user).key}'
+
+    def test_staff_flag_captures_profile_and_sql(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.key(self.staff), HTTP_X_PROFILE='1')
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.view, profile.status, profile.user), ('tokens-by-service', 200, self.staff))
+        self.assertEqual(profile.query_count, len(profile.queries))
+        self.assertTrue(any('api_servicedaycounter' in q['sql'] for q in profile.queries))
+        self.assertIn('function calls', profile.summary)
+
+        self.client.force_authenticate(self.staff)
+        listed = self.client.get('/api/profiles/').data
+        self.assertEqual([p['id'] for p in listed], [profile.id])
+        self.assertNotIn('queries', listed[0])
+        raw = self.client.get(f'/api/profiles/{profile.id}/pstats/').content
+        self.assertTrue(any(func[2] == 'get' for func in marshal.loads(raw)))
+
+    def test_ignored_without_staff_or_flag(self):
+        for headers in ({'HTTP_AUTHORIZATION': self.key(self.patient), 'HTTP_X_PROFILE': '1'},
+                        {'HTTP_AUTHORIZATION': self.key(self.staff)}):
+            self.assertNotIn('X-Profile-Id', self.client.get(self.url, **headers))
+        self.assertFalse(RequestProfile.objects.exists())
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+
+    def test_keeps_newest(self):
+        key = self.key(self.staff)
+        with self.settings(PROFILE_KEEP=2):
+            ids = [self.client.get(f'{self.url}&_profile=1', HTTP_AUTHORIZATION=key)['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(sorted(RequestProfile.objects.values_list('id', flat=True)), [int(i) for i in ids[1:]])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'builds the replica with the SQLite backup API')
+class ReadReplicaTests(APITransactionTestCase):
+    def setUp(self):
+        self.service = Service.objects.create(name='old')
+        # a frozen copy of the primary stands in for a lagging replica
+        replica = f'{self.enterContext(tempfile.TemporaryDirectory())}/replica.sqlite3'
+        connection.ensure_connection()
+        with sqlite3.connect(replica) as target:
+            connection.connection.backup(target)
+        Service.objects.filter(pk=self.service.pk).update(name='new')
+
+        connections.settings['replica'] = {**connections.settings['default'], 'NAME': replica}
+        self.addCleanup(self.drop_replica)
+        self.enterContext(mock.patch.object(type(self), 'databases', self.databases | {'replica'}))
+        # read the service uncached, so each request goes through the router
+        self.enterContext(self.settings(REPLICA_DATABASES=['replica'], DIRECTORY_CACHE_SECONDS=0,
+                                        DATABASE_ROUTERS=['queue_backend.api.routers.ReplicaRouter']))
+        routers._down.clear()
+        cache.clear()
+        self.url = f'/api/services/{self.service.id}/'
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def name(self, client):
+        return client.get(self.url).data['name']
+
+    def test_reads_replica_until_client_writes(self):
+        self.assertEqual(self.name(self.client), 'old')
+
+        # a key the replica has not seen yet still authenticates
+        key = AuthToken.objects.create(user=User.objects.create_user(username='writer')).key
+        writer = APIClient()
+        writer.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(writer.patch(self.url, {'description': 'edited'}, format='json').status_code, 200)
+        self.assertEqual(self.name(writer), 'new')  # pinned to the primary after its write
+        self.assertEqual(self.name(self.client), 'old')
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        connections.settings['replica']['NAME'] = '/nonexistent/dir/replica.sqlite3'
+        with self.assertLogs('queue_backend.api.routers', 'WARNING'):
+            self.assertEqual(self.name(self.client), 'new')
+        self.assertEqual(self.name(self.client), 'new')  # skipped without retrying
+
+    def test_bookkeeping_writes_do_not_pin(self):
+        # key usage, snapshot counters and the cache itself write on every poll
+        self.enterContext(self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'test_replica_cache'}}))
+        call_command('createcachetable', verbosity=0)
+        self.addCleanup(lambda: connection.cursor().execute('DROP TABLE test_replica_cache'))
+        Token.objects.create(service=self.service, token_number=1, appointment_date=timezone.now().date())
+
+        key = AuthToken.objects.create(user=User.objects.create_user(username='poller')).key
+        poller = APIClient()
+        poller.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        url = f'/api/tokens-by-service/?service={self.service.id}'
+        for _ in range(2):
+            self.assertEqual(poller.get(url).data, [])  # the replica has no tokens yet
+        self.assertTrue(AuthTokenUsage.objects.filter(key=key).exists())
+        identity = hashlib.sha256(f'Token {key}'.encode()).hexdigest()
+        self.assertIsNone(cache.get(routers.pin_key(identity)))
+
+
+class CachedTokenAuthTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        # off by default with the per-process test cache
+        self.enterContext(self.settings(AUTH_TOKEN_CACHE_SECONDS=60))
+        self.user = User.objects.create_user(username='poller', password='testpassword123')
+        self.key = AuthToken.objects.create(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    def poll(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notifications/badge/')
+        return response.status_code, [q['sql'] for q in queries if 'authtoken_token' in q['sql']]
+
+    def test_steady_state_poll_skips_auth_query(self):
+        status_code, auth = self.poll()
+        self.assertEqual((status_code, len(auth)), (200, 1))
+        self.assertEqual(self.poll(), (200, []))
+
+    def test_revoked_on_delete_and_deactivation(self):
+        self.poll()
+        with self.captureOnCommitCallbacks(execute=True):
+            AuthToken.objects.filter(key=self.key).delete()
+        self.assertEqual(self.poll()[0], 401)
+
+        self.key = AuthToken.objects.create(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.poll()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.poll()[0], 401)
+
+    def test_expiry_and_login_rotation(self):
+        AuthToken.objects.filter(key=self.key).update(created=timezone.now() - timedelta(hours=2))
+        with self.settings(AUTH_TOKEN_TTL=3600):
+            self.assertEqual(self.poll()[0], 401)
+            response = self.client.post('/api/login/', {'username': 'poller', 'password': 'testpassword123'},
+                                        format='json')
+            self.assertNotEqual(response.data['token'], self.key)
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {response.data["token"]}')
+            self.assertEqual(self.poll()[0], 200)
+
+
+class LoginThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='patient', password='testpassword123')
+        self.enterContext(self.settings(AUTH_THROTTLE_RATES={'login-ip': '3/min', 'login-username': '2/min'}))
+
+    def login(self, username, password='wrong', ip='10.0.0.1'):
+        return self.client.post('/api/login/', {'username': username, 'password': password},
+                                format='json', REMOTE_ADDR=ip)
+
+    def test_buckets_per_username_and_ip(self):
+        self.assertEqual(self.login('patient').status_code, 400)
+        self.assertEqual(self.login('Patient', ip='10.0.0.2').status_code, 400)
+        response = self.login('patient', 'testpassword123', ip='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        self.assertEqual(self.login('someone').status_code, 400)
+        self.assertEqual(self.login('someone-else').status_code, 400)
+        response = self.login('anyone')  # fourth attempt from 10.0.0.1
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_sheds_logins_when_hash_slots_are_taken(self):
+        self.enterContext(self.settings(PASSWORD_HASH_CONCURRENCY=1, PASSWORD_HASH_WAIT=0))
+        slots = throttles._semaphore(1)
+        slots.acquire()
+        try:
+            response = self.login('patient', 'testpassword123')
+        finally:
+            slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.login('patient', 'testpassword123').status_code, 200)
+
+    def test_register_hashes_outside_the_transaction(self):
+        data = {'username': 'newcomer', 'password': 'testpassword123', 'password2': 'testpassword123',
+                'phone': '9876543210', 'age': 30, 'dob': '1995-01-01'}
+        self.enterContext(self.settings(PASSWORD_HASH_CONCURRENCY=1, PASSWORD_HASH_WAIT=0))
+        slots = throttles._semaphore(1)
+        slots.acquire()
+        try:
+            self.assertEqual(self.client.post('/api/register/', data, format='json').status_code, 503)
+        finally:
+            slots.release()
+        self.assertFalse(User.objects.filter(username='newcomer').exists())
+
+        depth = len(connection.savepoint_ids)
+        hashed_at = []
+        make_password = views.make_password
+        def spy(password):
+            hashed_at.append(len(connection.savepoint_ids))
+            return make_password(password)
+        with mock.patch.object(views, 'make_password', spy):
+            response = self.client.post('/api/register/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(hashed_at, [depth])
+        self.assertTrue(User.objects.get(username='newcomer').check_password('testpassword123'))
+
+
+class DirectoryCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(self.settings(DIRECTORY_CACHE_SECONDS=300))  # off by default with the per-process test cache
+        self.user = User.objects.create_user(username='admin', password='testpassword123')
+        self.provider = Provider.objects.create(name='Test Hospital', admin=self.user)
+        self.service = Service.objects.create(name='Test Service', provider=self.provider)
+
+    def test_steady_state_reads_skip_the_database(self):
+        for url in ['/api/providers/', f'/api/services/?provider={self.provider.id}', f'/api/services/{self.service.id}/']:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('max-age=60', response['Cache-Control'])
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_writes_and_filters_get_fresh_entries(self):
+        url = f'/api/services/?provider={self.provider.id}'
+        self.assertEqual(len(self.client.get(url).data), 1)
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/services/', {'name': 'X-Ray', 'provider': self.provider.id}, format='json')
+        self.assertEqual(len(self.client.get(url).data), 2)
+        self.assertEqual(len(self.client.get('/api/services/?provider=0').data), 0)
+
+        self.assertEqual(self.client.get('/api/services/999999/').status_code, 404)
+        self.assertNotIn('Cache-Control', self.client.get('/api/services/999999/'))
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='patient', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.provider = Provider.objects.create(name='Test Hospital', admin=self.user)
+        self.service = Service.objects.create(name='Test Service', provider=self.provider)
+        Token.objects.create(service=self.service, token_number=1, user=self.user, remarks='private')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, ' '.join(q['sql'] for q in queries if 'api_token' in q['sql'])
+
+    def test_fields_and_omit_drop_columns_and_joins(self):
+        response, sql = self.get('/api/tokens/?fields=id,status,service_name')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'status', 'service_name'])
+        self.assertIn('api_service', sql)
+        self.assertNotIn('api_provider', sql)
+        self.assertNotIn('remarks', sql)
+
+        response, sql = self.get('/api/tokens/?omit=service_name,provider_name,remarks')
+        row = response.data['results'][0]
+        self.assertNotIn('remarks', row)
+        self.assertEqual(row['token_number'], 1)
+        self.assertNotIn('JOIN', sql)
+
+        response, _ = self.get('/api/tokens/')
+        self.assertEqual(response.data['results'][0]['provider_name'], 'Test Hospital')
+
+    def test_expand_nests_the_related_object(self):
+        response, sql = self.get('/api/tokens/?fields=id,service&expand=service')
+        self.assertEqual(response.data['results'][0]['service'],
+                         self.client.get(f'/api/services/{self.service.id}/').data)
+        self.assertIn('api_provider', sql)
+
+        services = self.client.get('/api/services/?fields=id,provider&expand=provider').data
+        self.assertEqual(services[0]['provider']['name'], 'Test Hospital')
+        self.assertEqual(self.client.get('/api/services/?fields=id,name').data, [{'id': self.service.id, 'name': 'Test Service'}])
+
+    def test_writes_keep_the_full_shape(self):
+        response = self.client.post('/api/tokens/?fields=id', {'service': self.service.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('provider_name', response.data)
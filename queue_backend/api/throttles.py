@@ -0,0 +1,110 @@
+# queue_backend/api/throttles.py
+"""
+CPU protection for the password-hashing endpoints (login, register).
+
+Token buckets in the default cache cap attempts per client IP and per
+username (settings.AUTH_THROTTLE_RATES, keyed by the view's throttle_scope),
+answering 429 with Retry-After. Buckets are read and written without a lock,
+so racing requests can overshoot a limit by a few attempts. The limits are
+only global when that cache is shared (settings.CACHE_SHARED); with the
+default per-process locmem cache every worker keeps its own buckets, so a
+client gets up to the rate times the number of workers.
+
+password_hashing() separately caps how many hashes one worker process runs
+at once (PASSWORD_HASH_CONCURRENCY), so a login storm leaves CPU for the
+polling endpoints; requests that find no free slot within PASSWORD_HASH_WAIT
+get 503 with Retry-After.
+"""
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+
+def parse_rate(rate):
+    """``"10/min"`` -> (capacity 10, refilled over 60 seconds)."""
+    count, period = rate.split("/")
+    return int(count), PERIODS[period]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Allows bursts of up to N attempts, refilled continuously at N per period.
+    Subclasses name the bucket through ``kind`` and ``get_ident``.
+    """
+    kind = None
+
+    def allow_request(self, request, view):
+        rate = settings.AUTH_THROTTLE_RATES.get(f"{view.throttle_scope}-{self.kind}")
+        ident = self.get_ident(request)
+        if not rate or not ident:
+            return True
+        capacity, period = parse_rate(rate)
+        refill = capacity / period
+        key = f"throttle:{view.throttle_scope}-{self.kind}:{hashlib.sha256(ident.encode()).hexdigest()[:32]}"
+
+        now = time.time()
+        tokens, stamp = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - stamp) * refill)
+        if tokens < 1:
+            self.retry_after = (1 - tokens) / refill
+            return False
+        cache.set(key, (tokens - 1, now), period)
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPBucketThrottle(TokenBucketThrottle):
+    kind = "ip"
+
+
+class UsernameBucketThrottle(TokenBucketThrottle):
+    kind = "username"
+
+    def get_ident(self, request):
+        username = request.data.get("username") if hasattr(request.data, "get") else None
+        return str(username).strip().lower() if username else None
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many sign-ins in progress, please retry shortly."
+    default_code = "hashing_busy"
+    wait = 1  # sent as Retry-After
+
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def _semaphore(limit):
+    with _slots_lock:
+        if limit not in _slots:
+            _slots[limit] = threading.BoundedSemaphore(limit)
+        return _slots[limit]
+
+
+@contextmanager
+def password_hashing():
+    """Hold one of this process' password-hashing slots, or raise HashingBusy."""
+    limit = settings.PASSWORD_HASH_CONCURRENCY
+    if not limit:
+        yield
+        return
+    slots = _semaphore(limit)
+    if not slots.acquire(timeout=settings.PASSWORD_HASH_WAIT):
+        raise HashingBusy()
+    try:
+        yield
+    finally:
+        slots.release()
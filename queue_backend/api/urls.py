@@ -11,7 +11,11 @@ from .views import (
     StaffViewSet,
     ServiceStaffViewSet,
     CancelAllTokensView,
-    NotificationViewSet
+    NotificationViewSet,
+    EventStreamView,
+    ServiceDayStatsViewSet,
+    MetricsView,
+    RequestProfileViewSet,
 )
 
 router = DefaultRouter()
@@ -21,6 +25,8 @@ router.register(r'tokens', TokenViewSet)
 router.register(r'staff', StaffViewSet)
 router.register(r'service-staff', ServiceStaffViewSet)
 router.register(r'notifications', NotificationViewSet, basename='notifications')
+router.register(r'service-stats', ServiceDayStatsViewSet, basename='service-stats')
+router.register(r'profiles', RequestProfileViewSet, basename='profiles')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -28,4 +34,6 @@ urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('cancel-all-tokens/', CancelAllTokensView.as_view(), name='cancel-all-tokens'),
+    path('events/', EventStreamView.as_view(), name='events'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,11 +1,26 @@
 # queue_backend/api/views.py
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
 from django.db import transaction
+from django.db.models import Q
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.permissions import AllowAny, BasePermission, IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
@@ -13,7 +28,12 @@ from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token as AuthToken
 
 # defensive model & serializer imports
+from . import directory, events, metrics, snapshots, stats
+from .authentication import TokenAuthentication, expired
+from .notifications import deliver, enqueue_cancelled, enqueue_status_change, notifications_changed
 from . import models as _models
+from .throttles import IPBucketThrottle, UsernameBucketThrottle, password_hashing
+from .pagination import MergedQuerySet, NotificationCursorPagination, TokenCursorPagination
 from .serializers import (
     ProviderSerializer,
     ServiceSerializer,
@@ -21,6 +41,11 @@ from .serializers import (
     RegisterSerializer,
     LoginSerializer,
     AuditLogSerializer,
+    ServiceDayStatsSerializer,
+    RequestProfileSerializer,
+    RequestProfileDetailSerializer,
+    compact_tokens,
+    requested_shape,
 )
 
 User = get_user_model()
@@ -39,11 +64,112 @@ AuditLog = getattr(_models, "AuditLog", None)
 if Service is None:
     raise ImportError("Service model not found in queue_backend.api.models. Please ensure `Service` exists.")
 
+ResourceVersion = _models.ResourceVersion
+
+
+# -----------------------
+# Conditional GET (ETag) helpers
+# -----------------------
+# ETags come from change counters bumped by the write paths, so an unchanged
+# poll costs one indexed lookup and a 304 instead of a query + serialization.
+def _query_tag(request):
+    return request.GET.urlencode().replace('"', '')
+
+
+def directory_etag(request, *args, **kwargs):
+    version = directory.version()
+    return f"dir{version}-{kwargs.get('pk', '')}-{_query_tag(request)}"
+
+
+def queue_etag(request, *args, **kwargs):
+    service_id = request.GET.get("service", "")
+    if not service_id.isdigit():
+        return None
+    today = timezone.now().date()
+    version = _models.ServiceDayCounter.objects.filter(service_id=service_id, date=today).values_list(
+        "version", flat=True).first() or 0
+    # service/provider names are part of each row
+    return f"q{today:%Y%m%d}-{version}-dir{directory.version()}-{_query_tag(request)}"
+
+
+def notifications_etag(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+    version = ResourceVersion.current(ResourceVersion.notifications_key(request.user.id))
+    return f"n{request.user.id}-{version}-{kwargs.get('pk', '')}-{_query_tag(request)}"
+
+
+def filter_status(queryset, params):
+    # ?status=waiting,calling
+    statuses = [s for s in params.get("status", "").split(",") if s]
+    return queryset.filter(status__in=statuses) if statuses else queryset
+
+
+def filter_date_window(queryset, params, field, is_datetime=False):
+    """
+    Inclusive ?date_from=/?date_to= (YYYY-MM-DD) window on ``field``. Datetime
+    fields are compared against day boundaries so the column index still applies.
+    """
+    for param in ("date_from", "date_to"):
+        value = params.get(param)
+        if not value:
+            continue
+        day = parse_date(value) if len(value) == 10 else None
+        if day is None:
+            raise ValidationError({param: "Use YYYY-MM-DD."})
+        if param == "date_to":
+            day += timedelta(days=1)
+        bound = timezone.make_aware(datetime.combine(day, time.min)) if is_datetime else day
+        lookup = "gte" if param == "date_from" else "lt"
+        queryset = queryset.filter(**{f"{field}__{lookup}": bound})
+    return queryset
+
+
+class DirectoryVersionMixin:
+    """
+    Serves list/retrieve from the shared directory cache (see directory.py)
+    with a public Cache-Control, and bumps the directory version on every write.
+    """
+    def list(self, request, *args, **kwargs):
+        return self._cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(super().retrieve, request, *args, **kwargs)
+
+    def _cached(self, handler, request, *args, **kwargs):
+        response = None
+
+        def build():
+            nonlocal response
+            response = handler(request, *args, **kwargs)
+            return response.data if response.status_code == 200 else None
+
+        data = directory.get_or_build(self.basename, kwargs.get("pk", ""), _query_tag(request), build)
+        if response is not None:
+            return response
+        return Response(data)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action in ("list", "retrieve") and response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=settings.DIRECTORY_MAX_AGE)
+        return response
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        directory.bump()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        directory.bump()
+
 
 # -----------------------
 # ProviderViewSet
 # -----------------------
-class ProviderViewSet(viewsets.ModelViewSet):
+@method_decorator(condition(etag_func=directory_etag), name="list")
+@method_decorator(condition(etag_func=directory_etag), name="retrieve")
+class ProviderViewSet(DirectoryVersionMixin, viewsets.ModelViewSet):
     """
     CRUD for Providers (Hospitals).
     """
@@ -51,15 +177,21 @@ class ProviderViewSet(viewsets.ModelViewSet):
     serializer_class = ProviderSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        return self.get_serializer().optimize(Provider.objects.all())
+
     def perform_create(self, serializer):
         # Assign current user as admin of the provider
         serializer.save(admin=self.request.user)
+        directory.bump()
 
 
 # -----------------------
 # ServiceViewSet
 # -----------------------
-class ServiceViewSet(viewsets.ModelViewSet):
+@method_decorator(condition(etag_func=directory_etag), name="list")
+@method_decorator(condition(etag_func=directory_etag), name="retrieve")
+class ServiceViewSet(DirectoryVersionMixin, viewsets.ModelViewSet):
     """
     CRUD for services.
     """
@@ -69,7 +201,7 @@ class ServiceViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
-        queryset = Service.objects.all()
+        queryset = self.get_serializer().optimize(Service.objects.all())
         provider_id = self.request.query_params.get('provider')
         if provider_id:
             queryset = queryset.filter(provider_id=provider_id)
@@ -81,19 +213,45 @@ class ServiceViewSet(viewsets.ModelViewSet):
             # Try to find a provider managed by this user
             provider = Provider.objects.filter(admin=self.request.user).first()
             if not provider:
-                from rest_framework.exceptions import ValidationError
                 raise ValidationError({"provider": "No provider found for this user. Please create a provider first."})
             serializer.save(provider=provider)
         else:
             serializer.save()
+        directory.bump()
 
+    @action(detail=True, methods=['post'], url_path='call-next', permission_classes=[IsAuthenticated])
+    def call_next(self, request, pk=None):
+        """
+        POST /api/services/<id>/call-next/ {"previous": "completed" | "skipped"}
+        Closes today's calling token as ``previous`` (default completed) and
+        calls the next waiting one in a single transaction, so two counters
+        pressing "next" together never call the same patient. Returns only
+        the tokens that changed.
+        """
+        previous = request.data.get("previous", "completed")
+        if previous not in ("completed", "skipped"):
+            return Response({"detail": "'previous' must be 'completed' or 'skipped'"}, status=400)
 
-# -----------------------
-# TokenViewSet
-# -----------------------
-from django.utils import timezone
+        service = self.get_object()
+        today = timezone.now().date()
+        with transaction.atomic():
+            version = _models.ServiceDayCounter.bump_version(service.id, today)
+            closed, called, before = QueueToken.call_next(service.id, today, version, previous)
+            changed = closed + ([called] if called else [])
+            stats.transitioned(service.id, today, zip(before, changed))
+
+            for token in changed:
+                # written by the job worker, off the request path
+                enqueue_status_change(token)
+            snapshots.invalidate(service.id, today)
+            events.emit_queue_change(service.id, today, changed)
+            # serialized before commit: a failure after it would leave the
+            # caller unsure whether a patient was called
+            tokens = TokenSerializer.eager(QueueToken.objects.filter(pk__in=[t.pk for t in changed])).order_by("id")
+            data = TokenSerializer(tokens, many=True).data
+
+        return Response({"version": version, "called": called.id if called else None, "tokens": data})
 
-# ... (imports)
 
 # -----------------------
 # TokenViewSet
@@ -101,7 +259,10 @@ from django.utils import timezone
 class TokenViewSet(viewsets.ModelViewSet):
     """
     Create/list/update tokens. Creating a token auto-assigns next token_number.
+    Lists are cursor-paginated newest first, include archived past-day tokens,
+    and accept ?status= and a ?date_from=/?date_to= appointment_date window.
     """
+    pagination_class = TokenCursorPagination
     if QueueToken is None:
         # fallback empty queryset to avoid import errors; will raise runtime errors on use
         queryset = []
@@ -113,11 +274,14 @@ class TokenViewSet(viewsets.ModelViewSet):
 
     permission_classes = [IsAuthenticated]
 
-    def get_queryset(self):
+    def get_queryset(self, model=None):
         if QueueToken is None:
             return []
         
-        queryset = QueueToken.objects.all().order_by("-id")
+        queryset = self.get_serializer().optimize((model or QueueToken).objects.all()).order_by("-id")
+        if self.action == "list":
+            params = self.request.query_params
+            queryset = filter_date_window(filter_status(queryset, params), params, "appointment_date")
         
         # Filter for current user if requested
         if self.request.query_params.get("user") == "me" and self.request.user.is_authenticated:
@@ -125,6 +289,12 @@ class TokenViewSet(viewsets.ModelViewSet):
             
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # history pages run over live and archived (past-day) tokens as one list
+        queryset = MergedQuerySet(self.get_queryset(), self.get_queryset(_models.ArchivedToken))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
     def perform_create(self, serializer):
         """
         Assigns next token_number for the chosen service and attaches request.user.
@@ -135,7 +305,6 @@ class TokenViewSet(viewsets.ModelViewSet):
         user = self.request.user if self.request.user and self.request.user.is_authenticated else None
         service = serializer.validated_data.get("service")
 
-        # find last token number for service TODAY
         today = timezone.now().date()
         
         # appointment_date handling
@@ -143,49 +312,81 @@ class TokenViewSet(viewsets.ModelViewSet):
         if not appt_date:
             appt_date = today
 
-        # find last token for service on the requested date
-        last_token = (
-            QueueToken.objects.filter(service=service, appointment_date=appt_date).order_by("-token_number").first()
-        )
-        # Fallback for legacy data: if no tokens found by date, and date is today, check issued_at?
-        # For now, let's assume we are moving to appointment_date strictly.
-        
-        next_number = last_token.token_number + 1 if last_token else 1
-
-        serializer.save(user=user, token_number=next_number, status="waiting", appointment_date=appt_date)
+        # claim the next number from the per-day counter; the insert shares the
+        # transaction so a failed save hands the number back (no gaps)
+        with transaction.atomic():
+            next_number, version = _models.ServiceDayCounter.issue(service.id, appt_date)
+            token = serializer.save(user=user, token_number=next_number, status="waiting",
+                                    appointment_date=appt_date, version=version)
+            stats.issued(token)
+            snapshots.invalidate(service.id, appt_date)
+            events.emit_queue_change(service.id, appt_date, [token])
 
     def perform_update(self, serializer):
         instance = serializer.instance
         old_status = instance.status
-        updated_token = serializer.save()
-        new_status = updated_token.status
-        
-        if old_status != new_status and updated_token.user:
-            from .models import Notification
-            provider_name = updated_token.service.provider.name if updated_token.service.provider else "Hospital"
-            service_name = updated_token.service.name
-            msg = None
-            
-            if new_status == 'calling':
-                msg = f"📢 ALERT: Token #{updated_token.token_number} is now CALLED at {provider_name} ({service_name}). Please proceed immediately."
-            elif new_status == 'skipped':
-                msg = f"Token #{updated_token.token_number} at {provider_name} ({service_name}) has been marked as SKIPPED."
-            elif new_status == 'cancelled':
-                msg = f"Token #{updated_token.token_number} at {provider_name} ({service_name}) has been CANCELLED."
-            elif new_status == 'completed':
-                msg = f"Token #{updated_token.token_number} at {provider_name} ({service_name}) session marked as COMPLETED."
-            
-            if msg:
-                Notification.objects.create(user=updated_token.user, message=msg)
+        old_queue = (instance.service_id, instance.appointment_date)
+        data = serializer.validated_data
+        service = data.get("service")
+        new_queue = (service.id if service else instance.service_id, data.get("appointment_date", instance.appointment_date))
+
+        with transaction.atomic():
+            if new_queue != old_queue:
+                # the token left its old queue; delta clients there must resync
+                _models.ServiceDayCounter.bump_version(*old_queue, reset=True)
+                snapshots.invalidate(*old_queue)
+            version = _models.ServiceDayCounter.bump_version(*new_queue)
+            # re-read under the queue lock so a racing update is not counted twice
+            before = QueueToken.objects.get(pk=instance.pk)
+            old_status = before.status
+            new_status = data.get("status", old_status)
+            stamps = {}
+            if new_status != old_status:
+                stamps["called_at" if new_status == "calling" else "finished_at"] = timezone.now()
+            updated_token = serializer.save(version=version, **stamps)
+            if new_queue != old_queue:
+                stats.removed(before)
+                stats.issued(updated_token)
+            else:
+                stats.transitioned(*new_queue, [(before, updated_token)])
+            snapshots.invalidate(*new_queue)
+            if old_status != updated_token.status:
+                # the notification is written by the job worker, off the request path
+                enqueue_status_change(updated_token)
+
+        if old_status != updated_token.status:
+            events.emit_queue_change(updated_token.service_id, updated_token.appointment_date, [updated_token])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            _models.ServiceDayCounter.bump_version(instance.service_id, instance.appointment_date, reset=True)
+            stats.removed(QueueToken.objects.get(pk=instance.pk))
+            snapshots.invalidate(instance.service_id, instance.appointment_date)
+            instance.status = "deleted"  # as reported to live subscribers
+            events.emit_queue_change(instance.service_id, instance.appointment_date, [instance])
+            super().perform_destroy(instance)
 
 
 # -----------------------
 # TokensByServiceView
 # -----------------------
+@method_decorator(condition(etag_func=queue_etag), name="get")
 class TokensByServiceView(APIView):
     """
     GET /api/tokens-by-service/?service=<id>
     Returns tokens for a specific service ordered by token_number (or created/issued timestamp).
+
+    GET /api/tokens-by-service/?service=<id>&since=<version>
+    Delta sync: returns {"version", "full", "tokens"} with only the tokens
+    changed after ``since``. ``full`` is true when the client must replace its
+    list instead of merging (first load, a new day, or a deleted token).
+
+    ``?fields=``/``?omit=``/``?expand=`` shape the rows (see SparseFieldsMixin).
+    ``&view=compact`` (either form) returns only what the queue board shows
+    (id, number, status, visitor name, appointment date/time), read with one
+    ``values_list`` query and no serializer.
+
+    Full lists are served from the shared snapshot cache (see snapshots.py).
     """
     permission_classes = [AllowAny]
 
@@ -193,6 +394,16 @@ class TokensByServiceView(APIView):
         service_id = request.query_params.get("service")
         if not service_id:
             return Response({"detail": "Missing 'service' query parameter"}, status=400)
+        if not service_id.isdigit():
+            return Response({"detail": "Invalid 'service' query parameter"}, status=400)
+        service_id = int(service_id)
+
+        since = request.query_params.get("since")
+        if since is not None and not since.isdigit():
+            return Response({"detail": "Invalid 'since' query parameter"}, status=400)
+        view = request.query_params.get("view", "full")
+        if view not in snapshots.VIEWS:
+            return Response({"detail": "Invalid 'view' query parameter"}, status=400)
 
         if QueueToken is None:
             return Response({"detail": "Token model missing"}, status=500)
@@ -200,9 +411,38 @@ class TokensByServiceView(APIView):
         # Filter by TODAY only (based on appointment_date)
         today = timezone.now().date()
         # We look for tokens scheduled for TODAY
-        tokens = QueueToken.objects.filter(service_id=service_id, appointment_date=today).order_by("appointment_time", "token_number")
-        serializer = TokenSerializer(tokens, many=True)
-        return Response(serializer.data)
+        tokens = QueueToken.objects.filter(service_id=service_id, appointment_date=today).order_by(
+            "appointment_time", "token_number")
+        context = {"request": request}
+        if view == "compact":
+            serialize = compact_tokens
+        else:
+            tokens = TokenSerializer(context=context).optimize(tokens)
+            serialize = lambda queryset: TokenSerializer(queryset, many=True, context=context).data
+
+        # read the version before the tokens: anything committed in between
+        # is sent again next time rather than lost
+        state = _models.ServiceDayCounter.objects.filter(service_id=service_id, date=today).values(
+            "version", "reset_version").first() or {"version": 0, "reset_version": 0}
+
+        full = True
+        if since is not None:
+            since = int(since)
+            full = since == 0 or since < state["reset_version"] or since > state["version"]
+
+        if full and view == "full" and requested_shape(request) is not None:
+            data = serialize(tokens)  # shaped rows (?fields= etc.) are not snapshotted
+        elif full:
+            data = snapshots.get_or_build(
+                service_id, today, state["version"], directory.version(),
+                lambda: list(serialize(tokens)), view=view,
+            )
+        else:
+            data = serialize(tokens.filter(version__gt=since))
+
+        if since is None:
+            return Response(data)
+        return Response({"version": state["version"], "full": full, "tokens": data})
 
 
 # -----------------------
@@ -210,8 +450,10 @@ class TokensByServiceView(APIView):
 # -----------------------
 class RegisterView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = []  # a stale or expired key must not block signing up
+    throttle_classes = [IPBucketThrottle, UsernameBucketThrottle]
+    throttle_scope = "register"
 
-    @transaction.atomic
     def post(self, request):
         print(f"Register attempt data: {request.data}")
         serializer = RegisterSerializer(data=request.data)
@@ -219,8 +461,13 @@ class RegisterView(APIView):
             print(f"Register validation errors: {serializer.errors}")
             return Response(serializer.errors, status=400)
 
-        user = serializer.save()
-        token_obj, _ = AuthToken.objects.get_or_create(user=user)
+        # hash before the transaction so waiting on a slot or hashing never
+        # holds a connection inside an open transaction
+        with password_hashing():
+            encoded = make_password(serializer.validated_data["password"])
+        with transaction.atomic():
+            user = serializer.save(encoded_password=encoded)
+            token_obj, _ = AuthToken.objects.get_or_create(user=user)
         print(f"Register success: {user.username}")
         return Response({
             "username": user.username,
@@ -232,6 +479,9 @@ class RegisterView(APIView):
 
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = []  # a stale or expired key must not block logging in again
+    throttle_classes = [IPBucketThrottle, UsernameBucketThrottle]
+    throttle_scope = "login"
 
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
@@ -241,11 +491,16 @@ class LoginView(APIView):
         username = serializer.validated_data.get("username")
         password = serializer.validated_data.get("password")
 
-        user = authenticate(request, username=username, password=password)
+        with password_hashing():
+            user = authenticate(request, username=username, password=password)
         if user is None:
             return Response({"non_field_errors": ["Invalid credentials"]}, status=400)
 
         token_obj, _ = AuthToken.objects.get_or_create(user=user)
+        if expired(token_obj):
+            # one key per user: replace it once AUTH_TOKEN_TTL has passed
+            token_obj.delete()
+            token_obj = AuthToken.objects.create(user=user)
         
         # Check if user is a service staff (provider)
         is_provider = hasattr(user, 'staff_profile')
@@ -286,6 +541,9 @@ class ServiceStaffViewSet(viewsets.ModelViewSet):
     serializer_class = ServiceStaffSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return self.get_serializer().optimize(ServiceStaff.objects.all())
+
     def create(self, request, *args, **kwargs):
         # Custom logic to handle "assign" (update or create)
         user_id = request.data.get('user')
@@ -299,13 +557,14 @@ class ServiceStaffViewSet(viewsets.ModelViewSet):
             user_id=user_id,
             defaults={'service_id': service_id}
         )
-        serializer = self.get_serializer(staff_profile)
+        # reload with user/service/provider joined rather than three lazy loads
+        serializer = self.get_serializer(self.get_queryset().get(pk=staff_profile.pk))
         return Response(serializer.data)
 
     def list(self, request, *args, **kwargs):
         # Support fetching "my" service
         if request.query_params.get('me'):
-            profile = getattr(request.user, 'staff_profile', None)
+            profile = self.get_queryset().filter(user=request.user).first()
             if not profile:
                 return Response({"detail": "Not a staff member"}, status=400)
             serializer = self.get_serializer(profile)
@@ -313,55 +572,273 @@ class ServiceStaffViewSet(viewsets.ModelViewSet):
         return super().list(request, *args, **kwargs)
 
 class CancelAllTokensView(APIView):
+    """
+    POST /api/cancel-all-tokens/ {"service": id | [ids], "provider": id, "remarks": str}
+    Cancels today's waiting tokens for the given services (and/or every service
+    of a provider) and queues one job to notify their users, as one
+    transaction whose query count does not depend on how many tokens are
+    cancelled. Only the provider's admin may cancel by provider; a service
+    may also be cancelled by the staff assigned to it. Site staff may cancel
+    anything.
+    """
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        from .models import Notification, Token as QueueToken # ensuring imports locally
+        from .models import Token as QueueToken # ensuring imports locally
         
-        service_id = request.data.get("service")
+        service_ids = request.data.get("service") or request.data.get("services") or []
+        if not isinstance(service_ids, list):
+            service_ids = [service_ids]
+        provider_id = request.data.get("provider")
         remarks = request.data.get("remarks")
-        
-        if not service_id:
+
+        try:
+            requested = {int(sid) for sid in service_ids}
+            provider_id = int(provider_id) if provider_id else None
+        except (TypeError, ValueError):
+            return Response({"detail": "Service and provider IDs must be integers"}, status=400)
+
+        match = Q(id__in=requested)
+        if provider_id:
+            match |= Q(provider_id=provider_id)
+        admins = dict(Service.objects.filter(match).values_list("id", "provider__admin_id"))
+        service_ids = set(admins)
+        unknown = requested - service_ids
+        if unknown:
+            return Response({"detail": f"Unknown service IDs: {sorted(unknown)}"}, status=404)
+        if not service_ids:
             return Response({"detail": "Service ID required"}, status=400)
-            
+
+        user = request.user
+        if not user.is_staff:
+            if provider_id and not Provider.objects.filter(pk=provider_id, admin=user).exists():
+                return Response({"detail": "Only the provider's admin can cancel all of its tokens"}, status=403)
+            denied = {sid for sid in requested if admins[sid] != user.id}
+            if denied:
+                denied -= set(ServiceStaff.objects.filter(user=user, service_id__in=denied).values_list(
+                    "service_id", flat=True))
+            if denied:
+                return Response({"detail": f"You do not manage service IDs: {sorted(denied)}"}, status=403)
+
         today = timezone.now().date()
+
+        with transaction.atomic():
+            # only queues with waiting tokens change: leave the others' versions,
+            # snapshots and ETags alone
+            busy = sorted(set(QueueToken.objects.filter(
+                service_id__in=service_ids, appointment_date=today, status="waiting",
+            ).values_list("service_id", flat=True).distinct()))
+            # counters first, tokens second: the same lock order as every other write path
+            versions = {sid: _models.ServiceDayCounter.bump_version(sid, today) for sid in busy}
+            cancelled, before = QueueToken.cancel_waiting(versions, today, remarks)
+
+            # one job writes every notification, off the request path
+            enqueue_cancelled(cancelled, remarks)
+
+            per_service = {sid: [] for sid in service_ids}
+            changes = {sid: [] for sid in busy}
+            for was, token in zip(before, cancelled):
+                per_service[token.service_id].append(token)
+                changes[token.service_id].append((was, token))
+            for sid in busy:
+                tokens = per_service[sid]
+                stats.transitioned(sid, today, changes[sid])
+                snapshots.invalidate(sid, today)
+                events.emit_queue_change(sid, today, tokens)
         
-        tokens_to_cancel = QueueToken.objects.filter(
-            service_id=service_id, 
-            appointment_date=today,
-            status='waiting'
-        )
-        
-        count = tokens_to_cancel.count()
-        
-        for token in tokens_to_cancel:
-            if token.user:
-                Notification.objects.create(
-                    user=token.user,
-                    message=f"Your appointment #{token.token_number} has been cancelled. Reason: {remarks}"
-                )
-        
-        tokens_to_cancel.update(status='cancelled', remarks=remarks)
-        
-        return Response({"detail": f"Cancelled {count} tokens", "count": count})
+        count = len(cancelled)
+        return Response({
+            "detail": f"Cancelled {count} tokens",
+            "count": count,
+            "services": {sid: len(tokens) for sid, tokens in per_service.items()},
+        })
+
+class ServiceDayStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    GET /api/service-stats/?date_from=&date_to=[&service=<id>][&provider=<id>]
+    Per service-day totals (see ServiceDayStats), oldest day first. The
+    window defaults to the last 30 days and is read from one index range.
+    """
+    serializer_class = ServiceDayStatsSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        params = self.request.query_params
+        queryset = ServiceDayStatsSerializer.eager(_models.ServiceDayStats.objects.order_by("date", "service_id"))
+        if not params.get("date_from"):
+            queryset = queryset.filter(date__gte=timezone.now().date() - timedelta(days=29))
+        queryset = filter_date_window(queryset, params, "date")
+        for param, field in (("service", "service_id"), ("provider", "service__provider_id")):
+            value = params.get(param)
+            if value:
+                if not value.isdigit():
+                    raise ValidationError({param: "Must be an integer id."})
+                queryset = queryset.filter(**{field: value})
+        return queryset
+
+
+# -----------------------
+# Metrics
+# -----------------------
+class HasMetricsAccess(BasePermission):
+    """Staff users, or a scraper sending ``Authorization: Bearer <METRICS_TOKEN>``."""
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        header = request.headers.get("Authorization", "")
+        return bool(settings.METRICS_TOKEN) and header.startswith("Bearer ") and constant_time_compare(
+            header[len("Bearer "):], settings.METRICS_TOKEN)
+
+
+class MetricsView(APIView):
+    """
+    GET /api/metrics
+    Request counts, latency, DB query and response size metrics per view, for
+    every worker on this host, in the Prometheus text format.
+    """
+    permission_classes = [HasMetricsAccess]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class RequestProfileViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    GET /api/profiles/            captures by ProfilingMiddleware, newest first
+    GET /api/profiles/<id>/       with the cProfile summary and SQL list
+    GET /api/profiles/<id>/pstats/ the raw stats, for `python -m pstats` or snakeviz
+    """
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        queryset = _models.RequestProfile.objects.select_related("user").order_by("-id")
+        if self.action == "list":
+            queryset = queryset.defer("summary", "queries", "stats")
+        return queryset
+
+    def get_serializer_class(self):
+        return RequestProfileSerializer if self.action == "list" else RequestProfileDetailSerializer
+
+    @action(detail=True, methods=["get"])
+    def pstats(self, request, pk=None):
+        profile = self.get_object()
+        response = HttpResponse(bytes(profile.stats), content_type="application/octet-stream")
+        response["Content-Disposition"] = f'attachment; filename="profile-{profile.id}.pstats"'
+        return response
+
 
 from .serializers_notification import NotificationSerializer
 
+@method_decorator(condition(etag_func=notifications_etag), name="list")
+@method_decorator(condition(etag_func=notifications_etag), name="retrieve")
 class NotificationViewSet(viewsets.ModelViewSet):
+    """
+    The current user's notifications, cursor-paginated newest first.
+    Lists accept ?is_read=true|false and a ?date_from=/?date_to= window.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = NotificationSerializer
     serializer_class = NotificationSerializer
+    pagination_class = NotificationCursorPagination
     http_method_names = ['get', 'patch', 'delete', 'head', 'options']
 
     @action(detail=False, methods=['delete'])
     def clear_all(self, request):
-        self.get_queryset().delete()
+        with transaction.atomic():
+            # count the unread rows as they go so a racing insert keeps its +1
+            unread = self.get_queryset().filter(is_read=False).delete()[0]
+            self.get_queryset().delete()
+            notifications_changed(request.user.id, unread={request.user.id: -unread})
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['get'])
+    def badge(self, request):
+        """
+        GET /api/notifications/badge/ -> {"unread": n, "latest": id | null}
+        Poll this and fetch the list only when it changes.
+        """
+        from .models import NotificationCounter
+        latest = self.get_queryset().values_list("id", flat=True).first()
+        return Response({"unread": NotificationCounter.unread_for(request.user.id), "latest": latest})
+
     def get_queryset(self):
         from .models import Notification
-        return Notification.objects.filter(user=self.request.user).order_by('-timestamp')
+        queryset = Notification.objects.filter(user=self.request.user).order_by('-timestamp', '-id')
+        if self.action == "list":
+            queryset = filter_date_window(queryset, self.request.query_params, "timestamp", is_datetime=True)
+            is_read = self.request.query_params.get("is_read")
+            if is_read in ("true", "false"):
+                queryset = queryset.filter(is_read=is_read == "true")
+        return queryset
     
     def perform_create(self, serializer):
         # Users shouldn't create their own notifications via API usually, but if needed:
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            deliver([serializer.save(user=self.request.user)])
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            # lock the row so two concurrent "mark read" calls count it once
+            was_read = type(serializer.instance).objects.select_for_update().values_list(
+                "is_read", flat=True).get(pk=serializer.instance.pk)
+            notification = serializer.save()
+            notifications_changed(self.request.user.id,
+                                  unread={self.request.user.id: int(was_read) - int(notification.is_read)})
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # filtered deletes: only the request that removed an unread row adjusts the count
+            rows = type(instance).objects.filter(pk=instance.pk)
+            unread = rows.filter(is_read=False).delete()[0]
+            rows.delete()
+            notifications_changed(self.request.user.id, unread={self.request.user.id: -unread})
+
+
+# -----------------------
+# Live event stream (SSE)
+# -----------------------
+class EventStreamView(View):
+    """
+    GET /api/events/?service=<id>[&service=<id>...][&token=<auth key>]
+    Server-Sent Events stream of queue changes for the given services and,
+    when authenticated, new notifications for the current user. EventSource
+    cannot set headers, so the auth key may be passed as ?token=.
+    Needs an ASGI server (core/asgi.py); each open stream is a coroutine,
+    not a worker thread.
+    """
+    async def get(self, request):
+        channels = []
+        for service_id in request.GET.getlist("service"):
+            if not service_id.isdigit():
+                return JsonResponse({"detail": "Invalid 'service' query parameter"}, status=400)
+            channels.append(events.service_channel(int(service_id)))
+
+        try:
+            user = await self._authenticate(request)
+        except AuthenticationFailed as exc:
+            return JsonResponse({"detail": exc.detail}, status=401)
+        if user is not None:
+            channels.append(events.user_channel(user.id))
+        if not channels:
+            return JsonResponse({"detail": "Nothing to subscribe to"}, status=400)
+
+        last_event_id = request.headers.get("Last-Event-ID", "")
+        response = StreamingHttpResponse(
+            events.stream(channels, int(last_event_id) if last_event_id.isdigit() else None),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def _authenticate(self, request):
+        # the same checks as the API (expiry, inactive users, replica lag);
+        # raises AuthenticationFailed for a bad key, None when there is none
+        key = request.GET.get("token")
+        header = request.headers.get("Authorization", "")
+        if not key and header.startswith("Token "):
+            key = header[len("Token "):]
+        if not key:
+            return None
+        user, _ = await sync_to_async(TokenAuthentication().authenticate_credentials)(key)
+        return user